@@ -1,5 +1,9 @@
 from django.contrib import admin
-from fleetboss.models import Character, FleetAccess
+from django.core.urlresolvers import reverse
+from django.utils.html import format_html, format_html_join
+from fleetboss.models import Character, FleetAccess, FleetSnapshot, FleetInvite, FleetLayout, \
+    Participation, RequestProfile
+from fleetboss import profiling
 
 
 class CharacterAdmin(admin.ModelAdmin):
@@ -7,8 +11,53 @@ class CharacterAdmin(admin.ModelAdmin):
 
 
 class FleetAccessAdmin(admin.ModelAdmin):
-    list_display = ('id',)
+    list_display = ('id', 'owner', 'last_viewed')
+
+
+class FleetSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('id', 'fleet', 'created')
+
+
+class FleetInviteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'fleet', 'character', 'status', 'attempts', 'updated')
+    list_filter = ('status',)
+
+
+class FleetLayoutAdmin(admin.ModelAdmin):
+    list_display = ('id', 'owner', 'name', 'updated')
+
+
+class ParticipationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'fleet', 'day', 'character_id', 'ship_id', 'seconds', 'polls')
+    list_filter = ('day',)
+
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created', 'user', 'method', 'path', 'status', 'duration',
+                    'queries', 'crest_calls', 'downloads')
+    list_filter = ('status',)
+    list_select_related = ('user',)
+    search_fields = ('path',)
+    exclude = ('stats', 'stacks', 'timeline')
+    readonly_fields = ('user', 'created', 'method', 'path', 'status', 'duration',
+                       'queries', 'crest_calls', 'downloads', 'summary')
+
+    def has_add_permission(self, request):
+        return False
+
+    def downloads(self, obj):
+        return format_html_join(' ', '<a href="{}">{}</a>', (
+            (reverse('profile_download', args=(obj.id, kind)), kind)
+            for kind in ('pstats', 'stacks', 'timeline')))
+
+    def summary(self, obj):
+        return format_html('<pre>{}</pre>', profiling.summary(obj.stats))
 
 
 admin.site.register(Character, CharacterAdmin)
 admin.site.register(FleetAccess, FleetAccessAdmin)
+admin.site.register(FleetSnapshot, FleetSnapshotAdmin)
+admin.site.register(FleetInvite, FleetInviteAdmin)
+admin.site.register(FleetLayout, FleetLayoutAdmin)
+admin.site.register(Participation, ParticipationAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
@@ -0,0 +1,73 @@
+"""
+A circuit breaker for CREST. After a number of failed calls in a short time
+the breaker opens and calls fail right away instead of tying up workers while
+CREST is down. Once the cooldown has passed, a single trial call is let through:
+if it succeeds the breaker closes again, otherwise it stays open for another
+cooldown. The state is kept in the Django cache, so it is shared between
+processes whenever the backend allows it.
+"""
+
+from django.core.cache import cache
+from fleetboss import settings
+
+
+THRESHOLD = getattr(settings, 'CREST_BREAKER_THRESHOLD', 5)
+WINDOW = getattr(settings, 'CREST_BREAKER_WINDOW', 30)
+COOLDOWN = getattr(settings, 'CREST_BREAKER_COOLDOWN', 30)
+
+OPEN = 'fleetboss:breaker:open'
+TRIPPED = 'fleetboss:breaker:tripped'
+TRIAL = 'fleetboss:breaker:trial'
+FAILURES = 'fleetboss:breaker:failures'
+
+
+def allow():
+    """
+    Returns true if a call may be made right now.
+    """
+
+    if cache.get(OPEN) is not None:
+        return False
+
+    if cache.get(TRIPPED) is not None:
+        return cache.add(TRIAL, 1, COOLDOWN)
+
+    return True
+
+
+def tripped():
+    """
+    Returns true if the breaker is open or waiting on a trial call, without
+    being counted as a call itself.
+    """
+
+    return cache.get(TRIPPED) is not None
+
+
+def success():
+    """
+    Records a call which CREST answered properly, closing the breaker if it was
+    waiting on a trial call.
+    """
+
+    if cache.get(TRIPPED) is not None:
+        cache.delete_many([TRIPPED, TRIAL, FAILURES])
+
+
+def failure():
+    """
+    Records a call which failed because of CREST, opening the breaker if there
+    were too many of them or if it was the trial call.
+    """
+
+    cache.add(FAILURES, 0, WINDOW)
+
+    try:
+        failures = cache.incr(FAILURES)
+    except ValueError:
+        failures = 1
+
+    if failures >= THRESHOLD or cache.get(TRIPPED) is not None:
+        cache.set(OPEN, 1, COOLDOWN)
+        cache.set(TRIPPED, 1, None)
+        cache.delete_many([TRIAL, FAILURES])
@@ -0,0 +1,200 @@
+"""
+A small client for the CREST API of EVE Online. All calls made by a process
+go through a single session, so connections to the API server are kept alive
+and reused instead of paying for a new TCP and TLS handshake every time.
+
+Calls are throttled by the rate limiter, retried with jittered exponential
+backoff when CREST asks us to slow down or fails temporarily, bounded by a hard
+deadline and refused outright while the circuit breaker is open.
+"""
+
+import random
+import re
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from fleetboss import settings, ratelimit, breaker, metrics, profiling
+from fleetboss.ratelimit import INTERACTIVE, BACKGROUND
+
+
+BASE_URL = getattr(settings, 'CREST_BASE_URL', 'https://crest-tq.eveonline.com/')
+POOL_SIZE = getattr(settings, 'CREST_POOL_SIZE', 20)
+TIMEOUT = getattr(settings, 'CREST_TIMEOUT', (3.05, 10))
+DEADLINE = getattr(settings, 'CREST_DEADLINE', 15)
+RETRIES = getattr(settings, 'CREST_RETRIES', 3)
+BACKOFF = getattr(settings, 'CREST_BACKOFF', 0.5)
+MAX_BACKOFF = getattr(settings, 'CREST_MAX_BACKOFF', 8)
+
+# Statuses which mean that the same call may well succeed a little later.
+TRANSIENT = (429, 502, 503, 504)
+
+# Methods which have the same effect no matter how often they are repeated.
+IDEMPOTENT = ('GET', 'PUT', 'DELETE')
+
+# IDs in paths, which are left out of the endpoints calls are counted by.
+ID = re.compile(r'\d+')
+
+session = requests.Session()
+session.mount(BASE_URL, HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+
+
+class CrestError(RuntimeError):
+    """
+    Raised when a CREST call could not be completed, either because the server
+    could not be reached or because it answered with an unexpected status.
+    """
+
+    def __init__(self, message, response=None):
+        super(CrestError, self).__init__(message)
+        self.response = response
+
+
+class CrestLimitExceeded(CrestError):
+    """
+    Raised when a CREST call is given up on before CREST itself failed, because
+    it ran out of rate budget or its deadline passed. These do not count
+    against the circuit breaker.
+    """
+
+
+def url(path):
+    """
+    Returns the absolute URL of a path on the CREST server.
+    """
+
+    return BASE_URL + path
+
+
+def request(method, path, token, priority=INTERACTIVE, deadline=DEADLINE, **kwargs):
+    """
+    Perform a single CREST call with the given access token, once the rate
+    limiter allows it. Transient failures are retried, although calls which
+    create something are only retried when CREST refused them outright. No
+    attempt is started after the deadline, in seconds, has passed. Connection
+    errors, timeouts, running out of rate budget and an open circuit breaker
+    are raised as a CrestError, the response is returned as-is otherwise. Only
+    failures of CREST itself, which are connection errors, timeouts and server
+    errors, count towards opening the circuit breaker.
+    """
+
+    if not breaker.allow():
+        raise CrestError("CREST is unavailable, not making any calls for now.")
+
+    try:
+        result = _attempt(method, path, token, priority, deadline, **kwargs)
+    except CrestLimitExceeded:
+        raise
+    except CrestError:
+        breaker.failure()
+        raise
+
+    if result.status_code >= 500:
+        breaker.failure()
+    else:
+        breaker.success()
+
+    return result
+
+
+def _attempt(method, path, token, priority, deadline, **kwargs):
+    headers = kwargs.pop('headers', {})
+    headers['Authorization'] = 'Bearer ' + token
+    timeout = kwargs.pop('timeout', TIMEOUT)
+    safe = method in IDEMPOTENT
+    end = time.time() + deadline
+
+    for attempt in range(RETRIES + 1):
+        if not ratelimit.acquire(token, priority):
+            raise CrestLimitExceeded("CREST call exceeded the rate budget.")
+
+        remaining = end - time.time()
+
+        if remaining <= 0:
+            raise CrestLimitExceeded("CREST call exceeded its deadline.")
+
+        start = time.time()
+
+        try:
+            result = session.request(
+                method, url(path), headers=headers,
+                timeout=_bound(timeout, remaining), **kwargs)
+        except requests.RequestException as e:
+            _measure(method, path, 'error', start)
+
+            if not safe or attempt == RETRIES:
+                raise CrestError("CREST call could not be completed: %s" % e)
+
+            backoff(attempt, remaining=end - time.time())
+            continue
+
+        _measure(method, path, result.status_code, start)
+
+        if result.status_code not in TRANSIENT or attempt == RETRIES:
+            return result
+
+        if not safe and result.status_code != 429:
+            return result
+
+        backoff(attempt, result.headers.get('Retry-After'), end - time.time())
+
+
+def _measure(method, path, status, start):
+    endpoint = ID.sub('<id>', path)
+    metrics.inc('fleetboss_crest_calls_total', method=method, endpoint=endpoint,
+                status=status)
+    metrics.observe('fleetboss_crest_call_seconds', time.time() - start,
+                    method=method, endpoint=endpoint)
+
+    if profiling.active:
+        profiling.crest_call(method, endpoint, status, start)
+
+
+def _bound(timeout, remaining):
+    """
+    Limits a requests timeout, either a number or a pair of connect and read
+    timeouts, to the time remaining before a deadline.
+    """
+
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) for t in timeout)
+
+    return min(timeout, remaining)
+
+
+def backoff(attempt, retry_after=None, remaining=MAX_BACKOFF):
+    """
+    Sleeps before retrying a call, for a random time of up to twice as long as
+    the previous attempt, or for as long as the server asked us to, but never
+    past the remaining time before the deadline of the call.
+    """
+
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** attempt))
+
+    time.sleep(max(0, min(MAX_BACKOFF, delay, remaining)))
+
+
+def get(path, token, **kwargs):
+    """
+    Perform a GET request on the CREST API.
+    """
+
+    return request('GET', path, token, **kwargs)
+
+
+def post(path, token, **kwargs):
+    """
+    Perform a POST request on the CREST API.
+    """
+
+    return request('POST', path, token, **kwargs)
+
+
+def put(path, token, **kwargs):
+    """
+    Perform a PUT request on the CREST API.
+    """
+
+    return request('PUT', path, token, **kwargs)
@@ -0,0 +1,103 @@
+"""
+Differences between two consecutive snapshots of the members of a fleet. A
+delta lists the members who joined or left and, for the members who stayed,
+only the fields which changed: their ship, their solar system, whether they are
+docked and their position in the fleet.
+"""
+
+
+FIELDS = (
+    ('ship', lambda m: m.ship),
+    ('system', lambda m: m.system),
+    ('docked', lambda m: m.docked),
+    ('position', lambda m: [m.wing, m.squad, m.role]),
+    ('boss', lambda m: m.boss),
+)
+
+
+def compact(m):
+    """
+    The fields of a single member which are tracked by deltas, along with the
+    ID and name of the character.
+    """
+
+    res = dict((name, get(m)) for name, get in FIELDS)
+    res['id'] = m.id
+    res['name'] = m.name
+    return res
+
+
+class Delta(object):
+    """
+    The difference between an old and a new list of FleetMember objects.
+    """
+
+    def __init__(self, old, new):
+        old = dict((m.id, m) for m in old)
+        new = dict((m.id, m) for m in new)
+
+        self.joined = [m for i, m in new.items() if i not in old]
+        self.left = [m for i, m in old.items() if i not in new]
+        self.changed = []
+
+        for i, m in new.items():
+            if i not in old:
+                continue
+
+            fields = dict((name, get(m)) for name, get in FIELDS
+                          if get(m) != get(old[i]))
+
+            if fields:
+                self.changed.append((old[i], m, fields))
+
+    def apply(self, stats):
+        """
+        Updates a FleetStats object of the old members so that it describes the
+        new members, and returns the new values of only the counters that have
+        changed, with zero for those which disappeared.
+        """
+
+        before = dict((name, dict(counts))
+                      for name, counts in stats.breakdowns.items())
+        touched = set()
+
+        for m in self.left:
+            touched.update(stats.remove(m))
+
+        for old, _, _ in self.changed:
+            touched.update(stats.remove(old))
+
+        for m in self.joined:
+            touched.update(stats.add(m))
+
+        for _, m, _ in self.changed:
+            touched.update(stats.add(m))
+
+        res = {}
+
+        for name, key in touched:
+            value = stats[name].get(key, 0)
+
+            if value != before[name].get(key, 0):
+                res.setdefault(name, {})[key] = value
+
+        return res
+
+    def as_json(self):
+        """
+        A compact representation of the delta which can be sent to clients.
+        """
+
+        changed = []
+
+        for _, m, fields in self.changed:
+            changed.append(dict(fields, id=m.id))
+
+        return {
+            'joined': [compact(m) for m in self.joined],
+            'left': [m.id for m in self.left],
+            'changed': changed,
+        }
+
+    def __bool__(self):
+        return bool(self.joined or self.left or self.changed)
@@ -0,0 +1,272 @@
+"""
+The history of fleets over the course of an op. Every so often the members of
+a fleet are written to the history, most of the time as a delta against the
+previous entry and now and then as a keyframe with all members, so that a
+long op takes little space and a query never needs more than a single
+keyframe to start from.
+
+Members are stored as rows of IDs, the names of their ships, solar systems and
+characters are interned in a separate table. Series of a breakdown are built
+by applying each delta to the counters of the breakdown, so only the members
+which changed are looked at.
+"""
+
+import json
+import threading
+from datetime import datetime, timedelta
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from fleetboss import settings
+from fleetboss.models import FleetHistory, HistoryName
+from fleetboss.stats import BREAKDOWNS
+
+
+INTERVAL = getattr(settings, 'FLEET_HISTORY_INTERVAL', 30)
+KEYFRAME_INTERVAL = getattr(settings, 'FLEET_HISTORY_KEYFRAME_INTERVAL', 20)
+RETENTION = getattr(settings, 'FLEET_HISTORY_RETENTION', 7 * 24 * 3600)
+
+# The index of the ID in a row, and of the ship, the solar system and whether
+# the member is docked.
+ID, SHIP, SYSTEM, DOCKED = 0, 1, 2, 3
+
+_names = {}
+_names_lock = threading.Lock()
+_names_loaded = threading.Event()
+
+
+class _Member(object):
+    """
+    Just enough of a fleet member to be counted by the breakdowns.
+    """
+
+    __slots__ = ('ship_id', 'ship', 'system', 'docked')
+
+    def __init__(self, row):
+        self.ship_id = row[SHIP]
+        self.ship = _name(HistoryName.SHIP, row[SHIP])
+        self.system = _name(HistoryName.SYSTEM, row[SYSTEM])
+        self.docked = row[DOCKED]
+
+
+def key(fleet_id):
+    """
+    Returns the cache key under which the last recorded members of a fleet are
+    kept.
+    """
+
+    return 'fleetboss:history:%d' % fleet_id
+
+
+def encode(m):
+    """
+    Returns a FleetMember as a row of IDs.
+    """
+
+    return [m.id, m.ship_id, m.system_id, int(m.docked), m.wing, m.squad,
+            m.role, int(m.boss)]
+
+
+def record(fleet_id, fleet):
+    """
+    Adds the current members of a fleet to its history, unless an entry was
+    written less than the interval ago. Returns true if an entry was written.
+    A keyframe is written after a number of deltas, or if this process does
+    not know what the last entry was, for example because another process
+    wrote it.
+    """
+
+    if not cache.add(key(fleet_id) + ':due', 1, INTERVAL):
+        return False
+
+    intern_names(fleet.members)
+    rows = dict((m.id, encode(m)) for m in fleet.members)
+    last = cache.get(key(fleet_id))
+    latest = FleetHistory.objects.filter(fleet_id=fleet_id).order_by(
+        '-id').values_list('id', flat=True).first()
+
+    if last is None or last['id'] != latest or last['deltas'] >= KEYFRAME_INTERVAL:
+        data, deltas = sorted(rows.values()), 0
+    else:
+        data, deltas = _delta(last['rows'], rows), last['deltas'] + 1
+
+        if not data:
+            return False
+
+    entry = FleetHistory.objects.create(
+        fleet_id=fleet_id, time=datetime.now(), keyframe=deltas == 0,
+        data=json.dumps(data, separators=(',', ':')))
+    cache.set(key(fleet_id), {'id': entry.id, 'rows': rows, 'deltas': deltas},
+              RETENTION)
+    return True
+
+
+def prune(fleet_id):
+    """
+    Throws away the entries of a fleet which are past their retention.
+    """
+
+    FleetHistory.objects.filter(
+        fleet_id=fleet_id, time__lt=datetime.now() - timedelta(seconds=RETENTION)
+    ).delete()
+
+
+def series(fleet_id, breakdown, start, end, top=8):
+    """
+    Returns the counters of a breakdown at every entry of the history of a
+    fleet between two points in time, as a list of keys and a list of pairs
+    of time and counts in the order of the keys. Only the keys with the
+    highest peaks are kept, the rest is summed up as "Other". Raises a
+    KeyError if there is no such breakdown.
+    """
+
+    count = dict(BREAKDOWNS)[breakdown]
+    entries = FleetHistory.objects.filter(fleet_id=fleet_id, time__lte=end)
+    keyframe = entries.filter(keyframe=True, time__lte=start).order_by(
+        '-time').values_list('time', flat=True).first()
+
+    if keyframe is None:
+        entries = entries.filter(time__gte=start)
+    else:
+        entries = entries.filter(time__gte=keyframe)
+
+    values = {}
+    counts = {}
+    points = []
+    started = False
+
+    for time, is_keyframe, data in entries.order_by('time', 'id').values_list(
+            'time', 'keyframe', 'data'):
+        data = json.loads(data)
+
+        if is_keyframe:
+            started = True
+            values.clear()
+            counts.clear()
+            updated, left = data, ()
+        elif not started:
+            continue
+        else:
+            updated, left = data['u'], data['l']
+
+        for member in left:
+            _uncount(counts, values.pop(member))
+
+        for row in updated:
+            if row[ID] in values:
+                _uncount(counts, values[row[ID]])
+
+            value = values[row[ID]] = count(_Member(row))
+            counts[value] = counts.get(value, 0) + 1
+
+        if time >= start:
+            points.append((time, dict(counts)))
+
+    peaks = {}
+
+    for _, point in points:
+        for value, n in point.items():
+            peaks[value] = max(peaks.get(value, 0), n)
+
+    keys = sorted(peaks, key=lambda k: (-peaks[k], k))[:top]
+    other = len(peaks) > len(keys)
+
+    return keys + (['Other'] if other else []), [
+        (time, [point.get(k, 0) for k in keys] +
+         ([sum(point.values()) - sum(point.get(k, 0) for k in keys)] if other else []))
+        for time, point in points
+    ]
+
+
+def _delta(old, new):
+    """
+    Returns the members which joined or changed and the IDs of those which
+    left, or None if nothing changed at all.
+    """
+
+    updated = [row for i, row in sorted(new.items()) if old.get(i) != row]
+    left = sorted(i for i in old if i not in new)
+
+    if updated or left:
+        return {'u': updated, 'l': left}
+
+
+def _uncount(counts, value):
+    counts[value] -= 1
+
+    if counts[value] == 0:
+        del counts[value]
+
+
+def intern_names(members):
+    """
+    Makes sure the names of the ships, solar systems and characters of the
+    given members are stored.
+    """
+
+    wanted = {}
+
+    for m in members:
+        wanted[(HistoryName.SHIP, m.ship_id)] = m.ship
+        wanted[(HistoryName.SYSTEM, m.system_id)] = m.system
+        wanted[(HistoryName.CHARACTER, m.id)] = m.name
+
+    missing = dict((k, v) for k, v in wanted.items() if _names.get(k) != v)
+
+    if not missing:
+        return
+
+    renamed = {}
+
+    for kind, code, name in HistoryName.objects.filter(
+            code__in=set(code for _, code in missing)
+    ).values_list('kind', 'code', 'name'):
+        if (kind, code) in missing:
+            if missing.pop((kind, code)) != name:
+                renamed[(kind, code)] = name
+
+        _remember(kind, code, name)
+
+    try:
+        with transaction.atomic():
+            HistoryName.objects.bulk_create([
+                HistoryName(kind=kind, code=code, name=name)
+                for (kind, code), name in missing.items()])
+    except IntegrityError:
+        # Another process stored some of them at the same time.
+        renamed.update(missing)
+
+    for (kind, code), name in renamed.items():
+        HistoryName.objects.update_or_create(
+            kind=kind, code=code, defaults={'name': name})
+
+    for (kind, code), name in wanted.items():
+        _remember(kind, code, name)
+
+
+def _name(kind, code):
+    try:
+        return _names[(kind, code)]
+    except KeyError:
+        pass
+
+    if not _names_loaded.is_set():
+        # There are only so many ships and systems, so load all of them at once
+        # rather than one query per name.
+        for k, c, n in HistoryName.objects.exclude(
+                kind=HistoryName.CHARACTER).values_list('kind', 'code', 'name'):
+            _remember(k, c, n)
+
+        _names_loaded.set()
+
+        if (kind, code) in _names:
+            return _names[(kind, code)]
+
+    name = HistoryName.objects.filter(kind=kind, code=code).values_list(
+        'name', flat=True).first()
+    _remember(kind, code, name or 'Unknown')
+    return _names[(kind, code)]
+
+
+def _remember(kind, code, name):
+    with _names_lock:
+        _names[(kind, code)] = name
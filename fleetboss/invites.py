@@ -0,0 +1,143 @@
+"""
+The dispatcher of fleet invites for link joins. Following a join link merely
+queues an invite, which is sent to CREST by a pool of workers within the rate
+budget of the fleet boss, so that a formup of hundreds of pilots clicking the
+link at once does not tie up the web workers.
+
+Repeated clicks are folded into the invite which is already queued or which
+was sent moments ago, and invites which failed because CREST had trouble are
+retried a few times before giving up.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from fleetboss import settings, crest
+from fleetboss.models import FleetInvite
+
+
+RETRIES = getattr(settings, 'FLEET_INVITE_RETRIES', 3)
+RESEND_AFTER = getattr(settings, 'FLEET_INVITE_RESEND_AFTER', 30)
+PENDING_TIMEOUT = getattr(settings, 'FLEET_INVITE_PENDING_TIMEOUT', 60)
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'FLEET_INVITE_WORKERS', 8))
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(fleet, character):
+    """
+    Queues an invite into a fleet for a character and returns it. If an invite
+    for the character is still pending or was sent only recently, that one is
+    returned instead. Invites which are pending for too long are assumed to
+    have been lost along with the process sending them, and are queued again.
+    """
+
+    invite, created = FleetInvite.objects.get_or_create(
+        fleet=fleet, character=character)
+    # Spares the queries for them when the invite is shown.
+    invite.fleet, invite.character = fleet, character
+
+    if not created:
+        age = datetime.now() - invite.updated
+
+        if invite.status in FleetInvite.PENDING and age < timedelta(seconds=PENDING_TIMEOUT):
+            return invite
+
+        if invite.status == FleetInvite.SENT and age < timedelta(seconds=RESEND_AFTER):
+            return invite
+
+        # Only one of several concurrent clicks gets to queue the invite again.
+        now = datetime.now()
+        queued = FleetInvite.objects.filter(
+            pk=invite.pk, status=invite.status, updated=invite.updated
+        ).update(status=FleetInvite.QUEUED, attempts=0, message='', updated=now)
+
+        if not queued:
+            return FleetInvite.objects.select_related('character').get(pk=invite.pk)
+
+        invite.status, invite.attempts, invite.message, invite.updated = \
+            FleetInvite.QUEUED, 0, '', now
+
+    executor.submit(send, invite.pk)
+    return invite
+
+
+def send(invite_id):
+    """
+    Sends a queued invite to CREST, retrying it if CREST failed to handle it,
+    and records the outcome.
+    """
+
+    try:
+        invite = FleetInvite.objects.select_related(
+            'fleet__owner', 'character').get(pk=invite_id)
+
+        for attempt in range(RETRIES + 1):
+            _update(invite, FleetInvite.SENDING, attempts=attempt + 1)
+            status, message = _post(invite)
+
+            if status is not None:
+                break
+
+            if attempt < RETRIES:
+                crest.backoff(attempt)
+
+        _update(invite, status or FleetInvite.FAILED, message=message)
+    except Exception:
+        logger.exception("Could not dispatch invite %d.", invite_id)
+    finally:
+        connection.close()
+
+
+def _post(invite):
+    """
+    Makes the CREST call for an invite. Returns its new status and a message,
+    where the status is None if the call may well succeed when retried.
+    """
+
+    if invite.fleet.owner is None:
+        return FleetInvite.FAILED, "The fleet has no boss to send the invite."
+
+    try:
+        result = crest.post(
+            'fleets/%d/members/' % invite.fleet_id,
+            invite.fleet.owner.access_token,
+            json={
+                "character": {
+                    "href": crest.url('characters/%d/' % invite.character.character_id)
+                },
+                "role": "squadMember"
+            }
+        )
+    except crest.CrestError as e:
+        return None, str(e)
+
+    if result.status_code == 201:
+        return FleetInvite.SENT, ''
+
+    if result.status_code in crest.TRANSIENT or result.status_code >= 500:
+        return None, "CREST returned status %d." % result.status_code
+
+    try:
+        key = result.json()['key']
+    except (ValueError, KeyError, TypeError):
+        key = None
+
+    if key == 'FleetCandidateOffline':
+        return FleetInvite.OFFLINE, ''
+
+    return FleetInvite.FAILED, "CREST refused the invite (%s)." % (
+        key or result.status_code)
+
+
+def _update(invite, status, **fields):
+    invite.status = status
+    invite.updated = datetime.now()
+
+    for name, value in fields.items():
+        setattr(invite, name, value)
+
+    invite.save(update_fields=['status', 'updated'] + list(fields))
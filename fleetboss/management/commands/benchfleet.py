@@ -0,0 +1,140 @@
+import json
+import platform
+import time
+from datetime import datetime
+import django
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from fleetboss.models import Fleet, FleetAccess
+from fleetboss.synthetic import crest_fleet
+from fleetboss.views import script_json
+
+
+PROPERTIES = ('composition_class', 'composition_category', 'composition_size',
+              'location_system', 'location_docked', 'warnings', 'member_names',
+              'squad_count', 'member_count')
+
+
+class Command(BaseCommand):
+    help = ('Times the steps of building and showing fleets of several sizes '
+            'from synthetic CREST payloads, optionally saving the results or '
+            'comparing them with saved ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,50,100,256',
+                            help='Comma-separated numbers of members.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of runs of which the best is kept.')
+        parser.add_argument('--time', type=float, default=0.2,
+                            help='Minimum number of seconds per run.')
+        parser.add_argument('--output', help='Path to save the results to.')
+        parser.add_argument('--compare', help='Path of saved results to '
+                                              'compare with.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(s) for s in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('Sizes must be numbers separated by commas.')
+
+        baseline = {}
+
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['results']
+            except (IOError, OSError, ValueError, KeyError) as e:
+                raise CommandError('Could not read saved results: %s' % e)
+
+        results = {}
+
+        for size in sizes:
+            for name, func in self.steps(size):
+                best = self.measure(func, options['repeat'], options['time'])
+                key = '%d/%s' % (size, name)
+                results[key] = best
+                self.report(key, best, baseline.get(key))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created': datetime.now().isoformat(),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'results': results,
+                }, f, indent=1, sort_keys=True)
+
+    def steps(self, size):
+        """
+        Returns the steps to time for a fleet of the given size, as pairs of
+        name and function.
+        """
+
+        payloads = crest_fleet(size, seed=size)
+        snapshot = Fleet.snapshot_from_crest(*payloads)
+        fleet = Fleet(0, snapshot=snapshot)
+        request = RequestFactory().get('/fleet/0/')
+        request.user = AnonymousUser()
+        context = {
+            'fleet': fleet, 'token': FleetAccess(id=0), 'owner': False,
+            'refresh': 10,
+        }
+
+        def render():
+            context['data'] = script_json(fleet.as_json())
+            return render_to_string('fleetboss/fleet.html', context, request)
+
+        steps = [
+            ('parse', lambda: Fleet.snapshot_from_crest(*payloads)),
+            ('init', lambda: Fleet(0, snapshot=snapshot)),
+        ]
+        steps += [(name, lambda name=name: getattr(fleet, name)) for name in PROPERTIES]
+        steps += [
+            ('as_json', fleet.as_json),
+            ('render', render),
+        ]
+
+        return steps
+
+    def measure(self, func, repeat, minimum):
+        """
+        Returns the best time of a single call in microseconds, out of several
+        runs which each call the function as often as fits in the minimum time.
+        """
+
+        number = 1
+
+        while True:
+            start = time.perf_counter()
+
+            for _ in range(number):
+                func()
+
+            elapsed = time.perf_counter() - start
+
+            if elapsed >= minimum:
+                break
+
+            number *= 10 if elapsed < minimum / 10 else 2
+
+        best = elapsed / number
+
+        for _ in range(repeat - 1):
+            start = time.perf_counter()
+
+            for _ in range(number):
+                func()
+
+            best = min(best, (time.perf_counter() - start) / number)
+
+        return best * 1e6
+
+    def report(self, key, value, old):
+        line = '%-28s %12.2f us' % (key, value)
+
+        if old:
+            line += '  (was %.2f us, %+.1f%%)' % (old, 100.0 * (value - old) / old)
+
+        self.stdout.write(line)
@@ -0,0 +1,268 @@
+"""
+Compares the memory used by fleets in the compact representation against the
+one they had before, in which a fleet kept the raw CREST payloads alive next to
+plain FleetMember, Squad and Wing objects. The classes of that representation
+are copied below as they were, leaving out only the fetching from CREST, which
+the fleets measured here do not do.
+"""
+
+import gc
+import json
+import tracemalloc
+from django.core.management.base import BaseCommand
+from fleetboss import models, ships
+from fleetboss.synthetic import crest_fleet
+
+
+def ship_class(p):
+    return p['ship']['name']
+
+
+def ship_category(p):
+    return ships.CATEGORIES.get(ship_class(p), 'Unknown')
+
+
+def ship_size(p):
+    return ships.SIZES.get(ship_category(p), 'Unknown')
+
+
+def solar_system(p):
+    return p['solarSystem']['name']
+
+
+def docking_status(p):
+    return 'Docked' if 'station' in p else 'Undocked'
+
+
+BREAKDOWNS = (
+    ('composition_class', ship_class),
+    ('composition_category', ship_category),
+    ('composition_size', ship_size),
+    ('location_system', solar_system),
+    ('location_docked', docking_status),
+)
+
+
+class FleetStats(object):
+    """
+    The counters of every breakdown in BREAKDOWNS for a set of fleet members,
+    along with the names of the members and the name of the fleet boss.
+    """
+
+    def __init__(self, members=()):
+        self.breakdowns = dict((name, {}) for name, _ in BREAKDOWNS)
+        self.member_names = set()
+        self.member_count = 0
+        self.boss = None
+
+        for p in members:
+            self.add(p)
+
+    def add(self, p):
+        """
+        Counts a single member, given as returned by CREST. Returns the
+        counters which were changed as pairs of breakdown and key.
+        """
+
+        touched = []
+
+        for name, key in BREAKDOWNS:
+            counts = self.breakdowns[name]
+            value = key(p)
+            counts[value] = counts.get(value, 0) + 1
+            touched.append((name, value))
+
+        self.member_names.add(p['character']['name'])
+        self.member_count += 1
+
+        if self.boss is None and '(Boss)' in p['roleName']:
+            self.boss = p['character']['name']
+
+        return touched
+
+    def remove(self, p):
+        """
+        Stops counting a member which was previously added, so that the stats
+        can be kept up to date without another pass over all members.
+        """
+
+        touched = []
+
+        for name, key in BREAKDOWNS:
+            counts = self.breakdowns[name]
+            value = key(p)
+            counts[value] -= 1
+            touched.append((name, value))
+
+            if counts[value] == 0:
+                del counts[value]
+
+        self.member_names.discard(p['character']['name'])
+        self.member_count -= 1
+
+        if self.boss == p['character']['name']:
+            self.boss = None
+
+        return touched
+
+    def __getitem__(self, name):
+        return self.breakdowns[name]
+
+
+class FleetMember(object):
+    """
+    Simple data-only class that respresents a single capsuleer.
+    """
+
+    def __init__(self, name, id, **_):
+        self.name = name
+        self.id = id
+
+
+class Squad(object):
+    """
+    A squad in a fleet which has a name, a commander and up to 10 members.
+    """
+
+    def __init__(self, id, name, **_):
+        self.id = id
+        self.commander = None
+        self.members = []
+        self.name = name
+
+    def add_member(self, character):
+        """
+        Adds a single member to the fleet.
+        """
+
+        self.members.append(character)
+
+    def __iter__(self):
+        return self.members.__iter__()
+
+    def __len__(self):
+        return len(self.members)
+
+
+class Wing(object):
+    """
+    A single wing in a fleet which can contain in turn five squads as well as a
+    commander.
+    """
+
+    def __init__(self, id, name, squadsList, **_):
+        self.id = id
+        self.commander = None
+        self.squads = {}
+        self.name = name
+
+        for squad in squadsList:
+            self.squads[squad['id']] = Squad(**squad)
+
+    def add_member(self, squad_id, character, commander=False):
+        """
+        Add a member to the wing which is in turn passed to the squad.
+        """
+
+        if commander:
+            self.squads[squad_id].commander = character
+        else:
+            self.squads[squad_id].add_member(character)
+
+    @property
+    def member_count(self):
+        """
+        Returns the number of members in the squads of this wing.
+        """
+
+        return sum(len(squad) for squad in self)
+
+    def __len__(self):
+        return len(self.squads)
+
+    def __iter__(self):
+        return self.squads.values().__iter__()
+
+
+class Fleet(object):
+    """
+    An entire fleet. Contains up to five wings, a commander as well as an API
+    key provided by a used which is used to get information.
+    """
+
+    def __init__(self, fleet_id, owner=None, concurrent=True, snapshot=None):
+        self.id = fleet_id
+        self.owner = owner
+        self.commander = None
+        self.version = None
+        self.__wings = {}
+
+        if snapshot is not None:
+            self.version = snapshot.get('version')
+            self.__dict__['_overview'] = snapshot['overview']
+            self.__dict__['_members'] = snapshot['members']
+            self.__dict__['_wings'] = snapshot['wings']
+
+        for wing in self._wings:
+            self.__wings[wing['id']] = Wing(**wing)
+
+        self.stats = FleetStats()
+
+        for p in self._members:
+            self.stats.add(p)
+            member = FleetMember(**p['character'])
+
+            if p['wingID'] < 0:
+                self.commander = member
+                continue
+
+            if p['squadID'] < 0:
+                self.__wings[p['wingID']].commander = member
+            else:
+                self.__wings[p['wingID']].add_member(p['squadID'], member, p['roleID'] == 3)
+
+
+class Command(BaseCommand):
+    help = ('Compares the memory used by many fleet snapshots in the compact '
+            'representation against the previous one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=256,
+                            help='Number of members in every fleet.')
+        parser.add_argument('--count', type=int, default=200,
+                            help='Number of snapshots held in memory.')
+
+    def handle(self, *args, **options):
+        overview, wings, members = [
+            json.dumps(x) for x in crest_fleet(options['size'], seed=0)]
+
+        def legacy():
+            # Snapshots used to be the payloads as CREST returned them.
+            return Fleet(0, snapshot={
+                'overview': json.loads(overview),
+                'wings': json.loads(wings)['items'],
+                'members': json.loads(members)['items']})
+
+        # Snapshots are now in the compact format, as stored and cached.
+        snapshot = json.dumps(models.Fleet.snapshot_from_crest(
+            json.loads(overview), json.loads(wings), json.loads(members)))
+
+        def compact():
+            return models.Fleet(0, snapshot=json.loads(snapshot))
+
+        results = {}
+
+        for name, build in (('legacy', legacy), ('compact', compact)):
+            gc.collect()
+            tracemalloc.start()
+            held = [build() for _ in range(options['count'])]
+            results[name] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del held
+
+        for name, used in sorted(results.items()):
+            self.stdout.write('%-8s %10.1f KiB total, %7.1f KiB per fleet' % (
+                name, used / 1024.0, used / 1024.0 / options['count']))
+
+        self.stdout.write('compact uses %.1f%% of the memory of legacy' % (
+            100.0 * results['compact'] / results['legacy']))
@@ -0,0 +1,67 @@
+import csv
+import pickle
+from django.core.management.base import BaseCommand, CommandError
+from fleetboss import ships
+
+
+SHIP_CATEGORY_ID = 6
+
+
+class Command(BaseCommand):
+    help = ('Builds the index used to classify ships by type ID from the '
+            'invTypes and invGroups tables of the static data export, as CSV.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('types', help='Path to invTypes.csv.')
+        parser.add_argument('groups', help='Path to invGroups.csv.')
+        parser.add_argument('--output', default=ships.INDEX_PATH,
+                            help='Path to write the index to.')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['groups']) as f:
+                groups = dict(
+                    (int(row['groupID']), row['groupName'])
+                    for row in csv.DictReader(f)
+                    if int(row['categoryID']) == SHIP_CATEGORY_ID)
+
+            with open(options['types']) as f:
+                types = dict(
+                    (int(row['typeID']), groups[int(row['groupID'])])
+                    for row in csv.DictReader(f)
+                    if int(row['groupID']) in groups)
+        except (IOError, OSError, KeyError, ValueError) as e:
+            raise CommandError('Could not read the static data export: %s' % e)
+
+        if not types:
+            raise CommandError('The static data export contains no ships.')
+
+        # Code zero is reserved for types which are not ships.
+        categories = ['Unknown'] + sorted(set(
+            ships.GROUPS.get(group, group) for group in types.values()))
+        sizes = ['Unknown'] + sorted(set(
+            ships.SIZES.get(c, 'Unknown') for c in categories) - {'Unknown'})
+
+        if len(categories) > 256 or len(sizes) > 256:
+            raise CommandError('Too many categories to fit in a byte.')
+
+        category_codes = dict((c, i) for i, c in enumerate(categories))
+        size_codes = dict((s, i) for i, s in enumerate(sizes))
+        codes = bytearray(max(types) + 1)
+
+        for type_id, group in types.items():
+            codes[type_id] = category_codes[ships.GROUPS.get(group, group)]
+
+        index = {
+            'categories': tuple(categories),
+            'sizes': tuple(sizes),
+            'category_sizes': bytes(bytearray(
+                size_codes[ships.SIZES.get(c, 'Unknown')] for c in categories)),
+            'types': bytes(codes),
+        }
+
+        with open(options['output'], 'wb') as f:
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+
+        self.stdout.write('Indexed %d ship types in %d categories.' % (
+            len(types), len(categories) - 1))
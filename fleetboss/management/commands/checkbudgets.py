@@ -0,0 +1,170 @@
+from datetime import datetime, timedelta
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import resolve
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils.http import urlencode
+from social.apps.django_app.default.models import UserSocialAuth
+from fleetboss import querybudget, querylog, snapshots, tokens
+from fleetboss.models import Character, Fleet, FleetAccess, FleetInvite, FleetSnapshot
+from fleetboss.standin import token
+from fleetboss.synthetic import FIRST_CHARACTER, crest_fleet
+
+
+ROLES = ('boss', 'viewer', 'member', 'outsider')
+
+
+class Command(BaseCommand):
+    help = ('Requests the fleet views as the boss, a viewer, a member and an '
+            'outsider of a synthetic fleet and checks the database queries of '
+            'every request against the budget of its view, reporting '
+            'duplicate and repeated queries as well. Snapshots are not cached '
+            'beforehand, so that the budgets cover reading them from the '
+            'database. Everything is rolled back afterwards. Fails if any view '
+            'exceeds its budget, so that it can run along with the tests.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fleet', type=int, default=1,
+                            help='ID of the synthetic fleet, which must not '
+                                 'exist yet.')
+        parser.add_argument('--size', type=int, default=50,
+                            help='Number of members of the fleet.')
+
+    def handle(self, *args, **options):
+        fleet_id = options['fleet']
+
+        if FleetAccess.objects.filter(id=fleet_id).exists():
+            raise CommandError('Fleet %d exists already, choose another one '
+                               'with --fleet.' % fleet_id)
+
+        users, over = {}, 0
+
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+                users, version = self.set_up(fleet_id, options['size'])
+                over = self.check_views(fleet_id, users, version, options['verbosity'])
+                transaction.set_rollback(True)
+        finally:
+            # The IDs of the characters are handed out again after the
+            # rollback, so none of their tokens may be left behind.
+            cache.delete(snapshots.key(fleet_id))
+            cache.delete_many([tokens.key(u.pk) for u in users.values()])
+
+        if over:
+            raise CommandError('%d of the requests exceeded the query budgets of '
+                               'their views.' % over)
+
+    def set_up(self, fleet_id, size):
+        """
+        Creates the characters, the fleet with the member among its pilots, a
+        fresh snapshot of it and a recent invite of the member, so that joining
+        does not send one. Returns the characters by role and the version of
+        the snapshot.
+        """
+
+        expires = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        users = {}
+
+        for i, role in enumerate(ROLES):
+            # Below the IDs of the synthetic pilots, which may have logged in
+            # already. The member is in the fleet by the name of its first pilot.
+            character_id = FIRST_CHARACTER - 1 - i
+            users[role] = Character.objects.create(
+                username='checkbudgets-%s' % role, first_name='Pilot',
+                last_name='0' if role == 'member' else role.capitalize())
+            UserSocialAuth.objects.create(
+                user=users[role], provider='eveonline', uid=str(character_id),
+                extra_data={'id': character_id, 'access_token': token(character_id),
+                            'expires': expires})
+
+        obj = FleetAccess.objects.create(
+            id=fleet_id, owner=users['boss'], fleet_access=True, link_join=True)
+        obj.access.add(users['viewer'])
+        snapshot = FleetSnapshot.record(
+            fleet_id, Fleet.snapshot_from_crest(*crest_fleet(size, seed=fleet_id)))
+        FleetInvite.objects.create(
+            fleet=obj, character=users['member'], status=FleetInvite.SENT)
+
+        return users, snapshot['version']
+
+    def requests(self, fleet_id, users, version):
+        """
+        Returns the requests to check, as tuples of role, method, path and
+        data.
+        """
+
+        path = '/fleet/%d/' % fleet_id
+        viewer = str(users['outsider'].social_auth.get().uid)
+
+        return [
+            ('boss', 'get', path, None),
+            ('viewer', 'get', path, None),
+            ('member', 'get', path, None),
+            ('outsider', 'get', path, None),
+            ('member', 'get', path + 'api/', None),
+            ('member', 'get', path + 'api/', {'since': version}),
+            ('viewer', 'get', path + 'stream/', None),
+            ('boss', 'get', path + 'history/', None),
+            ('member', 'get', path + 'delta/', {'since': version}),
+            ('member', 'get', path + 'join/%s/' % FleetAccess.objects.get(id=fleet_id).secret, None),
+            ('member', 'get', path + 'invites/', None),
+            ('boss', 'get', path + 'invites/', None),
+            ('boss', 'post', path + 'settings/', {'allow_fleet': 'true'}),
+            ('boss', 'post', path + 'settings/', {'add_viewer': viewer}),
+            ('boss', 'post', path + 'settings/', {'remove_viewer': viewer}),
+            ('boss', 'post', path + 'layouts/', {'name': 'Budget'}),
+            ('boss', 'get', path + 'layouts/', None),
+        ]
+
+    def check_views(self, fleet_id, users, version, verbosity):
+        """
+        Makes the requests and reports the queries of each. Returns the number
+        of requests which exceeded their budget.
+        """
+
+        clients = {}
+
+        for role, user in users.items():
+            clients[role] = Client()
+            clients[role].force_login(user)
+
+        over = 0
+
+        for role, method, path, data in self.requests(fleet_id, users, version):
+            # Every request reads the snapshot from the database and notes
+            # that the fleet is being viewed, as the first one in a while does.
+            cache.delete(snapshots.key(fleet_id))
+            FleetAccess.objects.filter(id=fleet_id).update(last_viewed=None)
+            budget = getattr(resolve(path).func, 'query_budget', None)
+
+            with querylog.recording() as queries:
+                try:
+                    response = getattr(clients[role], method)(path, data or {})
+                    status = response.status_code
+                except querybudget.QueryBudgetExceeded:
+                    status = 'strict'
+
+            duplicates, repeated = querybudget.analyze(queries)
+            exceeded = budget is not None and len(queries) > budget
+            over += exceeded
+
+            if data and method == 'get':
+                path += '?' + urlencode(data)
+
+            self.stdout.write('%-4s %-45s %-8s %s %2d queries, budget %s%s' % (
+                method.upper(), path, role, status, len(queries), budget,
+                ' EXCEEDED' if exceeded else ''))
+
+            for n, sql in duplicates:
+                self.stdout.write('    duplicated %d times: %s' % (n, sql))
+
+            for n, sql in repeated:
+                self.stdout.write('    repeated %d times: %s' % (n, sql))
+
+            if verbosity > 1 or exceeded:
+                for sql, params in queries:
+                    self.stdout.write('    %s %r' % (sql, params))
+
+        return over
@@ -0,0 +1,33 @@
+import json
+from django.core.management.base import BaseCommand
+from fleetboss.synthetic import crest_fleet
+
+
+class Command(BaseCommand):
+    help = ('Writes the CREST overview, wings and members payloads of a '
+            'synthetic fleet as a single JSON document.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=256,
+                            help='Number of members in the fleet.')
+        parser.add_argument('--wings', type=int, default=5,
+                            help='Number of wings in the fleet.')
+        parser.add_argument('--squads', type=int, default=5,
+                            help='Number of squads in every wing.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the generator, the same seed always '
+                                 'gives the same fleet.')
+        parser.add_argument('--output', help='Path to write the fixture to '
+                                             'instead of standard output.')
+
+    def handle(self, *args, **options):
+        overview, wings, members = crest_fleet(
+            options['size'], options['wings'], options['squads'], options['seed'])
+        data = json.dumps(
+            {'overview': overview, 'wings': wings, 'members': members}, indent=1)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
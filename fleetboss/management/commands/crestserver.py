@@ -0,0 +1,78 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from fleetboss import standin
+
+
+class Command(BaseCommand):
+    help = ('Runs a local stand-in for the CREST API, serving synthetic or '
+            'recorded fleets with optional latency and failures. Point '
+            'CREST_BASE_URL at it to use it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--fixture', help='Serve this fixture, as written '
+                                              'by crestfixture, for every fleet.')
+        parser.add_argument('--size', type=int, default=256,
+                            help='Number of members in synthetic fleets.')
+        parser.add_argument('--record', metavar='SESSION',
+                            help='Pass calls on to the live API and record them '
+                                 'to this file.')
+        parser.add_argument('--upstream', default='https://crest-tq.eveonline.com/',
+                            help='The API to pass calls on to when recording.')
+        parser.add_argument('--replay', metavar='SESSION',
+                            help='Serve the calls recorded in this file.')
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Milliseconds to wait before every response.')
+        parser.add_argument('--jitter', type=float, default=0,
+                            help='Milliseconds by which the latency varies.')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Fraction of calls answered with a 503.')
+        parser.add_argument('--throttle-rate', type=float, default=0,
+                            help='Fraction of calls answered with a 429.')
+        parser.add_argument('--retry-after', type=int, default=1,
+                            help='Seconds to send along with a 429.')
+        parser.add_argument('--offline-rate', type=float, default=0,
+                            help='Fraction of invites refused because the '
+                                 'character is offline.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the injected faults and invites.')
+
+    def handle(self, *args, **options):
+        if options['record'] and options['replay']:
+            raise CommandError('Cannot record and replay at the same time.')
+
+        try:
+            if options['record']:
+                source = standin.Recorder(options['upstream'], options['record'])
+            elif options['replay']:
+                source = standin.Replay(options['replay'])
+            else:
+                fixture = None
+
+                if options['fixture']:
+                    with open(options['fixture']) as f:
+                        fixture = json.load(f)
+
+                source = standin.Synthetic(fixture, options['size'],
+                                           options['offline_rate'], options['seed'])
+        except (IOError, OSError, ValueError) as e:
+            raise CommandError('Could not load the session or fixture: %s' % e)
+
+        faults = standin.Faults(
+            options['latency'], options['jitter'], options['error_rate'],
+            options['throttle_rate'], options['retry_after'], options['seed'])
+        server = standin.serve(source, faults, options['host'], options['port'])
+
+        self.stdout.write(
+            "Serving CREST at http://%(host)s:%(port)d/, set "
+            "CREST_BASE_URL = 'http://%(host)s:%(port)d/' to use it." % options)
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write('Answered calls by status: %s' % json.dumps(
+                server.calls, sort_keys=True))
@@ -0,0 +1,275 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from social.apps.django_app.default.models import UserSocialAuth
+from fleetboss import settings
+from fleetboss.models import Character, FleetAccess
+from fleetboss.standin import token
+from fleetboss.synthetic import pilot
+
+
+USERNAME_PREFIX = 'loadtest-'
+ACTIONS = ('view', 'join', 'settings')
+PERCENTILES = (50, 95, 99)
+
+
+class Command(BaseCommand):
+    help = ('Simulates a formup against a running instance of the app: logs '
+            'in synthetic characters which view the fleet, join it by link '
+            'while the boss changes its settings, at increasing numbers of '
+            'concurrent users. Reports latency percentiles, throughput, error '
+            'rate and the calls made to the CREST stand-in for every stage. '
+            'The app must share its database with this command and use the '
+            'stand-in started with crestserver as CREST_BASE_URL.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/',
+                            help='Root URL of the app under test.')
+        parser.add_argument('--crest', help='Root URL of the CREST stand-in, to '
+                                            'count the calls made to it.')
+        parser.add_argument('--fleet', type=int, default=1,
+                            help='ID of the fleet to form up in.')
+        parser.add_argument('--pilots', type=int, default=300,
+                            help='Number of synthetic characters to log in.')
+        parser.add_argument('--concurrency', default='10,50,100,200',
+                            help='Comma-separated numbers of concurrent users, '
+                                 'one stage each.')
+        parser.add_argument('--duration', type=float, default=30,
+                            help='Number of seconds every stage runs.')
+        parser.add_argument('--mix', default='view=8,join=2,settings=1',
+                            help='Relative weights of the actions.')
+        parser.add_argument('--think', type=float, default=0,
+                            help='Milliseconds users wait between requests.')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Seconds after which a request fails.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the choices of the users.')
+        parser.add_argument('--output', help='Path to save the results to.')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete the synthetic characters and exit.')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            count, _ = Character.objects.filter(
+                username__startswith=USERNAME_PREFIX).delete()
+            self.stdout.write('Deleted %d objects.' % count)
+            return
+
+        try:
+            stages = [int(c) for c in options['concurrency'].split(',')]
+            mix = dict((a, float(w)) for a, w in (
+                pair.split('=') for pair in options['mix'].split(',')))
+        except ValueError:
+            raise CommandError('Concurrency must be numbers separated by commas, '
+                               'the mix pairs of action and weight.')
+
+        if set(mix) - set(ACTIONS):
+            raise CommandError('Actions must be one of %s.' % ', '.join(ACTIONS))
+
+        if options['pilots'] < 1:
+            raise CommandError('At least one pilot is needed.')
+
+        self.url = options['url'].rstrip('/') + '/'
+        self.timeout = options['timeout']
+        cookies = self.log_in(options['pilots'])
+        obj, _ = FleetAccess.objects.update_or_create(
+            id=options['fleet'], defaults={
+                'owner': Character.objects.get(username=USERNAME_PREFIX + '0'),
+                'fleet_access': True, 'link_join': True})
+        self.paths = {
+            'view': 'fleet/%d/' % obj.id,
+            'join': 'fleet/%d/join/%s/' % (obj.id, obj.secret),
+            'settings': 'fleet/%d/settings/' % obj.id,
+        }
+        self.stdout.write('Logged in %d pilots, fleet %d is owned by %s.' % (
+            len(cookies), obj.id, obj.owner.get_full_name()))
+
+        results = []
+
+        for users in stages:
+            before = self.upstream(options['crest'])
+            stage = self.run(users, cookies, mix, options['duration'],
+                             options['think'], options['seed'])
+            after = self.upstream(options['crest'])
+
+            if before is not None and after is not None:
+                stage['upstream'] = dict(
+                    (k, after[k] - before.get(k, 0)) for k in after
+                    if after[k] != before.get(k, 0))
+
+            results.append(stage)
+            self.report(stage)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created': datetime.now().isoformat(),
+                    'url': self.url,
+                    'fleet': obj.id,
+                    'pilots': len(cookies),
+                    'stages': results,
+                }, f, indent=1, sort_keys=True)
+
+    def log_in(self, count):
+        """
+        Creates the synthetic characters, each with a synthetic access token
+        which never expires, and logs them in. Returns their session cookies, the boss
+        first.
+        """
+
+        expires = (datetime.now() + timedelta(days=3650)).strftime('%Y-%m-%dT%H:%M:%S')
+        cookie = getattr(settings, 'SESSION_COOKIE_NAME', 'sessionid')
+        cookies = []
+
+        for i in range(count):
+            character = pilot(i)
+            first, last = character['name'].split(' ', 1)
+            user, _ = Character.objects.get_or_create(
+                username=USERNAME_PREFIX + str(i),
+                defaults={'first_name': first, 'last_name': last})
+            UserSocialAuth.objects.update_or_create(
+                user=user, provider='eveonline', defaults={
+                    'uid': str(character['id']),
+                    'extra_data': {'id': character['id'],
+                                   'access_token': token(character['id']),
+                                   'expires': expires}})
+            # A client of its own for every pilot, as logging in another user
+            # on the same client throws away the previous session.
+            client = Client()
+            client.force_login(user)
+            cookies.append(client.cookies[cookie].value)
+
+        self.cookie = cookie
+        return cookies
+
+    def upstream(self, crest):
+        """
+        Returns the number of calls the CREST stand-in answered so far, by
+        endpoint, or None if it is not known.
+        """
+
+        if not crest:
+            return None
+
+        try:
+            return requests.get(crest.rstrip('/') + '/_calls/', timeout=5).json()['endpoints']
+        except (requests.RequestException, ValueError, KeyError):
+            self.stderr.write('Could not read the calls of the CREST stand-in.')
+
+    def run(self, users, cookies, mix, duration, think, seed):
+        """
+        Runs a stage of the given number of concurrent users, each of which
+        makes requests as a randomly chosen pilot until the time is up. The boss
+        changes the settings, the other pilots view and join the fleet.
+        """
+
+        samples = dict((a, []) for a in mix)
+        errors = dict((a, 0) for a in mix)
+        lock = threading.Lock()
+        actions = sorted(mix)
+        weights = [mix[a] for a in actions]
+        end = time.time() + duration
+
+        def user(number):
+            rng = random.Random('%d:%d:%d' % (seed, users, number))
+            http = requests.Session()
+
+            while time.time() < end:
+                action = rng.choices(actions, weights)[0]
+                who = 0 if action == 'settings' else rng.randrange(len(cookies))
+                latency, ok = self.request(http, action, cookies[who])
+
+                with lock:
+                    samples[action].append(latency)
+                    errors[action] += not ok
+
+                if think:
+                    time.sleep(rng.uniform(0, 2 * think) / 1000.0)
+
+        threads = [threading.Thread(target=user, args=(n,)) for n in range(users)]
+        start = time.time()
+
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        elapsed = time.time() - start
+        stage = {'users': users, 'seconds': round(elapsed, 2), 'actions': {}}
+
+        for action in actions + ['total']:
+            if action == 'total':
+                latencies = sorted(l for a in actions for l in samples[a])
+                failed = sum(errors.values())
+            else:
+                latencies = sorted(samples[action])
+                failed = errors[action]
+
+            stage['actions'][action] = summarize(latencies, failed, elapsed)
+
+        return stage
+
+    def request(self, http, action, session):
+        """
+        Makes a single request of an action, returning its latency in
+        milliseconds and whether it succeeded. Redirects count as failures, as
+        the app redirects to the home page when it cannot show a fleet.
+        """
+
+        http.cookies.clear()
+        http.cookies.set(self.cookie, session)
+        url = self.url + self.paths[action]
+        start = time.time()
+
+        try:
+            if action == 'settings':
+                response = http.post(url, data={'link_join': 'true'},
+                                     timeout=self.timeout, allow_redirects=False)
+            else:
+                response = http.get(url, timeout=self.timeout, allow_redirects=False)
+
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+
+        return (time.time() - start) * 1000, ok
+
+    def report(self, stage):
+        self.stdout.write('\n%d users, %.1f seconds' % (stage['users'], stage['seconds']))
+        self.stdout.write('  %-10s %8s %8s %8s %8s %8s %8s %8s' % (
+            'action', 'requests', 'req/s', 'errors', 'p50', 'p95', 'p99', 'max'))
+
+        for action, s in sorted(stage['actions'].items(), key=lambda a: a[0] == 'total'):
+            self.stdout.write('  %-10s %8d %8.1f %7.1f%% %6.0fms %6.0fms %6.0fms %6.0fms' % (
+                action, s['requests'], s['throughput'], s['error_rate'] * 100,
+                s['p50'], s['p95'], s['p99'], s['max']))
+
+        for endpoint, count in sorted(stage.get('upstream', {}).items()):
+            self.stdout.write('  upstream %-40s %8d' % (endpoint, count))
+
+
+def summarize(latencies, failed, elapsed):
+    """
+    Returns the number of requests, throughput, error rate and latency
+    percentiles of sorted latencies.
+    """
+
+    res = {
+        'requests': len(latencies),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'error_rate': round(failed / float(len(latencies)), 4) if latencies else 0,
+        'max': round(latencies[-1], 1) if latencies else 0,
+    }
+
+    for p in PERCENTILES:
+        # The nearest rank, which is always one of the measured latencies.
+        index = max(0, -(-len(latencies) * p // 100) - 1)
+        res['p%d' % p] = round(latencies[index], 1) if latencies else 0
+
+    return res
@@ -0,0 +1,75 @@
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connection
+from fleetboss import settings, crest, snapshots, tokenpool, history, participation
+from fleetboss.models import Fleet, FleetAccess, FleetSnapshot
+
+
+class Command(BaseCommand):
+    help = ('Keeps the snapshots of recently viewed fleets up to date by '
+            'polling CREST on a fixed interval.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            default=getattr(settings, 'FLEET_POLL_INTERVAL', 5),
+            help='Number of seconds between two polls of the same fleet.')
+        parser.add_argument(
+            '--workers', type=int,
+            default=getattr(settings, 'FLEET_POLL_WORKERS', 8),
+            help='Number of fleets which are polled at the same time.')
+        parser.add_argument(
+            '--active', type=int,
+            default=getattr(settings, 'FLEET_POLL_ACTIVE', 600),
+            help='Only poll fleets viewed in the last this many seconds.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Poll every active fleet a single time and exit.')
+
+    def handle(self, *args, **options):
+        self.retention = timedelta(
+            seconds=getattr(settings, 'FLEET_SNAPSHOT_RETENTION', 600))
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                start = time.time()
+                since = datetime.now() - timedelta(seconds=options['active'])
+                fleets = list(FleetAccess.objects.filter(
+                    last_viewed__gte=since, owner__isnull=False
+                ).select_related('owner'))
+
+                for _ in pool.map(self.poll, fleets):
+                    pass
+
+                if options['once']:
+                    break
+
+                time.sleep(max(0, options['interval'] - (time.time() - start)))
+
+    def poll(self, obj):
+        """
+        Takes a single snapshot of a fleet, stores it along with its history,
+        credits its members for participating and throws away snapshots and
+        history which are past their retention. The tokens of the owner and of all
+        members of the fleet who logged in are used in turns.
+        """
+
+        try:
+            last = FleetSnapshot.latest(obj.id)
+            members = Fleet(obj.id, snapshot=last.snapshot).members if last else ()
+            fleet, _ = tokenpool.fetch(
+                obj.id, [obj.owner], members, crest.BACKGROUND)
+            snapshot = FleetSnapshot.record(obj.id, fleet.snapshot)
+            FleetSnapshot.objects.filter(
+                fleet=obj, created__lt=datetime.now() - self.retention
+            ).delete()
+            snapshots.put(obj.id, snapshot)
+            history.record(obj.id, fleet)
+            participation.record(obj.id, fleet)
+            history.prune(obj.id)
+        except Exception as e:
+            self.stderr.write('Could not poll fleet %d: %s' % (obj.id, e))
+        finally:
+            connection.close()
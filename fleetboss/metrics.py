@@ -0,0 +1,320 @@
+"""
+Counters and histograms of the hot paths of the app: CREST calls, refreshes of
+access tokens, requests and their database queries, template rendering and
+lookups in caches. They are exported in the Prometheus text format at
+/metrics.
+
+Recording a value only adds to a dict of this process. A background thread
+of every process adds the values recorded since its last flush to counters in
+the shared cache every few seconds, off the path of requests, so the export
+covers all worker processes whenever the configured cache backend is shared
+between them and increments atomically, as memcached does. Should the cache
+drop a counter, Prometheus sees it as a counter reset.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from django.core.cache import caches
+from django.db import connection
+from fleetboss import settings
+
+
+CACHE = getattr(settings, 'METRICS_CACHE', 'default')
+FLUSH_INTERVAL = getattr(settings, 'METRICS_FLUSH_INTERVAL', 10)
+INDEX_KEY = 'fleetboss:metrics:index'
+LOCK_TIMEOUT = 5
+
+# Sums of histograms are kept as integers in millionths, as the cache can only
+# add to integers.
+SCALE = 1000000
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES = (1, 2, 5, 10, 20, 50, 100)
+
+# The type, help text and, for histograms, buckets of every metric.
+METRICS = {
+    'fleetboss_crest_calls_total': (
+        'counter', 'CREST calls by method, endpoint and status.', None),
+    'fleetboss_crest_call_seconds': (
+        'histogram', 'Latency of CREST calls by method and endpoint.', SECONDS),
+    'fleetboss_token_refreshes_total': (
+        'counter', 'Refreshes of access tokens by outcome.', None),
+    'fleetboss_token_refresh_seconds': (
+        'histogram', 'Latency of refreshes of access tokens.', SECONDS),
+    'fleetboss_requests_total': (
+        'counter', 'Requests by view and status.', None),
+    'fleetboss_request_seconds': (
+        'histogram', 'Latency of requests by view.', SECONDS),
+    'fleetboss_request_queries': (
+        'histogram', 'Database queries made by requests, by view.', QUERIES),
+    'fleetboss_template_render_seconds': (
+        'histogram', 'Time spent rendering templates.', SECONDS),
+    'fleetboss_cache_lookups_total': (
+        'counter', 'Lookups in caches by cache and result.', None),
+    'fleetboss_query_budget_overruns_total': (
+        'counter', 'Requests which made more queries than their budget, by view.', None),
+    'fleetboss_wasted_queries_total': (
+        'counter', 'Duplicate and repeated queries by view and kind.', None),
+}
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_pending = {}
+_series = {}
+_known = set()
+_unregistered = {}
+_flusher = None
+
+logger = logging.getLogger(__name__)
+
+
+def inc(name, value=1, **labels):
+    """
+    Adds to a counter.
+    """
+
+    series = _names(name, labels)[0]
+
+    with _lock:
+        _pending[series] = _pending.get(series, 0) + value
+
+    _start_flusher()
+
+
+def observe(name, value, **labels):
+    """
+    Adds a value to a histogram.
+    """
+
+    series = _names(name, labels)
+    buckets = METRICS[name][2]
+
+    first = bisect_left(buckets, value)
+
+    with _lock:
+        # Buckets count every value up to their bound, so a value counts
+        # towards its own bucket and all larger ones, up to +Inf. The smaller
+        # ones are added to as well, so that every bucket is exported.
+        for i, s in enumerate(series[:len(buckets) + 1]):
+            _pending[s] = _pending.get(s, 0) + (i >= first)
+
+        _pending[series[-2]] = _pending.get(series[-2], 0) + int(value * SCALE)
+        _pending[series[-1]] = _pending.get(series[-1], 0) + 1
+
+    _start_flusher()
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Adds the time spent in the block to a histogram.
+    """
+
+    start = time.time()
+
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, **labels)
+
+
+def flush():
+    """
+    Adds the values recorded by this process since the last flush to the
+    counters in the shared cache.
+    """
+
+    global _pending
+
+    with _lock:
+        pending, _pending = _pending, {}
+
+    store = caches[CACHE]
+
+    with _flush_lock:
+        if _known and store.get(INDEX_KEY) is None:
+            # The index was dropped from the cache, so register all series
+            # again.
+            _known.clear()
+
+        for series, value in pending.items():
+            k = key(series)
+
+            if series not in _known:
+                _unregistered[k] = series
+
+            try:
+                store.incr(k, value)
+            except ValueError:
+                if not store.add(k, value, None):
+                    store.incr(k, value)
+
+        if _unregistered:
+            _register(store)
+
+
+def export():
+    """
+    Returns the counters of all processes in the Prometheus text format.
+    """
+
+    flush()
+    store = caches[CACHE]
+    index = store.get(INDEX_KEY) or {}
+    values = store.get_many(list(index))
+    families = {}
+
+    for k, value in values.items():
+        series = index[k]
+        families.setdefault(_family(series), []).append((series, value))
+
+    lines = []
+
+    for name in sorted(families):
+        kind, text = METRICS[name][:2]
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s %s' % (name, kind))
+
+        for series, value in sorted(families[name], key=lambda s: _order(s[0])):
+            if series.split('{', 1)[0].endswith('_sum'):
+                value = '%.6f' % (value / float(SCALE))
+
+            lines.append('%s %s' % (series, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def key(series):
+    """
+    Returns the cache key under which a series is counted.
+    """
+
+    return 'fleetboss:metrics:' + hashlib.md5(series.encode('utf-8')).hexdigest()
+
+
+def _names(name, labels):
+    """
+    Returns the names of the series a metric with the given labels consists
+    of: a single one for counters, and the buckets followed by the sum and the
+    count for histograms.
+    """
+
+    k = (name, tuple(sorted(labels.items())))
+
+    try:
+        return _series[k]
+    except KeyError:
+        pass
+
+    kind, _, buckets = METRICS[name]
+    text = ','.join('%s="%s"' % (l, _escape(v)) for l, v in k[1])
+
+    if kind == 'counter':
+        names = [_format(name, text)]
+    else:
+        prefix = text + ',' if text else ''
+        names = [_format(name + '_bucket', '%sle="%s"' % (prefix, b))
+                 for b in [repr(b) for b in buckets] + ['+Inf']]
+        names += [_format(name + '_sum', text), _format(name + '_count', text)]
+
+    with _lock:
+        _series[k] = names
+
+    return names
+
+
+def _format(name, labels):
+    return '%s{%s}' % (name, labels) if labels else name
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _family(series):
+    name = series.split('{', 1)[0]
+
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+
+    return name
+
+
+def _order(series):
+    """
+    Sorts the series of a family by their labels, with the buckets of a
+    histogram in the order of their bounds.
+    """
+
+    name, _, labels = series.partition('{')
+    labels, _, bound = labels.rstrip('}').partition('le="')
+
+    if bound:
+        return labels.rstrip(','), name, float(bound.rstrip('"'))
+
+    return labels, name, 0
+
+
+def _register(store):
+    """
+    Adds the series this process counted for the first time to the index of
+    all series. Gives up quickly if another process holds the lock on the
+    index, in which case the next flush tries again.
+    """
+
+    lock = INDEX_KEY + ':lock'
+
+    for _ in range(10):
+        if store.add(lock, 1, LOCK_TIMEOUT):
+            break
+
+        time.sleep(0.01)
+    else:
+        return
+
+    try:
+        index = store.get(INDEX_KEY) or {}
+        index.update(_unregistered)
+        store.set(INDEX_KEY, index, None)
+        _known.update(_unregistered.values())
+        _unregistered.clear()
+    finally:
+        store.delete(lock)
+
+
+def _start_flusher():
+    """
+    Starts the thread which flushes the values recorded by this process,
+    unless it runs already. A process forked from one which had started it
+    starts its own.
+    """
+
+    global _flusher
+
+    if _flusher is not None and _flusher[0] == os.getpid():
+        return
+
+    with _lock:
+        if _flusher is None or _flusher[0] != os.getpid():
+            thread = threading.Thread(target=_flush_regularly, name='metrics-flusher', daemon=True)
+            _flusher = os.getpid(), thread
+            thread.start()
+
+
+def _flush_regularly():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+
+        try:
+            flush()
+        except Exception:
+            logger.exception("Could not flush the metrics.")
+        finally:
+            # The cache may be kept in the database.
+            connection.close()
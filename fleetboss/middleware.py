@@ -0,0 +1,136 @@
+import json
+import logging
+import threading
+import time
+from fleetboss import settings, metrics, profiling, querybudget, querylog
+from fleetboss.models import RequestProfile
+
+
+PROFILES_KEPT = getattr(settings, 'PROFILING_KEEP', 200)
+
+_profiling = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware(object):
+    """
+    Counts requests by view and status, and records how long they took and how
+    many database queries they made. Queries are counted by the query log, so
+    only the queries made in the thread of the request count.
+    """
+
+    def process_request(self, request):
+        request._metrics = {
+            'start': time.time(),
+            'view': 'unresolved',
+            'queries': querylog.start(),
+        }
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_metrics'):
+            request._metrics['view'] = '%s.%s' % (view_func.__module__, view_func.__name__)
+
+    def process_response(self, request, response):
+        state = getattr(request, '_metrics', None)
+
+        if state is None:
+            return response
+
+        querylog.stop(state['queries'])
+        queries = len(state['queries'])
+        view = state['view']
+
+        metrics.inc('fleetboss_requests_total', view=view, status=response.status_code)
+        metrics.observe('fleetboss_request_seconds', time.time() - state['start'], view=view)
+        metrics.observe('fleetboss_request_queries', queries, view=view)
+        return response
+
+
+class QueryBudgetMiddleware(object):
+    """
+    Checks the queries of every request against the budget of its view and logs
+    any wasted ones. Must come before the session and authentication
+    middleware, so that their queries count as well.
+    """
+
+    def process_request(self, request):
+        request._query_budget = {
+            'view': None,
+            'limit': None,
+            'queries': querylog.start(),
+        }
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_query_budget'):
+            request._query_budget.update(
+                view='%s.%s' % (view_func.__module__, view_func.__name__),
+                limit=getattr(view_func, 'query_budget', None))
+
+    def process_response(self, request, response):
+        state = getattr(request, '_query_budget', None)
+
+        if state is None:
+            return response
+
+        queries = state['queries']
+        querylog.stop(queries)
+
+        # Storing a profile takes queries of its own.
+        if state['view'] is None or hasattr(request, '_profiler'):
+            return response
+
+        problems = querybudget.check(state['view'], state['limit'], queries)
+
+        if problems is not None:
+            logger.warning('Wasteful queries in %s %s:\n%s', request.method,
+                           request.path, problems)
+
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a request when a staff member asks for it with the profile query
+    parameter or the X-Profile header, stores the profile and sends back its ID
+    in the X-Profile-Id header. A single request is profiled at a time in each
+    process, others asking for a profile meanwhile are served as usual. Must
+    come after the authentication middleware.
+    """
+
+    def process_request(self, request):
+        if 'profile' not in request.GET and 'HTTP_X_PROFILE' not in request.META:
+            return
+
+        if not request.user.is_staff or not _profiling.acquire(False):
+            return
+
+        request._profiler = profiling.Profiler()
+        request._profiler.start()
+
+    def process_response(self, request, response):
+        profiler = getattr(request, '_profiler', None)
+
+        if profiler is None:
+            return response
+
+        try:
+            profiler.stop()
+        finally:
+            _profiling.release()
+
+        timeline = profiler.timeline()
+        profile = RequestProfile.objects.create(
+            user=request.user, method=request.method,
+            path=request.get_full_path()[:255], status=response.status_code,
+            duration=profiler.duration, queries=len(profiler.queries),
+            crest_calls=len(profiler.crest), stats=profiler.stats(),
+            stacks=profiler.stacks(), timeline=json.dumps(timeline, indent=1))
+        oldest = RequestProfile.objects.order_by('-id').values_list(
+            'id', flat=True)[PROFILES_KEPT - 1:PROFILES_KEPT].first()
+
+        if oldest is not None:
+            RequestProfile.objects.filter(id__lt=oldest).delete()
+
+        response['X-Profile-Id'] = str(profile.id)
+        return response
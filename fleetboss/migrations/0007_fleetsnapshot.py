@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetboss', '0006_fleetaccess_link_join'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('data', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fleetaccess',
+            name='last_viewed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fleetsnapshot',
+            name='fleet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='fleetboss.FleetAccess'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 03:07
+from __future__ import unicode_literals
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetboss', '0007_fleetsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetInvite',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('offline', 'Offline'), ('failed', 'Failed')], default='queued', max_length=8)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('message', models.CharField(blank=True, max_length=200)),
+                ('updated', models.DateTimeField(db_index=True, default=datetime.datetime.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fleetinvite',
+            name='character',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invites', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='fleetinvite',
+            name='fleet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invites', to='fleetboss.FleetAccess'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='fleetinvite',
+            unique_together=set([('fleet', 'character')]),
+        ),
+    ]
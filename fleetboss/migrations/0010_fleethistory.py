@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 03:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetboss', '0009_fleetlayout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('keyframe', models.BooleanField(default=False)),
+                ('data', models.TextField()),
+                ('fleet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='fleetboss.FleetAccess')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HistoryName',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=1)),
+                ('code', models.IntegerField()),
+                ('name', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='historyname',
+            unique_together=set([('kind', 'code')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='fleethistory',
+            index_together=set([('fleet', 'time')]),
+        ),
+    ]
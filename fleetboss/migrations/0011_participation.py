@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 03:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetboss', '0010_fleethistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Participation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('character_id', models.IntegerField()),
+                ('ship_id', models.IntegerField()),
+                ('seconds', models.IntegerField(default=0)),
+                ('polls', models.IntegerField(default=0)),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField()),
+                ('fleet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participation', to='fleetboss.FleetAccess')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='participation',
+            unique_together=set([('fleet', 'day', 'character_id', 'ship_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='participation',
+            index_together=set([('day', 'character_id')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 03:25
+from __future__ import unicode_literals
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fleetboss', '0011_participation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True, default=datetime.datetime.now)),
+                ('method', models.CharField(max_length=8)),
+                ('path', models.CharField(max_length=255)),
+                ('status', models.IntegerField()),
+                ('duration', models.FloatField()),
+                ('queries', models.IntegerField()),
+                ('crest_calls', models.IntegerField()),
+                ('stats', models.BinaryField()),
+                ('stacks', models.TextField()),
+                ('timeline', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='requestprofile',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='profiles', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,13 +1,18 @@
+import json
 import random
 import string
+from sys import intern
 from datetime import datetime, timedelta
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from django.db import models
 from django.utils.functional import cached_property
 from django.contrib.auth.models import AbstractUser
-from social.apps.django_app.utils import load_strategy
-from fleetboss import settings, ships
-import requests
+from fleetboss import settings, crest, tokens
+from fleetboss.stats import FleetStats, BREAKDOWNS
+
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'CREST_FETCH_WORKERS', 12))
 
 
 def get_key():
@@ -40,24 +45,11 @@ class Character(AbstractUser):
     @cached_property
     def __crest(self):
         """
-        Helper function to occasionally refresh the access token whenever it
-        expires.
+        Helper function to get the CREST data of the character, which is kept
+        up to date by the token manager.
         """
 
-        provider = self.social_auth.get(provider='eveonline')
-
-        difference = (datetime.strptime(
-            provider.extra_data['expires'],
-            "%Y-%m-%dT%H:%M:%S"
-        ) - datetime.now()).total_seconds()
-
-        if difference < 10:
-            provider.refresh_token(load_strategy())
-            expiry = datetime.now() + timedelta(seconds=1200)
-            provider.extra_data['expires'] = expiry.strftime("%Y-%m-%dT%H:%M:%S")
-            provider.save()
-
-        return provider.extra_data
+        return tokens.get(self)
 
 
 class FleetAccess(models.Model):
@@ -76,16 +68,258 @@ class FleetAccess(models.Model):
     fleet_access = models.BooleanField(default=False)
     link_join = models.BooleanField(default=False)
     secret = models.CharField(max_length=24, default=get_key, db_index=True)
+    last_viewed = models.DateTimeField(null=True, blank=True, db_index=True)
+
+
+class FleetSnapshot(models.Model):
+    """
+    The raw CREST data of a fleet at some point in time, as stored by the fleet
+    poller. Viewers of the fleet read the latest snapshot instead of calling
+    CREST themselves.
+    """
+
+    fleet = models.ForeignKey(FleetAccess, related_name='snapshots')
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    data = models.TextField()
+
+    @classmethod
+    def record(cls, fleet_id, snapshot, last=None):
+        """
+        Stores the snapshot of a fleet and returns it along with its version,
+        which is the ID of its row. If the fleet did not change since the last
+        snapshot, that one is marked as fresh and its version is kept, so that
+        clients are only told about actual changes. The last snapshot is looked
+        up unless it is given.
+        """
+
+        data = json.dumps(snapshot)
+        last = last or cls.latest(fleet_id)
+
+        if last is not None and last.data == data:
+            cls.objects.filter(pk=last.pk).update(created=datetime.now())
+            return dict(snapshot, version=last.id)
+
+        obj = cls.objects.create(fleet_id=fleet_id, data=data)
+        return dict(snapshot, version=obj.id)
+
+    @classmethod
+    def latest(cls, fleet_id, max_age=None):
+        """
+        Returns the most recent snapshot of a fleet, or None if there is none
+        or if it is older than the given number of seconds.
+        """
+
+        snapshots = cls.objects.filter(fleet_id=fleet_id)
+
+        if max_age is not None:
+            snapshots = snapshots.filter(
+                created__gte=datetime.now() - timedelta(seconds=max_age))
+
+        return snapshots.order_by('-id').first()
+
+    @property
+    def snapshot(self):
+        """
+        The stored data in the format used to build a Fleet object.
+        """
+
+        return dict(json.loads(self.data), version=self.id)
+
+
+class FleetInvite(models.Model):
+    """
+    An invite into a fleet for a character who followed its join link. Invites
+    are sent to CREST in the background by the invite dispatcher, which keeps
+    the status of each invite up to date.
+    """
+
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    OFFLINE = 'offline'
+    FAILED = 'failed'
+
+    STATUSES = (
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (OFFLINE, 'Offline'),
+        (FAILED, 'Failed'),
+    )
+
+    PENDING = (QUEUED, SENDING)
+
+    fleet = models.ForeignKey(FleetAccess, related_name='invites')
+    character = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='invites')
+    status = models.CharField(max_length=8, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    updated = models.DateTimeField(default=datetime.now, db_index=True)
+
+    class Meta:
+        unique_together = ('fleet', 'character')
+
+    def as_json(self):
+        """
+        Returns the status of the invite in a form fit for the JSON API.
+        """
+
+        return {
+            'character': self.character.get_full_name(),
+            'status': self.status,
+            'attempts': self.attempts,
+            'message': self.message,
+            'updated': self.updated.isoformat(),
+        }
+
+
+class FleetLayout(models.Model):
+    """
+    A named target structure for fleets, saved by a fleet commander so that it
+    can be applied to any of their fleets by the restructure planner.
+    """
+
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='layouts')
+    name = models.CharField(max_length=100)
+    data = models.TextField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('owner', 'name')
+
+    @property
+    def layout(self):
+        """
+        The stored layout in the format used by the restructure planner.
+        """
+
+        return json.loads(self.data)
+
+
+class HistoryName(models.Model):
+    """
+    The name of a ship type, solar system or character, by its kind and EVE ID.
+    The fleet history only stores the IDs, so that each name is stored once
+    instead of in every entry which mentions it.
+    """
+
+    SHIP = 's'
+    SYSTEM = 'y'
+    CHARACTER = 'c'
+
+    kind = models.CharField(max_length=1)
+    code = models.IntegerField()
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = ('kind', 'code')
+
+
+class FleetHistory(models.Model):
+    """
+    A single entry in the history of a fleet. Keyframes hold all members of the
+    fleet, other entries only the members who joined, changed or left since the
+    entry before them. Either way, members are stored as rows of IDs.
+    """
+
+    fleet = models.ForeignKey(FleetAccess, related_name='history')
+    time = models.DateTimeField()
+    keyframe = models.BooleanField(default=False)
+    data = models.TextField()
+
+    class Meta:
+        index_together = (('fleet', 'time'),)
+
+
+class Participation(models.Model):
+    """
+    The attendance of a character in a fleet on a single day, per ship flown.
+    Rows are counters which are added to on every poll of the fleet, so there
+    is a single row per pilot and ship however long the op.
+    """
+
+    fleet = models.ForeignKey(FleetAccess, related_name='participation')
+    day = models.DateField()
+    character_id = models.IntegerField()
+    ship_id = models.IntegerField()
+    seconds = models.IntegerField(default=0)
+    polls = models.IntegerField(default=0)
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('fleet', 'day', 'character_id', 'ship_id')
+        index_together = (('day', 'character_id'),)
+
+
+class RequestProfile(models.Model):
+    """
+    The profile of a single request, taken on demand of a staff member. Holds
+    the cProfile statistics in the marshalled pstats format, the samples of
+    the stack of the request in the collapsed format of flame graphs and a
+    timeline of the SQL queries and CREST calls made.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, related_name='profiles')
+    created = models.DateTimeField(default=datetime.now, db_index=True)
+    method = models.CharField(max_length=8)
+    path = models.CharField(max_length=255)
+    status = models.IntegerField()
+    duration = models.FloatField()
+    queries = models.IntegerField()
+    crest_calls = models.IntegerField()
+    stats = models.BinaryField()
+    stacks = models.TextField()
+    timeline = models.TextField()
 
 
 class FleetMember(object):
     """
-    Simple data-only class that respresents a single capsuleer.
+    Simple data-only class that respresents a single capsuleer. Strings are
+    interned, so that the names of pilots, ships and systems are shared between
+    all members and snapshots which mention them.
     """
 
-    def __init__(self, name, id, **_):
-        self.name = name
+    __slots__ = ('id', 'name', 'ship_id', 'ship', 'system_id', 'system',
+                 'docked', 'wing', 'squad', 'role', 'boss')
+
+    def __init__(self, id, name, ship_id, ship, system_id, system, docked,
+                 wing, squad, role, boss):
         self.id = id
+        self.name = intern(name)
+        self.ship_id = ship_id
+        self.ship = intern(ship)
+        self.system_id = system_id
+        self.system = intern(system)
+        self.docked = docked
+        self.wing = wing
+        self.squad = squad
+        self.role = role
+        self.boss = boss
+
+    @staticmethod
+    def row_from_crest(p):
+        """
+        Converts a member as returned by CREST into the compact row format in
+        which members are stored in snapshots.
+        """
+
+        return (
+            p['character']['id'], p['character']['name'],
+            p['ship']['id'], p['ship']['name'],
+            p['solarSystem']['id'], p['solarSystem']['name'],
+            'station' in p, p['wingID'], p['squadID'], p['roleID'],
+            '(Boss)' in p['roleName']
+        )
+
+    @property
+    def row(self):
+        """
+        The member in compact row format, from which it can be rebuilt.
+        """
+
+        return tuple(getattr(self, name) for name in self.__slots__)
 
 
 class Squad(object):
@@ -93,7 +327,9 @@ class Squad(object):
     A squad in a fleet which has a name, a commander and up to 10 members.
     """
 
-    def __init__(self, id, name, **_):
+    __slots__ = ('id', 'commander', 'members', 'name')
+
+    def __init__(self, id, name):
         self.id = id
         self.commander = None
         self.members = []
@@ -119,14 +355,16 @@ class Wing(object):
     commander.
     """
 
-    def __init__(self, id, name, squadsList, **_):
+    __slots__ = ('id', 'commander', 'squads', 'name')
+
+    def __init__(self, id, name, squads):
         self.id = id
         self.commander = None
         self.squads = {}
         self.name = name
 
-        for squad in squadsList:
-            self.squads[squad['id']] = Squad(**squad)
+        for squad_id, squad_name in squads:
+            self.squads[squad_id] = Squad(squad_id, squad_name)
 
     def add_member(self, squad_id, character, commander=False):
         """
@@ -156,53 +394,100 @@ class Wing(object):
 class Fleet(object):
     """
     An entire fleet. Contains up to five wings, a commander as well as an API
-    key provided by a used which is used to get information.
+    key provided by a used which is used to get information. The fleet is built
+    from a compact snapshot, either given or fetched from CREST, and the raw
+    CREST data is not kept around.
     """
 
-    def __init__(self, fleet_id, owner):
+    def __init__(self, fleet_id, owner=None, concurrent=True, snapshot=None,
+                 priority=crest.INTERACTIVE):
         self.id = fleet_id
         self.owner = owner
+        self.priority = priority
         self.commander = None
         self.__wings = {}
 
-        for wing in self._wings:
-            self.__wings[wing['id']] = Wing(**wing)
+        if snapshot is None:
+            snapshot = self.fetch(concurrent)
+
+        self.version = snapshot.get('version')
+        self.stale = snapshot.get('stale', False)
+        self.__overview = tuple(snapshot['overview'])
+        self.members = [FleetMember(*row) for row in snapshot['members']]
+        self.stats = FleetStats()
+
+        for wing_id, name, squads in snapshot['wings']:
+            self.__wings[wing_id] = Wing(wing_id, name, squads)
 
-        for p in self._members:
-            member = FleetMember(**p['character'])
+        for member in self.members:
+            self.stats.add(member)
 
-            if p['wingID'] < 0:
+            if member.wing < 0:
                 self.commander = member
                 continue
 
-            if p['squadID'] < 0:
-                self.__wings[p['wingID']].commander = member
+            if member.squad < 0:
+                self.__wings[member.wing].commander = member
             else:
-                self.__wings[p['wingID']].add_member(p['squadID'], member, p['roleID'] == 3)
+                self.__wings[member.wing].add_member(member.squad, member, member.role == 3)
 
-    @cached_property
-    def _overview(self):
+    def fetch(self, concurrent=True):
         """
-        Return a cached overview directly from the CREST endpoint.
+        Fetch the overview, the wings and the members of the fleet from CREST
+        and return them as a compact snapshot. Unless told otherwise, the three
+        calls are made at the same time so that we only wait as long as the
+        slowest of them. Raises the error of the first failed call.
         """
 
-        return self.__request('')[1]
+        urls = ('', 'wings', 'members')
 
-    @cached_property
-    def _members(self):
+        if concurrent:
+            # Resolve the token here so that the workers do not touch the
+            # database.
+            self.owner.access_token
+            futures = [executor.submit(self.__request, url) for url in urls]
+
+            try:
+                overview, wings, members = [
+                    f.result(timeout=crest.DEADLINE)[1] for f in futures]
+            except TimeoutError:
+                raise crest.CrestLimitExceeded("CREST call exceeded its deadline.")
+        else:
+            overview, wings, members = [self.__request(url)[1] for url in urls]
+
+        return self.snapshot_from_crest(overview, wings, members)
+
+    @staticmethod
+    def snapshot_from_crest(overview, wings, members):
         """
-        Return a cached list of members directly from the CREST endpoint.
+        Turns the CREST overview, wings and members payloads of a fleet into a
+        compact snapshot.
         """
 
-        return self.__request('members')[1]['items']
+        return {
+            'overview': (overview['isFreeMove'], overview['isRegistered']),
+            'wings': [
+                (w['id'], w['name'], [(s['id'], s['name']) for s in w['squadsList']])
+                for w in wings['items']
+            ],
+            'members': [FleetMember.row_from_crest(p) for p in members['items']],
+        }
 
-    @cached_property
-    def _wings(self):
+    @property
+    def snapshot(self):
         """
-        Return a cached list of wings from the CREST endpoint.
+        The fleet in the compact format of snapshots, from which an identical
+        fleet can be built without making any further calls.
         """
 
-        return self.__request('wings')[1]['items']
+        return {
+            'overview': self.__overview,
+            'wings': [
+                (wing.id, wing.name, [(squad.id, squad.name) for squad in wing])
+                for wing in self
+            ],
+            'members': [member.row for member in self.members],
+        }
 
     @property
     def boss(self):
@@ -210,9 +495,7 @@ class Fleet(object):
         Return the name of the fleet boss (not the commander).
         """
 
-        for p in self._members:
-            if '(Boss)' in p['roleName']:
-                return p['character']['name']
+        return self.stats.boss
 
     @property
     def is_freemove(self):
@@ -221,7 +504,7 @@ class Fleet(object):
         or false otherwise.
         """
 
-        return self._overview['isFreeMove']
+        return self.__overview[0]
 
     @property
     def is_advertised(self):
@@ -230,7 +513,7 @@ class Fleet(object):
         otherwise.
         """
 
-        return self._overview['isRegistered']
+        return self.__overview[1]
 
     @property
     def composition_class(self):
@@ -239,7 +522,7 @@ class Fleet(object):
         instances per ship type.
         """
 
-        return dict(Counter(p['ship']['name'] for p in self._members))
+        return self.stats['composition_class']
 
     @property
     def composition_category(self):
@@ -247,15 +530,7 @@ class Fleet(object):
         A somewhat broader counting of ships bucketed by category.
         """
 
-        res = {}
-
-        for name, count in self.composition_class.items():
-            category = ships.CATEGORIES.get(name, 'Unknown')
-            if category not in res:
-                res[category] = 0
-            res[category] += count
-
-        return res
+        return self.stats['composition_category']
 
     @property
     def composition_size(self):
@@ -264,15 +539,7 @@ class Fleet(object):
         the fleet.
         """
 
-        res = {}
-
-        for name, count in self.composition_category.items():
-            size = ships.SIZES.get(name, 'Unknown')
-            if size not in res:
-                res[size] = 0
-            res[size] += count
-
-        return res
+        return self.stats['composition_size']
 
     @property
     def location_system(self):
@@ -281,7 +548,7 @@ class Fleet(object):
         are located.
         """
 
-        return dict(Counter(p['solarSystem']['name'] for p in self._members))
+        return self.stats['location_system']
 
     @property
     def location_docked(self):
@@ -289,8 +556,8 @@ class Fleet(object):
         Buckets for the docking status of fleet memebers, either docked or
         undocked.
         """
-        return dict(Counter('Docked' if 'station' in p else 'Undocked'
-                            for p in self._members))
+
+        return self.stats['location_docked']
 
     @property
     def warnings(self):
@@ -319,11 +586,10 @@ class Fleet(object):
     @property
     def member_names(self):
         """
-        A list of names of members of the fleet.
+        The set of names of members of the fleet.
         """
 
-        for p in self._members:
-            yield p['character']['name']
+        return self.stats.member_names
 
     @property
     def squad_count(self):
@@ -339,7 +605,40 @@ class Fleet(object):
         Returns the number of members in this fleet.
         """
 
-        return len(self._members)
+        return self.stats.member_count
+
+    def as_json(self):
+        """
+        A compact summary of the fleet for clients, containing its hierarchy,
+        its warnings and all breakdowns sorted from large to small.
+        """
+
+        def character(member):
+            return [member.id, member.name] if member else None
+
+        return {
+            'id': self.id,
+            'version': self.version,
+            'stale': self.stale,
+            'boss': self.boss,
+            'member_count': self.member_count,
+            'is_freemove': self.is_freemove,
+            'is_advertised': self.is_advertised,
+            'commander': character(self.commander),
+            'wings': [{
+                'name': wing.name,
+                'commander': character(wing.commander),
+                'squads': [{
+                    'name': squad.name,
+                    'commander': character(squad.commander),
+                    'members': [character(m) for m in squad],
+                } for squad in wing],
+            } for wing in self],
+            'breakdowns': dict(
+                (name, sorted(self.stats[name].items(), key=lambda x: (-x[1], x[0])))
+                for name, _ in BREAKDOWNS),
+            'warnings': self.warnings,
+        }
 
     def __request(self, url):
         """
@@ -347,16 +646,15 @@ class Fleet(object):
         registered as the owner of the fleet.
         """
 
-        result = requests.get(
-            'https://crest-tq.eveonline.com/fleets/%d/%s' % (
-                self.id, url + '/' if len(url) > 0 else ''),
-            headers={
-                'Authorization': 'Bearer ' + self.owner.access_token,
-                'Host': 'crest-tq.eveonline.com'}
+        result = crest.get(
+            'fleets/%d/%s' % (self.id, url + '/' if len(url) > 0 else ''),
+            self.owner.access_token,
+            priority=self.priority
         )
 
         if result.status_code != 200:
-            raise RuntimeError("CREST call returned a non-200 status code.")
+            raise crest.CrestError(
+                "CREST call returned a non-200 status code.", result)
 
         return result.status_code, result.json()
 
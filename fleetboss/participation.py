@@ -0,0 +1,166 @@
+"""
+The participation ledger, which credits pilots for the time they spend in
+fleets. Every so often the poller adds the time since the previous credit of
+a fleet to the counters of each member, keyed by day, character and ship.
+
+The counters of all members of a fleet are added to with a single upsert
+statement, rather than a query or two per pilot, so that crediting a fleet of
+hundreds of pilots stays cheap. Reports sum the counters of a date range in
+the database, which the index on day and character keeps fast however long
+the ledger, and are shown a page at a time, so that only the pilots on the
+page have their names and ships looked up.
+"""
+
+import time
+from datetime import datetime
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from fleetboss import settings
+from fleetboss.models import Participation, HistoryName, FleetAccess
+from fleetboss.history import intern_names
+
+
+INTERVAL = getattr(settings, 'PARTICIPATION_INTERVAL', 60)
+MAX_CREDIT = getattr(settings, 'PARTICIPATION_MAX_CREDIT', 300)
+BATCH = getattr(settings, 'PARTICIPATION_BATCH', 500)
+PAGE_SIZE = getattr(settings, 'PARTICIPATION_PAGE_SIZE', 50)
+
+COLUMNS = ('fleet_id', 'day', 'character_id', 'ship_id', 'seconds', 'polls',
+           'first_seen', 'last_seen')
+
+
+def key(fleet_id):
+    """
+    Returns the cache key under which the time of the last credit of a fleet
+    is kept.
+    """
+
+    return 'fleetboss:participation:%d' % fleet_id
+
+
+def record(fleet_id, fleet):
+    """
+    Credits the members of a fleet with the time since the fleet was credited
+    last, unless that was less than the interval ago. Gaps longer than the
+    maximum credit, for example when nobody watched the fleet for a while, are
+    not credited at all, but still count as a poll. Returns the number of
+    pilots credited.
+    """
+
+    if not cache.add(key(fleet_id) + ':due', 1, INTERVAL):
+        return 0
+
+    now = time.time()
+    last = cache.get(key(fleet_id))
+    # The time of the last credit expires after the maximum credit, so a longer
+    # gap leaves nothing to count from.
+    cache.set(key(fleet_id), now, MAX_CREDIT)
+    seconds = int(now - last) if last is not None else 0
+
+    intern_names(fleet.members)
+    upsert(fleet_id, datetime.fromtimestamp(now), seconds,
+           set((m.id, m.ship_id) for m in fleet.members))
+    return len(fleet.members)
+
+
+def upsert(fleet_id, when, seconds, pilots):
+    """
+    Adds the given number of seconds and a single poll to the counters of the
+    pairs of character and ship, creating the counters which do not exist yet.
+    """
+
+    table = connection.ops.quote_name(Participation._meta.db_table)
+    day = connection.ops.adapt_datefield_value(when.date())
+    stamp = connection.ops.adapt_datetimefield_value(when)
+    rows = [(fleet_id, day, character, ship, seconds, 1, stamp, stamp)
+            for character, ship in sorted(pilots)]
+
+    if connection.vendor == 'mysql':
+        conflict = ('ON DUPLICATE KEY UPDATE seconds = seconds + VALUES(seconds), '
+                    'polls = polls + 1, last_seen = VALUES(last_seen)')
+    else:
+        # Both PostgreSQL and SQLite understand this form.
+        conflict = ('ON CONFLICT (fleet_id, day, character_id, ship_id) DO UPDATE '
+                    'SET seconds = {0}.seconds + excluded.seconds, '
+                    'polls = {0}.polls + 1, last_seen = excluded.last_seen'
+                    ).format(table)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(rows), BATCH):
+            batch = rows[i:i + BATCH]
+            values = ', '.join(['(%s)' % ', '.join(['%s'] * len(COLUMNS))] * len(batch))
+            cursor.execute(
+                'INSERT INTO %s (%s) VALUES %s %s' % (
+                    table, ', '.join(COLUMNS), values, conflict),
+                [value for row in batch for value in row])
+
+
+def totals(start, end, fleets=None):
+    """
+    Sums up the participation of every character between two days, both
+    inclusive, optionally only in the given fleets. Returns a query of dicts
+    with the ID of the character, the number of fleets and days attended, the
+    number of polls and the total time in seconds, most active first, which is
+    meant to be shown a page at a time.
+    """
+
+    return _ledger(start, end, fleets).values('character_id').annotate(
+        seconds=Sum('seconds'), polls=Sum('polls'),
+        fleets=Count('fleet', distinct=True), days=Count('day', distinct=True),
+    ).order_by('-seconds', '-polls', 'character_id')
+
+
+def describe(start, end, fleets, rows):
+    """
+    Adds the name of the character, the time in hours and the ship flown
+    longest over the same days and fleets to a page of rows of totals.
+    Returns the rows as a list.
+    """
+
+    rows = list(rows)
+    characters = [r['character_id'] for r in rows]
+    ships = {}
+
+    for row in _ledger(start, end, fleets).filter(character_id__in=characters).values(
+            'character_id', 'ship_id').annotate(seconds=Sum('seconds')):
+        best = ships.get(row['character_id'])
+
+        if best is None or row['seconds'] > best[1]:
+            ships[row['character_id']] = (row['ship_id'], row['seconds'])
+
+    names = _names(HistoryName.CHARACTER, characters)
+    ship_names = _names(HistoryName.SHIP, [s for s, _ in ships.values()])
+
+    for r in rows:
+        r['name'] = names.get(r['character_id'], 'Unknown')
+        r['hours'] = round(r['seconds'] / 3600.0, 1)
+        r['ship'] = ship_names.get(ships[r['character_id']][0], 'Unknown')
+
+    return rows
+
+
+def visible_fleets(user):
+    """
+    Returns a query of the IDs of the fleets whose participation the user may
+    see, or None if the user may see all of them.
+    """
+
+    if user.is_staff:
+        return None
+
+    return FleetAccess.objects.filter(Q(owner=user) | Q(access=user)).values('id')
+
+
+def _ledger(start, end, fleets):
+    ledger = Participation.objects.filter(day__range=(start, end))
+
+    if fleets is not None:
+        ledger = ledger.filter(fleet__in=fleets)
+
+    return ledger
+
+
+def _names(kind, codes):
+    return dict(HistoryName.objects.filter(kind=kind, code__in=set(codes)).values_list(
+        'code', 'name'))
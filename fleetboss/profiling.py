@@ -0,0 +1,171 @@
+"""
+Profiles of single requests, taken when a staff member asks for one. While a
+request is profiled, cProfile traces the thread of the request, a sampler
+takes its stack every few milliseconds for flame graphs, and the SQL queries
+and CREST calls made are put on a timeline.
+
+CREST calls are mostly made by worker threads, so every call made while a
+profile is active is put on its timeline, marked with the thread it was made
+in. Calls of other requests profiled or served at the same time show up as
+well. When no profile is active, the hooks cost a single check of a list.
+"""
+
+import collections
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from django.db import connection
+from fleetboss import settings
+
+
+SAMPLE_INTERVAL = getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.005)
+
+active = []
+_active_lock = threading.Lock()
+
+
+class _QueryLog(collections.deque):
+    """
+    A log of queries which also notes when each query ended, as the debug
+    cursor only logs how long they took.
+    """
+
+    def append(self, query):
+        super(_QueryLog, self).append(dict(query, end=time.time()))
+
+
+class _Stats(object):
+    """
+    Marshalled statistics in a form pstats.Stats can load.
+    """
+
+    def __init__(self, data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+
+class Profiler(object):
+    """
+    Profiles the current thread between start() and stop().
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.thread_id = threading.current_thread().ident
+        self.samples = collections.Counter()
+        self.crest = []
+        self.done = threading.Event()
+
+    def start(self):
+        self.debug_cursor = connection.force_debug_cursor
+        self.queries_log = connection.queries_log
+        connection.force_debug_cursor = True
+        connection.queries_log = _QueryLog(maxlen=self.queries_log.maxlen)
+        self.start_time = time.time()
+
+        with _active_lock:
+            active.append(self)
+
+        threading.Thread(target=self._sample, name='profile-sampler', daemon=True).start()
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stops profiling and puts back the query log of the connection.
+        """
+
+        self.profile.disable()
+        self.duration = time.time() - self.start_time
+        self.done.set()
+
+        with _active_lock:
+            active.remove(self)
+
+        self.queries = list(connection.queries_log)
+        connection.queries_log = self.queries_log
+        connection.force_debug_cursor = self.debug_cursor
+
+    def stats(self):
+        """
+        Returns the statistics of cProfile in the marshalled format which
+        pstats.Stats reads from a file.
+        """
+
+        return marshal.dumps(pstats.Stats(self.profile).stats)
+
+    def stacks(self):
+        """
+        Returns the samples in the collapsed format of flame graphs: a line per
+        distinct stack, with the frames from the outermost one separated by
+        semicolons, followed by the number of samples.
+        """
+
+        return ''.join('%s %d\n' % (stack, n) for stack, n in sorted(self.samples.items()))
+
+    def timeline(self):
+        """
+        Returns the SQL queries and the CREST calls, in the order they started,
+        with times in milliseconds since the start of the profile.
+        """
+
+        events = [{
+            'kind': 'sql',
+            'start': round((q['end'] - float(q['time']) - self.start_time) * 1000, 2),
+            'duration': round(float(q['time']) * 1000, 2),
+            'detail': q['sql'],
+            'thread': 'request',
+        } for q in self.queries] + self.crest
+
+        return sorted(events, key=lambda e: e['start'])
+
+    def _sample(self):
+        while not self.done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+def crest_call(method, endpoint, status, start):
+    """
+    Puts a CREST call on the timelines of the active profiles.
+    """
+
+    end = time.time()
+    thread = threading.current_thread()
+
+    with _active_lock:
+        for profiler in active:
+            profiler.crest.append({
+                'kind': 'crest',
+                'start': round((start - profiler.start_time) * 1000, 2),
+                'duration': round((end - start) * 1000, 2),
+                'detail': '%s %s %s' % (method, endpoint, status),
+                'thread': 'request' if thread.ident == profiler.thread_id else thread.name,
+            })
+
+
+def summary(stats, count=30):
+    """
+    Returns the functions which took the most time, including the calls they
+    made, of marshalled statistics as printed by pstats.
+    """
+
+    output = io.StringIO()
+    pstats.Stats(_Stats(bytes(stats)), stream=output).sort_stats(
+        'cumulative').print_stats(count)
+    return output.getvalue()
@@ -0,0 +1,104 @@
+"""
+Budgets of database queries per view. A view declares with the budget
+decorator how many queries a request to it may make, counting every statement
+from the session and user lookups of the middleware onwards, as recorded by
+the query log. The budgets of the fleet views are set for requests
+served from the snapshots stored by the fleet poller; a request which has to
+fetch the fleet from CREST itself takes a few more.
+
+The middleware checks every request against the budget of its view and looks
+for wasted queries: the same query made more than once, and the same query
+made over and over with different parameters, which is the signature of an
+N+1 pattern. Those are logged, and counted in the metrics. With
+QUERY_BUDGET_STRICT set, as it should be when testing, a request which
+exceeds its budget raises QueryBudgetExceeded instead, which fails the
+request and with it the test.
+"""
+
+import re
+from collections import Counter
+from fleetboss import settings, metrics
+
+
+STRICT = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+REPEAT_THRESHOLD = getattr(settings, 'QUERY_BUDGET_REPEAT_THRESHOLD', 3)
+
+# Literals in SQL, and lists of them or of placeholders of parameters.
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+LISTS = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised in strict mode when a request made more queries than the budget of
+    its view.
+    """
+
+
+def budget(queries):
+    """
+    Declares the number of queries a request to the decorated view may make.
+    """
+
+    def decorator(view):
+        view.query_budget = queries
+        return view
+
+    return decorator
+
+
+def shape(sql):
+    """
+    Returns a query with its literals left out, so that the same query with
+    different parameters has the same shape.
+    """
+
+    return LISTS.sub('(...)', LITERALS.sub('%s', sql))
+
+
+def analyze(queries):
+    """
+    Returns the queries which were made more than once, and the shapes of the
+    queries which were made with different parameters at least as often as the
+    threshold, each as a list of pairs of count and SQL, most frequent first.
+    Takes the queries as pairs of SQL and parameters, as the query log records
+    them.
+    """
+
+    statements = [(sql, repr(params)) for sql, params in queries
+                  if sql.lstrip()[:6].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE')]
+    duplicates = [(n, '%s with %s' % query) for query, n in Counter(statements).items() if n > 1]
+    variants = Counter(shape(sql) for sql, params in set(statements))
+    repeated = [(n, sql) for sql, n in variants.items() if n >= REPEAT_THRESHOLD]
+
+    return sorted(duplicates, reverse=True), sorted(repeated, reverse=True)
+
+
+def check(view, limit, queries):
+    """
+    Checks the queries of a request to a view against its budget, which may be
+    None, and returns a description of any problems found, or None. Raises
+    QueryBudgetExceeded in strict mode if the budget was exceeded.
+    """
+
+    duplicates, repeated = analyze(queries)
+    problems = []
+
+    for n, sql in duplicates:
+        metrics.inc('fleetboss_wasted_queries_total', view=view, kind='duplicate')
+        problems.append('The same query was made %d times: %s' % (n, sql))
+
+    for n, sql in repeated:
+        metrics.inc('fleetboss_wasted_queries_total', view=view, kind='repeated')
+        problems.append('A query was made %d times with different parameters, '
+                        'possibly once per object: %s' % (n, sql))
+
+    if limit is not None and len(queries) > limit:
+        metrics.inc('fleetboss_query_budget_overruns_total', view=view)
+        problems.insert(0, '%s made %d queries, its budget is %d.' % (view, len(queries), limit))
+
+        if STRICT:
+            raise QueryBudgetExceeded('\n'.join(problems))
+
+    if problems:
+        return '\n'.join(problems)
@@ -0,0 +1,84 @@
+"""
+A lightweight log of the database queries made in a thread, which the metrics
+and the query budgets count the queries of requests with. Unlike the debug
+cursor it neither times queries nor copies their parameters into the SQL, it
+merely appends the SQL and the parameters of every query to the logs which
+are being recorded, if any.
+
+The cursors of a connection are wrapped once it is first recorded, by
+replacing the methods of the connection which wrap them. Queries made through
+other connections, like those of other threads, are not recorded.
+"""
+
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorWrapper, CursorDebugWrapper
+
+
+class _Recording(object):
+
+    def execute(self, sql, params=None):
+        for log in self.db.fleetboss_query_logs:
+            log.append((sql, params))
+
+        return super(_Recording, self).execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        for log in self.db.fleetboss_query_logs:
+            log.append((sql, None))
+
+        return super(_Recording, self).executemany(sql, param_list)
+
+
+class _Cursor(_Recording, CursorWrapper):
+    pass
+
+
+class _DebugCursor(_Recording, CursorDebugWrapper):
+    pass
+
+
+def start():
+    """
+    Starts recording the queries of this thread, and returns the list they are
+    appended to as pairs of SQL and parameters. Any number of logs may be
+    recorded at a time.
+    """
+
+    db = connections[DEFAULT_DB_ALIAS]
+
+    if not hasattr(db, 'fleetboss_query_logs'):
+        db.fleetboss_query_logs = []
+        db.make_cursor = lambda cursor: _Cursor(cursor, db)
+        db.make_debug_cursor = lambda cursor: _DebugCursor(cursor, db)
+
+    log = []
+    db.fleetboss_query_logs.append(log)
+    return log
+
+
+def stop(log):
+    """
+    Stops recording a log.
+    """
+
+    logs = connections[DEFAULT_DB_ALIAS].fleetboss_query_logs
+
+    for i, l in enumerate(logs):
+        if l is log:
+            del logs[i]
+            break
+
+
+@contextmanager
+def recording():
+    """
+    Records the queries of this thread made in the block.
+    """
+
+    log = start()
+
+    try:
+        yield log
+    finally:
+        stop(log)
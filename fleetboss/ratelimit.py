@@ -0,0 +1,127 @@
+"""
+Token buckets which limit the rate of outbound CREST calls. Buckets are kept in
+the Django cache, so with a shared backend the budget is shared between all
+worker processes and the fleet poller.
+
+There is a global bucket for all calls and a bucket per access token. A call
+takes from both, and gives back what it took from one if the other runs dry
+for too long. Calls made in the background may not take the last part of a bucket, which is kept
+in reserve so that page loads are served first when the budget runs low.
+"""
+
+import hashlib
+import time
+from contextlib import contextmanager
+from django.core.cache import cache
+from fleetboss import settings
+
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+GLOBAL_RATE = getattr(settings, 'CREST_RATE', 100)
+GLOBAL_BURST = getattr(settings, 'CREST_BURST', 200)
+TOKEN_RATE = getattr(settings, 'CREST_TOKEN_RATE', 20)
+TOKEN_BURST = getattr(settings, 'CREST_TOKEN_BURST', 40)
+BACKGROUND_RESERVE = getattr(settings, 'CREST_BACKGROUND_RESERVE', 0.25)
+
+TIMEOUTS = {
+    INTERACTIVE: getattr(settings, 'CREST_RATE_TIMEOUT', 5),
+    BACKGROUND: getattr(settings, 'CREST_BACKGROUND_RATE_TIMEOUT', 30),
+}
+
+LOCK_TIMEOUT = 1
+LOCK_INTERVAL = 0.001
+LOCK_MAX_INTERVAL = 0.05
+
+
+def acquire(token, priority=INTERACTIVE):
+    """
+    Waits until both the global budget and the budget of the given access token
+    allow another call. Returns false if that takes longer than the timeout
+    of the priority, in which case the call should not be made.
+    """
+
+    deadline = time.time() + TIMEOUTS[priority]
+    digest = hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+    buckets = (
+        ('fleetboss:rate:token:' + digest, TOKEN_RATE, TOKEN_BURST),
+        ('fleetboss:rate:global', GLOBAL_RATE, GLOBAL_BURST),
+    )
+
+    taken = []
+
+    for key, rate, burst in buckets:
+        reserve = burst * BACKGROUND_RESERVE if priority == BACKGROUND else 0
+
+        while True:
+            wait = take(key, rate, burst, reserve)
+
+            if wait == 0:
+                taken.append((key, rate, burst))
+                break
+
+            if time.time() + wait > deadline:
+                # No call is made, so the tokens taken for it are not used up.
+                for args in taken:
+                    refund(*args)
+
+                return False
+
+            time.sleep(wait)
+
+    return True
+
+
+def take(key, rate, burst, reserve=0):
+    """
+    Takes a single token from a bucket which refills at the given rate per
+    second up to the given burst, provided that at least the reserve is left
+    afterwards. Returns zero if a token was taken, or the number of seconds
+    after which one will be available otherwise.
+    """
+
+    with _lock(key):
+        now = time.time()
+        tokens, stamp = cache.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - stamp) * rate)
+
+        if tokens - 1 >= reserve:
+            cache.set(key, (tokens - 1, now), None)
+            return 0
+
+        cache.set(key, (tokens, now), None)
+        return (reserve + 1 - tokens) / float(rate)
+
+
+def refund(key, rate, burst):
+    """
+    Gives back a token taken from a bucket for a call which was not made.
+    """
+
+    with _lock(key):
+        now = time.time()
+        tokens, stamp = cache.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - stamp) * rate + 1)
+        cache.set(key, (tokens, now), None)
+
+
+@contextmanager
+def _lock(key):
+    """
+    Holds the lock of a bucket in the shared cache. Waits for another holder
+    with exponential backoff, so that waiting does not flood the cache.
+    """
+
+    lock = key + ':lock'
+    interval = LOCK_INTERVAL
+
+    while not cache.add(lock, 1, LOCK_TIMEOUT):
+        time.sleep(interval)
+        interval = min(interval * 2, LOCK_MAX_INTERVAL)
+
+    try:
+        yield
+    finally:
+        cache.delete(lock)
@@ -0,0 +1,399 @@
+"""
+Restructuring of live fleets according to a saved layout. A layout names the
+wings and squads of a fleet along with the commanders and members of each of
+them, all by name, so that it can be reused for every fleet of an op.
+
+The planner compares a layout with the current structure of a fleet and works
+out which CREST calls are needed to get there: wings and squads are reused and
+renamed where possible and only created when there are too few of them, and
+only members who are not in place yet are moved. The executor makes these
+calls concurrently, in batches of calls whose dependencies are done, such as
+moving a member into a squad which had to be created first.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from fleetboss import settings, crest
+
+
+WORKERS = getattr(settings, 'FLEET_RESTRUCTURE_WORKERS', 10)
+
+executor = ThreadPoolExecutor(max_workers=WORKERS)
+
+# The CREST roles of fleet members, by the role ID found in the fleet data.
+ROLES = {
+    1: 'fleetCommander',
+    2: 'wingCommander',
+    3: 'squadCommander',
+    4: 'squadMember',
+}
+
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class LayoutError(ValueError):
+    """
+    Raised when a layout is malformed or cannot be applied to a fleet.
+    """
+
+
+class Operation(object):
+    """
+    A single CREST call of a restructure. Wings and squads are referred to
+    either by their ID or by the operation which creates them, in which case
+    the ID is only known once that operation is done.
+    """
+
+    __slots__ = ('kind', 'name', 'wing', 'squad', 'member', 'role',
+                 'depends', 'result', 'status', 'error')
+
+    def __init__(self, kind, name=None, wing=None, squad=None, member=None,
+                 role=None, depends=()):
+        self.kind = kind
+        self.name = name
+        self.wing = wing
+        self.squad = squad
+        self.member = member
+        self.role = role
+        self.depends = [d for d in depends if isinstance(d, Operation)]
+        self.result = None
+        self.status = None
+        self.error = None
+
+    def call(self, fleet_id):
+        """
+        Returns the method, path and body of the CREST call. Only valid once
+        all dependencies are done.
+        """
+
+        fleet = 'fleets/%d/' % fleet_id
+
+        if self.kind == 'create_wing':
+            return 'POST', fleet + 'wings/', None
+        if self.kind == 'rename_wing':
+            return 'PUT', fleet + 'wings/%d/' % _id(self.wing), {'name': self.name}
+        if self.kind == 'create_squad':
+            return 'POST', fleet + 'wings/%d/squads/' % _id(self.wing), None
+        if self.kind == 'rename_squad':
+            return 'PUT', fleet + 'wings/%d/squads/%d/' % (
+                _id(self.wing), _id(self.squad)), {'name': self.name}
+
+        body = {'newRole': self.role}
+
+        if self.wing is not None:
+            body['newWingID'] = _id(self.wing)
+        if self.squad is not None:
+            body['newSquadID'] = _id(self.squad)
+
+        return 'PUT', fleet + 'members/%d/' % self.member.id, body
+
+    def describe(self):
+        """
+        Returns a short description of the operation for the user.
+        """
+
+        if self.kind == 'create_wing':
+            return 'Create wing %s' % self.name
+        if self.kind == 'rename_wing':
+            return 'Rename wing to %s' % self.name
+        if self.kind == 'create_squad':
+            return 'Create squad %s' % self.name
+        if self.kind == 'rename_squad':
+            return 'Rename squad to %s' % self.name
+
+        return 'Move %s to %s%s' % (
+            self.member.name, self.role, ' in %s' % self.name if self.name else '')
+
+    def as_json(self):
+        return {
+            'operation': self.describe(),
+            'status': self.status,
+            'error': self.error,
+        }
+
+
+def layout_of(fleet):
+    """
+    Returns the current structure of a fleet as a layout.
+    """
+
+    def name(member):
+        return member.name if member else None
+
+    return {
+        'commander': name(fleet.commander),
+        'wings': [{
+            'name': wing.name,
+            'commander': name(wing.commander),
+            'squads': [{
+                'name': squad.name,
+                'commander': name(squad.commander),
+                'members': [m.name for m in squad],
+            } for squad in wing],
+        } for wing in fleet],
+    }
+
+
+def plan(fleet, layout):
+    """
+    Returns the operations which turn the structure of the fleet into the given
+    layout. Members of the fleet who are not mentioned in the layout are left
+    where they are, unless they hold a position which the layout gives to
+    someone else. Pilots in the layout who are not in the fleet are ignored.
+    """
+
+    validate(layout)
+
+    operations = []
+    members = dict((m.name, m) for m in fleet.members)
+    targets = {}
+    occupants = {}
+    first = None
+
+    if fleet.commander is not None:
+        occupants[('fleet',)] = fleet.commander
+
+    if layout.get('commander'):
+        targets[layout['commander']] = ('fleetCommander', None, None, None, ('fleet',))
+
+    for wing, wing_ref, spec in _match(list(fleet), layout['wings'], operations, 'wing'):
+        existing = list(wing) if wing is not None else []
+
+        if wing is not None and wing.commander is not None:
+            occupants[('wing', wing.id)] = wing.commander
+
+        for squad in existing:
+            if squad.commander is not None:
+                occupants[('squad', wing.id, squad.id)] = squad.commander
+
+        if spec.get('commander'):
+            targets[spec['commander']] = (
+                'wingCommander', wing_ref, None, spec['name'], ('wing', wing_ref))
+
+        for squad, squad_ref, squad_spec in _match(
+                existing, spec['squads'], operations, 'squad', wing_ref):
+            where = '%s / %s' % (spec['name'], squad_spec['name'])
+            first = first or (wing_ref, squad_ref, where)
+
+            if squad_spec.get('commander'):
+                targets[squad_spec['commander']] = (
+                    'squadCommander', wing_ref, squad_ref, where,
+                    ('squad', wing_ref, squad_ref))
+
+            for name in squad_spec.get('members', ()):
+                targets[name] = ('squadMember', wing_ref, squad_ref, where, None)
+
+    moves = {}
+
+    for name, (role, wing, squad, where, slot) in targets.items():
+        member = members.get(name)
+
+        if member is None or _position(member) == (role, wing, squad):
+            continue
+
+        moves[member.id] = Operation(
+            'move', where, wing, squad, member, role, depends=(wing, squad))
+
+    # A position can only be taken once its current holder has left it.
+    for name, (role, wing, squad, where, slot) in targets.items():
+        member = members.get(name)
+        holder = occupants.get(slot)
+
+        if member is None or member.id not in moves or holder in (None, member):
+            continue
+
+        if holder.id not in moves:
+            if first is None:
+                raise LayoutError("There is no squad to move %s into." % holder.name)
+
+            moves[holder.id] = Operation(
+                'move', first[2], first[0], first[1], holder, 'squadMember',
+                depends=first[:2])
+
+        moves[member.id].depends.append(moves[holder.id])
+
+    _break_cycles(list(moves.values()), first, operations)
+
+    return operations + sorted(moves.values(), key=lambda op: op.member.name)
+
+
+def execute(fleet_id, token, operations, priority=crest.INTERACTIVE):
+    """
+    Performs the planned operations on a fleet with the given access token.
+    Operations are run in batches of those whose dependencies are done, the
+    operations of a batch all at once. Operations which depend on a failed
+    operation are skipped. Returns the number of seconds it took.
+    """
+
+    start = time.time()
+    pending = list(operations)
+
+    while pending:
+        for op in pending:
+            if any(d.status in (FAILED, SKIPPED) for d in op.depends):
+                op.status = SKIPPED
+                op.error = "An operation it depends on failed."
+
+        batch = [op for op in pending
+                 if op.status is None and all(d.status == DONE for d in op.depends)]
+
+        futures = dict(
+            (executor.submit(_run, fleet_id, token, op, priority), op) for op in batch)
+        wait(futures)
+
+        for future, op in futures.items():
+            if future.exception() is not None:
+                op.status, op.error = FAILED, str(future.exception())
+
+        pending = [op for op in pending if op.status is None]
+
+        if not batch:
+            for op in pending:
+                op.status = SKIPPED
+                op.error = "The operation depends on itself."
+            break
+
+    return time.time() - start
+
+
+def _run(fleet_id, token, op, priority):
+    method, path, body = op.call(fleet_id)
+
+    try:
+        result = crest.request(method, path, token, priority=priority, json=body)
+    except crest.CrestError as e:
+        op.status, op.error = FAILED, str(e)
+        return
+
+    if result.status_code not in (200, 201, 204):
+        op.status, op.error = FAILED, "CREST returned status %d." % result.status_code
+        return
+
+    if op.kind.startswith('create'):
+        try:
+            op.result = int(result.headers['Location'].rstrip('/').rsplit('/', 1)[1])
+        except (KeyError, IndexError, ValueError):
+            op.status, op.error = FAILED, "CREST did not say what it created."
+            return
+
+    op.status = DONE
+
+
+def _id(ref):
+    return ref.result if isinstance(ref, Operation) else ref
+
+
+def _match(existing, specs, operations, kind, wing=None):
+    """
+    Pairs the specs of wings or squads with existing ones, preferring those
+    with the same name, and appends the operations to rename or create the
+    rest. Yields each spec with the existing wing or squad, which is None if
+    it has yet to be created, and with its ID or the operation creating it.
+    """
+
+    pairs = [None] * len(specs)
+    free = list(existing)
+
+    for i, spec in enumerate(specs):
+        for obj in free:
+            if obj.name == spec['name']:
+                pairs[i] = obj
+                free.remove(obj)
+                break
+
+    for i, spec in enumerate(specs):
+        obj = pairs[i]
+
+        if obj is not None:
+            yield obj, obj.id, spec
+            continue
+
+        if free:
+            obj = free.pop(0)
+            ref = obj.id
+        else:
+            ref = Operation('create_' + kind, spec['name'], wing, depends=(wing,))
+            operations.append(ref)
+
+        # New wings and squads get a default name, so they are renamed as well.
+        operations.append(Operation(
+            'rename_' + kind, spec['name'],
+            wing if kind == 'squad' else ref,
+            ref if kind == 'squad' else None,
+            depends=(wing, ref)))
+
+        yield obj, ref, spec
+
+
+def _position(member):
+    role = ROLES.get(member.role)
+
+    if role == 'fleetCommander':
+        return role, None, None
+    if role == 'wingCommander':
+        return role, member.wing, None
+
+    return role, member.wing, member.squad
+
+
+def _break_cycles(moves, first, operations):
+    """
+    Commanders swapping positions wait on each other. Such cycles are broken
+    by parking one of them as a squad member first, which frees their old
+    position without taking another.
+    """
+
+    state = {}
+
+    def visit(op):
+        state[op] = 'visiting'
+
+        for i, dep in enumerate(op.depends):
+            if dep.kind != 'move':
+                continue
+
+            if state.get(dep) == 'visiting':
+                if first is None:
+                    raise LayoutError("There is no squad to park %s in." % dep.member.name)
+
+                park = Operation('move', first[2], first[0], first[1], dep.member,
+                                 'squadMember', depends=first[:2])
+                op.depends[i] = park
+                dep.depends.append(park)
+                moves.append(park)
+                operations.append(park)
+            elif dep not in state:
+                visit(dep)
+
+        state[op] = 'visited'
+
+    for op in list(moves):
+        if op not in state:
+            visit(op)
+
+
+def validate(layout):
+    """
+    Checks that a layout is well-formed and names every pilot only once.
+    """
+
+    try:
+        names = [layout.get('commander')]
+
+        for wing in layout['wings']:
+            names.append(wing.get('commander'))
+            wing['name']
+
+            for squad in wing['squads']:
+                squad['name']
+                names.append(squad.get('commander'))
+                names.extend(squad.get('members', ()))
+    except (KeyError, TypeError, AttributeError):
+        raise LayoutError("The layout is not well-formed.")
+
+    names = [n for n in names if n]
+
+    if len(names) != len(set(names)):
+        raise LayoutError("The layout mentions some pilots more than once.")
@@ -16,11 +16,14 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'fleetboss.middleware.MetricsMiddleware',
+    'fleetboss.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'fleetboss.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -94,3 +97,99 @@ SOCIAL_AUTH_REDIRECT_IS_HTTPS = False
 
 SECRET_KEY = ''
 DEBUG = False
+
+CREST_FETCH_WORKERS = 12
+CREST_POOL_SIZE = 20
+CREST_BASE_URL = 'https://crest-tq.eveonline.com/'
+CREST_TIMEOUT = (3.05, 10)
+
+# Snapshots and their fetch locks, access tokens, the buckets of the rate
+# limiter, the circuit breaker and the metrics are shared between worker
+# processes through the cache, so it has to be a backend which all processes
+# share and which increments atomically, like memcached. LocMemCache keeps a
+# separate cache in every process and only suits a single process during
+# development.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }
+}
+
+FLEET_SNAPSHOT_TTL = 5
+FLEET_SNAPSHOT_LOCK_TIMEOUT = 15
+
+FLEET_POLL_INTERVAL = 5
+FLEET_POLL_WORKERS = 8
+FLEET_POLL_ACTIVE = 600
+FLEET_POLL_MAX_AGE = 30
+FLEET_SNAPSHOT_RETENTION = 600
+
+SHIP_INDEX = os.path.join(BASE_DIR, 'ships.idx')
+FLEET_REFRESH_INTERVAL = 10
+# Event streams check the version published by the fleet poller this often,
+# so they pass a new snapshot on this soon after the poller took it.
+FLEET_STREAM_INTERVAL = 0.5
+# Every viewer of a fleet holds a worker thread for as long as its stream
+# lasts, after which the browser reconnects and is only sent the fleet if it
+# changed meanwhile. Keep streams short with sync workers, which serve a
+# single request each; longer ones need a threaded or asynchronous worker
+# class, like gunicorn's gthread or gevent workers.
+FLEET_STREAM_DURATION = 30
+
+TOKEN_REFRESH_MARGIN = 120
+TOKEN_REFRESH_WORKERS = 2
+TOKEN_LOCAL_CACHE_SIZE = 1000
+FLEET_TOKEN_VALID_TTL = 900
+FLEET_TOKEN_INVALID_TTL = 600
+FLEET_TOKEN_PROBES = 2
+FLEET_TOKEN_BACKGROUND_PROBES = 10
+
+CREST_RATE = 100
+CREST_BURST = 200
+CREST_TOKEN_RATE = 20
+CREST_TOKEN_BURST = 40
+CREST_BACKGROUND_RESERVE = 0.25
+CREST_RATE_TIMEOUT = 5
+CREST_BACKGROUND_RATE_TIMEOUT = 30
+CREST_RETRIES = 3
+CREST_BACKOFF = 0.5
+CREST_MAX_BACKOFF = 8
+
+CREST_DEADLINE = 15
+CREST_BREAKER_THRESHOLD = 5
+CREST_BREAKER_WINDOW = 30
+CREST_BREAKER_COOLDOWN = 30
+FLEET_SNAPSHOT_STALE_TTL = 300
+FLEET_SNAPSHOT_STALE_AFTER = 30
+FLEET_REVALIDATE_WORKERS = 4
+
+FLEET_INVITE_WORKERS = 8
+FLEET_INVITE_RETRIES = 3
+FLEET_INVITE_RESEND_AFTER = 30
+FLEET_INVITE_PENDING_TIMEOUT = 60
+
+FLEET_RESTRUCTURE_WORKERS = 10
+
+FLEET_HISTORY_INTERVAL = 30
+FLEET_HISTORY_KEYFRAME_INTERVAL = 20
+FLEET_HISTORY_RETENTION = 604800
+
+PARTICIPATION_INTERVAL = 60
+PARTICIPATION_MAX_CREDIT = 300
+PARTICIPATION_BATCH = 500
+PARTICIPATION_PAGE_SIZE = 50
+
+COALITION_WORKERS = 10
+COALITION_MAX_FLEETS = 20
+COALITION_FLEET_TIMEOUT = 5
+
+METRICS_CACHE = 'default'
+METRICS_FLUSH_INTERVAL = 10
+METRICS_ALLOWED_ADDRESSES = ('127.0.0.1', '::1')
+
+PROFILING_SAMPLE_INTERVAL = 0.005
+PROFILING_KEEP = 200
+
+QUERY_BUDGET_STRICT = False
+QUERY_BUDGET_REPEAT_THRESHOLD = 3
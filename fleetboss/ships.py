@@ -1,8 +1,16 @@
 """
 This file provides the categories and sizes for different ships in the EVE
 Online MMORPG by CCP games. Data from EVE University.
+
+If an index built from the static data export by the buildshipindex command is
+available, ships are classified by their type ID through that index instead,
+with the names below as a fallback for hulls the index does not know about.
 """
 
+import os
+import pickle
+from fleetboss import settings
+
 CATEGORIES = {
     'Abaddon': 'Battleship',
     'Absolution': 'Command Ship',
@@ -291,3 +299,75 @@ SIZES = {
     'Titan': 'Capital',
     'Transport Ship': 'Industrial Ship'
 }
+
+# Names of ship groups in the static data export which differ from the
+# categories used above.
+GROUPS = {
+    'Black Ops': 'Black Op',
+    'Blockade Runner': 'Transport Ship',
+    'Combat Battlecruiser': 'Battlecruiser',
+    'Combat Recon Ship': 'Recon Ship',
+    'Corvette': 'Rookie Ship',
+    'Deep Space Transport': 'Transport Ship',
+    'Electronic Attack Ship': 'Electronic Attack Frigate',
+    'Exhumer': 'Exhumer Barge',
+    'Expedition Frigate': 'Exploration Frigate',
+    'Force Auxiliary': 'Carrier',
+    'Force Recon Ship': 'Recon Ship',
+    'Heavy Interdiction Cruiser': 'Heavy Interdictor',
+    'Industrial': 'Industrial Ship',
+    'Logistics': 'Logistics Cruiser',
+    'Prototype Exploration Ship': 'Exploration Frigate',
+    'Supercarrier': 'Carrier',
+}
+
+INDEX_PATH = getattr(settings, 'SHIP_INDEX', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ships.idx'))
+
+
+def load_index(path=INDEX_PATH):
+    """
+    Loads the precomputed index of ship types, or returns None if it has not
+    been built. The index contains the names of all categories and sizes, a
+    byte string with the size code of each category code and a byte string with
+    the category code of each type ID, where code zero means unknown.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (IOError, OSError):
+        return None
+
+
+INDEX = load_index()
+
+
+def category(type_id, name):
+    """
+    Returns the category of a ship by its type ID, or by its name if the type
+    is not in the index.
+    """
+
+    if INDEX is not None and 0 <= type_id < len(INDEX['types']):
+        code = INDEX['types'][type_id]
+
+        if code:
+            return INDEX['categories'][code]
+
+    return CATEGORIES.get(name, 'Unknown')
+
+
+def size(type_id, name):
+    """
+    Returns the size class of a ship by its type ID, or by its name if the type
+    is not in the index.
+    """
+
+    if INDEX is not None and 0 <= type_id < len(INDEX['types']):
+        code = INDEX['types'][type_id]
+
+        if code:
+            return INDEX['sizes'][INDEX['category_sizes'][code]]
+
+    return SIZES.get(CATEGORIES.get(name, 'Unknown'), 'Unknown')
@@ -0,0 +1,239 @@
+"""
+A short-lived cache of fleet snapshots which is shared between all viewers of
+a fleet. Snapshots are stored using the Django cache framework, so they are
+shared between worker processes whenever the configured backend allows it.
+
+When a snapshot is missing, only a single fetch for that fleet is performed at
+any time. Other requests for the same fleet wait for that fetch to finish and
+use its result instead of making CREST calls of their own.
+
+A snapshot which is older than its TTL but not yet past its stale TTL is still
+served while a fresh one is fetched in the background. This way viewers are
+not held up by CREST being slow, and if CREST is failing they keep seeing the
+last good snapshot. It is only marked as stale, which warns viewers that the
+fleet may be out of date, if refreshing it failed the last time, if the
+circuit breaker is open or if it is older than FLEET_SNAPSHOT_STALE_AFTER.
+
+The version of every snapshot stored is published under a key of its own, so
+that event streams can watch for new versions, like those of the fleet poller,
+with a tiny cache read instead of reading the whole snapshot every time.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db import connection
+from fleetboss import settings, metrics, breaker
+
+
+TTL = getattr(settings, 'FLEET_SNAPSHOT_TTL', 5)
+STALE_TTL = getattr(settings, 'FLEET_SNAPSHOT_STALE_TTL', 300)
+STALE_AFTER = getattr(settings, 'FLEET_SNAPSHOT_STALE_AFTER', 30)
+STATS_TTL = getattr(settings, 'FLEET_SNAPSHOT_RETENTION', 600)
+LOCK_TIMEOUT = getattr(settings, 'FLEET_SNAPSHOT_LOCK_TIMEOUT', 15)
+POLL_INTERVAL = 0.05
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'FLEET_REVALIDATE_WORKERS', 4))
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class _Flight(object):
+    """
+    A single fetch in progress in this process, which other threads can wait
+    on to receive either its result or its error.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+def key(fleet_id):
+    """
+    Returns the cache key under which the snapshot of a fleet is stored.
+    """
+
+    return 'fleetboss:snapshot:%d' % fleet_id
+
+
+def get(fleet_id, fetch):
+    """
+    Returns the cached snapshot of a fleet. If it is past its TTL, it is
+    returned all the same and the given fetch function is called to refresh it
+    in the background, and its stale flag is set if refreshing it is not going
+    well. If there is none, the fetch function is called to create it right
+    away. In both cases we rely on a fetch in progress in another thread or
+    process if there is one.
+    """
+
+    entry = cache.get(key(fleet_id))
+
+    if entry is not None:
+        age = time.time() - entry['time']
+
+        if age < TTL:
+            metrics.inc('fleetboss_cache_lookups_total', cache='snapshot', result='fresh')
+            return entry['snapshot']
+
+        if age < STALE_TTL:
+            metrics.inc('fleetboss_cache_lookups_total', cache='snapshot', result='stale')
+            _flight(fleet_id, fetch, background=True)
+
+            if age >= STALE_AFTER or breaker.tripped() or cache.get(failed_key(fleet_id)):
+                return dict(entry['snapshot'], stale=True)
+
+            return entry['snapshot']
+
+    metrics.inc('fleetboss_cache_lookups_total', cache='snapshot', result='miss')
+    return _flight(fleet_id, fetch).wait()
+
+
+def failed_key(fleet_id):
+    """
+    Returns the cache key which notes that refreshing the snapshot of a fleet
+    failed the last time.
+    """
+
+    return key(fleet_id) + ':failed'
+
+
+def version_key(fleet_id):
+    """
+    Returns the cache key under which the version of the latest snapshot of a
+    fleet is published.
+    """
+
+    return key(fleet_id) + ':version'
+
+
+def put(fleet_id, snapshot):
+    """
+    Stores a fresh snapshot of a fleet in the cache and publishes its version.
+    """
+
+    now = time.time()
+    cache.set(key(fleet_id), {'snapshot': snapshot, 'time': now}, STALE_TTL)
+    cache.delete(failed_key(fleet_id))
+    # Published after the snapshot, so that a stream which sees the version
+    # also finds the snapshot.
+    cache.set(version_key(fleet_id), (snapshot.get('version'), now), STALE_TTL)
+
+
+def published(fleet_id):
+    """
+    Returns the version of the latest snapshot of a fleet if that snapshot is
+    still within its TTL, or None if there is no such snapshot.
+    """
+
+    entry = cache.get(version_key(fleet_id))
+
+    if entry is not None and time.time() - entry[1] < TTL:
+        return entry[0]
+
+
+def get_stats(fleet_id, version):
+    """
+    Returns the FleetStats of a given version of a fleet if they are cached, so
+    that they can be brought up to date with a delta instead of a full pass.
+    """
+
+    return cache.get('fleetboss:stats:%d:%d' % (fleet_id, version))
+
+
+def put_stats(fleet_id, version, stats):
+    """
+    Stores the FleetStats of a given version of a fleet.
+    """
+
+    cache.set('fleetboss:stats:%d:%d' % (fleet_id, version), stats, STATS_TTL)
+
+
+def _flight(fleet_id, fetch, background=False):
+    """
+    Joins the fetch of a fleet in progress in this process, or starts one,
+    either in this thread or in the background.
+    """
+
+    with _flights_lock:
+        flight = _flights.get(fleet_id)
+        leader = flight is None
+
+        if leader:
+            flight = _flights[fleet_id] = _Flight()
+
+    if leader and background:
+        executor.submit(_run, fleet_id, fetch, flight, True)
+    elif leader:
+        _run(fleet_id, fetch, flight)
+
+    return flight
+
+
+def _run(fleet_id, fetch, flight, background=False):
+    try:
+        flight.result = _fetch(fleet_id, fetch)
+    except Exception as e:
+        flight.error = e
+
+        if background:
+            # Nobody waits for a refresh in the background, so the viewers of
+            # the cached snapshot are told instead.
+            cache.set(failed_key(fleet_id), 1, STALE_TTL)
+    finally:
+        with _flights_lock:
+            del _flights[fleet_id]
+
+        flight.done.set()
+
+        if background:
+            connection.close()
+
+
+def _fetch(fleet_id, fetch):
+    """
+    Coalesces fetches between processes by means of a lock in the cache. The
+    process holding the lock fetches the snapshot, the others poll the cache
+    until a fresh one shows up or until the lock is released without a result.
+    The lock expires by itself, so a process dying while holding it blocks
+    nobody.
+    """
+
+    lock = key(fleet_id) + ':lock'
+
+    while not cache.add(lock, 1, LOCK_TIMEOUT):
+        time.sleep(POLL_INTERVAL)
+        snapshot = _fresh(fleet_id)
+
+        if snapshot is not None:
+            return snapshot
+
+    try:
+        snapshot = _fresh(fleet_id)
+
+        if snapshot is None:
+            snapshot = fetch()
+            put(fleet_id, snapshot)
+
+        return snapshot
+    finally:
+        cache.delete(lock)
+
+
+def _fresh(fleet_id):
+    entry = cache.get(key(fleet_id))
+
+    if entry is not None and time.time() - entry['time'] < TTL:
+        return entry['snapshot']
@@ -0,0 +1,362 @@
+"""
+A local stand-in for the CREST API, so that the app can be run and load tested
+on a machine without access to the live API. Point CREST_BASE_URL at it and
+start it with the crestserver command.
+
+Responses come from one of three sources: synthetic fleets which can be
+invited into and restructured, a proxy to the live API which records every
+exchange to a session file, or the replay of such a session. On top of that,
+latency, server errors and rate limiting can be injected into any of them.
+The number of calls answered so far, by endpoint and by status, is served at
+/_calls/ for load tests to read.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import requests
+from fleetboss.synthetic import crest_fleet, pilot, FIRST_CHARACTER, ROLES
+
+
+TOKEN_PATTERN = re.compile(r'Bearer synthetic-(\d+)$')
+
+ROLE_IDS = {
+    'fleetCommander': 1,
+    'wingCommander': 2,
+    'squadCommander': 3,
+    'squadMember': 4,
+}
+
+
+def token(character_id):
+    """
+    Returns a synthetic access token of a character.
+    """
+
+    return 'synthetic-%d' % character_id
+
+
+class Faults(object):
+    """
+    Latency and failures which are injected into responses. The same seed
+    always gives the same sequence of faults for the same sequence of calls.
+    """
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, throttle_rate=0,
+                 retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def apply(self):
+        """
+        Waits for the injected latency, and returns a response to send instead
+        of the real one, or None.
+        """
+
+        with self.lock:
+            delay = max(0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+
+        time.sleep(delay / 1000.0)
+
+        if roll < self.throttle_rate:
+            return 429, {'Retry-After': str(self.retry_after)}, {
+                'key': 'RateLimited', 'message': 'Slow down.'}
+
+        if roll < self.throttle_rate + self.error_rate:
+            return 503, {}, {'key': 'ServiceUnavailable', 'message': 'Injected.'}
+
+
+class Synthetic(object):
+    """
+    Serves synthetic fleets, each generated from its ID the first time it is
+    asked for, or loaded from a fixture written by the crestfixture command.
+    Fleets keep their state, so invites and restructures show up in the next
+    read of the fleet.
+
+    Like the live API, only the boss may use a fleet. Synthetic access tokens,
+    as made by token(), name their character, and calls with the token of any
+    other character than the boss are refused. Other tokens are let through.
+    """
+
+    def __init__(self, fixture=None, size=256, offline_rate=0, seed=None):
+        self.fixture = fixture
+        self.size = size
+        self.offline_rate = offline_rate
+        self.random = random.Random(seed)
+        self.fleets = {}
+        self.ids = iter(range(1000, 10 ** 9))
+        self.lock = threading.Lock()
+
+    def fleet(self, fleet_id):
+        if fleet_id not in self.fleets:
+            if self.fixture is not None:
+                data = json.loads(json.dumps(self.fixture))
+            else:
+                overview, wings, members = crest_fleet(self.size, seed=fleet_id)
+                data = {'overview': overview, 'wings': wings, 'members': members}
+
+            self.fleets[fleet_id] = data
+
+        return self.fleets[fleet_id]
+
+    def handle(self, method, path, body, authorization=None):
+        match = re.match(r'fleets/(\d+)/(.*)$', path)
+
+        if match is None:
+            return 404, {}, {'key': 'NotFound', 'message': 'Not found.'}
+
+        with self.lock:
+            fleet = self.fleet(int(match.group(1)))
+            character = TOKEN_PATTERN.match(authorization or '')
+            boss = [m for m in fleet['members']['items'] if m['roleID'] == 1]
+
+            if character and boss and int(character.group(1)) != boss[0]['character']['id']:
+                return 403, {}, {'key': 'FleetNotBoss',
+                                 'message': 'Only the boss may use the fleet.'}
+
+            return self.route(method, fleet, match.group(2), body)
+
+    def route(self, method, fleet, path, body):
+        if method == 'GET' and path in ('', 'wings/', 'members/'):
+            return 200, {}, fleet[path.rstrip('/') or 'overview']
+
+        if method == 'POST' and path == 'members/':
+            return self.invite(fleet, body)
+
+        if method == 'POST' and path == 'wings/':
+            wing = {'id': next(self.ids), 'name': 'Wing', 'squadsList': []}
+            fleet['wings']['items'].append(wing)
+            return 201, {'Location': '%d/' % wing['id']}, {}
+
+        match = re.match(r'wings/(\d+)/(?:squads/(\d+)/|(squads/))?$', path)
+        wing = match and self.find(fleet['wings']['items'], int(match.group(1)))
+
+        if wing is not None and method == 'POST' and match.group(3):
+            squad = {'id': next(self.ids), 'name': 'Squad'}
+            wing['squadsList'].append(squad)
+            return 201, {'Location': '%d/' % squad['id']}, {}
+
+        if wing is not None and method == 'PUT' and not match.group(3):
+            target = wing
+
+            if match.group(2):
+                target = self.find(wing['squadsList'], int(match.group(2)))
+
+            if target is not None:
+                target['name'] = body['name']
+                return 204, {}, None
+
+        match = re.match(r'members/(\d+)/$', path)
+        member = match and self.find(fleet['members']['items'], int(match.group(1)),
+                                     lambda m: m['character']['id'])
+
+        if member is not None and method == 'PUT':
+            return self.move(fleet, member, body)
+
+        return 404, {}, {'key': 'NotFound', 'message': 'Not found.'}
+
+    def invite(self, fleet, body):
+        character = int(re.search(r'characters/(\d+)/', body['character']['href']).group(1))
+        members = fleet['members']['items']
+
+        if self.find(members, character, lambda m: m['character']['id']) is not None:
+            return 422, {}, {'key': 'FleetCandidateAlreadyInFleet',
+                             'message': 'Already in the fleet.'}
+
+        if self.random.random() < self.offline_rate:
+            return 422, {}, {'key': 'FleetCandidateOffline',
+                             'message': 'The character is offline.'}
+
+        squads = [(w['id'], s['id']) for w in fleet['wings']['items'] for s in w['squadsList']]
+        sizes = dict((s, 0) for s in squads)
+
+        for m in members:
+            if (m['wingID'], m['squadID']) in sizes:
+                sizes[(m['wingID'], m['squadID'])] += 1
+
+        wing, squad = min(squads, key=lambda s: sizes[s]) if squads else (-1, -1)
+        system = members[0]['solarSystem'] if members else {'id': 30090000, 'name': 'Jita'}
+        members.append({
+            'character': pilot(character - FIRST_CHARACTER),
+            'ship': {'id': 670, 'name': 'Capsule'},
+            'solarSystem': system,
+            'wingID': wing,
+            'squadID': squad,
+            'roleID': 4,
+            'roleName': ROLES[4],
+        })
+        return 201, {}, {}
+
+    def move(self, fleet, member, body):
+        role = ROLE_IDS.get(body.get('newRole'))
+
+        if role is None:
+            return 400, {}, {'key': 'BadRole', 'message': 'Unknown role.'}
+
+        wing = body.get('newWingID', -1)
+        squad = body.get('newSquadID', -1)
+
+        for other in fleet['members']['items']:
+            if other is not member and role < 4 and (other['roleID'], other['wingID'],
+                                                     other['squadID']) == (role, wing, squad):
+                return 400, {}, {'key': 'FleetPositionTaken',
+                                 'message': 'The position is taken.'}
+
+        member.update(roleID=role, roleName=ROLES[role], wingID=wing, squadID=squad)
+        return 204, {}, None
+
+    @staticmethod
+    def find(items, id, key=lambda item: item['id']):
+        for item in items:
+            if key(item) == id:
+                return item
+
+
+class Recorder(object):
+    """
+    Passes calls on to the live API and appends every exchange to a session
+    file, one JSON object per line. Access tokens are not recorded.
+    """
+
+    def __init__(self, upstream, path):
+        self.upstream = upstream
+        self.file = open(path, 'a')
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+
+    def handle(self, method, path, body, authorization=None):
+        result = self.session.request(
+            method, self.upstream + path, json=body, timeout=(3.05, 30),
+            headers={'Authorization': authorization} if authorization else {})
+
+        try:
+            payload = result.json()
+        except ValueError:
+            payload = None
+
+        headers = dict((k, v) for k, v in result.headers.items()
+                       if k in ('Location', 'Retry-After'))
+
+        with self.lock:
+            self.file.write(json.dumps({
+                'method': method, 'path': path, 'status': result.status_code,
+                'headers': headers, 'body': payload}) + '\n')
+            self.file.flush()
+
+        return result.status_code, headers, payload
+
+
+class Replay(object):
+    """
+    Serves the exchanges of a recorded session. Calls are answered with the
+    recorded responses to the same method and path in the order they were
+    recorded, repeating the last one once they run out.
+    """
+
+    def __init__(self, path):
+        self.responses = {}
+        self.served = {}
+        self.lock = threading.Lock()
+
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    e = json.loads(line)
+                    self.responses.setdefault((e['method'], e['path']), []).append(
+                        (e['status'], e['headers'], e['body']))
+
+    def handle(self, method, path, body, authorization=None):
+        responses = self.responses.get((method, path))
+
+        if not responses:
+            return 404, {}, {'key': 'NotRecorded', 'message': 'Not recorded.'}
+
+        with self.lock:
+            index = self.served.get((method, path), 0)
+            self.served[(method, path)] = index + 1
+
+        return responses[min(index, len(responses) - 1)]
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(source, faults, host='127.0.0.1', port=8081):
+    """
+    Serves CREST calls from the given source until interrupted. Returns the
+    server, which counts the calls it answered by status in `calls` and by
+    method and path in `endpoints`.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def handle_call(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+            path = self.path.split('?', 1)[0].lstrip('/')
+
+            if path == '_calls/':
+                with server.lock:
+                    counts = {'status': dict(server.calls),
+                              'endpoints': dict(server.endpoints)}
+
+                return self.respond(200, {}, counts)
+
+            response = faults.apply()
+
+            if response is None and not self.headers.get('Authorization'):
+                response = 401, {}, {'key': 'AuthorizationMissing',
+                                     'message': 'No access token.'}
+
+            if response is None:
+                response = source.handle(self.command, path, body,
+                                         self.headers['Authorization'])
+
+            status, headers, payload = response
+            endpoint = '%s %s' % (self.command, re.sub(r'\d+', '<id>', path))
+
+            if 'Location' in headers and not headers['Location'].startswith('http'):
+                headers = dict(headers, Location='http://%s:%d/%s%s' % (
+                    host, port, path, headers['Location']))
+
+            with server.lock:
+                server.calls[status] = server.calls.get(status, 0) + 1
+                server.endpoints[endpoint] = server.endpoints.get(endpoint, 0) + 1
+
+            self.respond(status, headers, payload)
+
+        def respond(self, status, headers, payload):
+            data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+            self.send_response(status)
+
+            for k, v in headers.items():
+                self.send_header(k, v)
+
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = handle_call
+
+        def log_message(self, format, *args):
+            pass
+
+    server = Server((host, port), Handler)
+    server.calls = {}
+    server.endpoints = {}
+    server.lock = threading.Lock()
+    return server
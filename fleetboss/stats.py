@@ -0,0 +1,117 @@
+"""
+Breakdowns of the members of a fleet by ship and location. All breakdowns are
+gathered in a single pass over the members, so adding a new one only means
+adding a key function to BREAKDOWNS.
+"""
+
+from fleetboss import ships
+
+
+def ship_class(m):
+    return m.ship
+
+
+def ship_category(m):
+    return ships.category(m.ship_id, m.ship)
+
+
+def ship_size(m):
+    return ships.size(m.ship_id, m.ship)
+
+
+def solar_system(m):
+    return m.system
+
+
+def docking_status(m):
+    return 'Docked' if m.docked else 'Undocked'
+
+
+BREAKDOWNS = (
+    ('composition_class', ship_class),
+    ('composition_category', ship_category),
+    ('composition_size', ship_size),
+    ('location_system', solar_system),
+    ('location_docked', docking_status),
+)
+
+
+class FleetStats(object):
+    """
+    The counters of every breakdown in BREAKDOWNS for a set of fleet members,
+    along with the names of the members and the name of the fleet boss.
+    """
+
+    def __init__(self, members=()):
+        self.breakdowns = dict((name, {}) for name, _ in BREAKDOWNS)
+        self.member_names = set()
+        self.member_count = 0
+        self.boss = None
+
+        for m in members:
+            self.add(m)
+
+    def add(self, m):
+        """
+        Counts a single FleetMember. Returns the
+        counters which were changed as pairs of breakdown and key.
+        """
+
+        touched = []
+
+        for name, key in BREAKDOWNS:
+            counts = self.breakdowns[name]
+            value = key(m)
+            counts[value] = counts.get(value, 0) + 1
+            touched.append((name, value))
+
+        self.member_names.add(m.name)
+        self.member_count += 1
+
+        if self.boss is None and m.boss:
+            self.boss = m.name
+
+        return touched
+
+    def remove(self, m):
+        """
+        Stops counting a member which was previously added, so that the stats
+        can be kept up to date without another pass over all members.
+        """
+
+        touched = []
+
+        for name, key in BREAKDOWNS:
+            counts = self.breakdowns[name]
+            value = key(m)
+            counts[value] -= 1
+            touched.append((name, value))
+
+            if counts[value] == 0:
+                del counts[value]
+
+        self.member_names.discard(m.name)
+        self.member_count -= 1
+
+        if self.boss == m.name:
+            self.boss = None
+
+        return touched
+
+    def merge(self, other):
+        """
+        Adds the counters and members of another FleetStats object to these,
+        for example to sum up several fleets.
+        """
+
+        for name, counts in other.breakdowns.items():
+            mine = self.breakdowns[name]
+
+            for key, n in counts.items():
+                mine[key] = mine.get(key, 0) + n
+
+        self.member_names |= other.member_names
+        self.member_count += other.member_count
+
+    def __getitem__(self, name):
+        return self.breakdowns[name]
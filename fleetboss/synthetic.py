@@ -0,0 +1,104 @@
+"""
+Synthetic CREST payloads of fleets, for benchmarks and for the local CREST
+stand-in. Fleets look like those of a real op: a fleet commander, commanders
+for most wings and squads, a doctrine of a few hulls with logistics and some
+odd ships mixed in, and most pilots in the staging system.
+
+The type and solar system IDs are made up, but each name always has the same
+ID, so the payloads are consistent between runs and between fleets.
+"""
+
+import random
+from fleetboss import ships
+
+
+HULLS = sorted(ships.CATEGORIES)
+TYPE_IDS = dict((name, 1000 + i) for i, name in enumerate(HULLS))
+
+SYSTEMS = ('Jita', 'Amarr', 'Perimeter', 'Niarja', 'Uedama', 'Sivala',
+           'Ahbazon', 'Rancer', 'Tama', 'Old Man Star')
+SYSTEM_IDS = dict((name, 30090000 + i) for i, name in enumerate(SYSTEMS))
+
+DOCTRINE = ('Abaddon', 'Apocalypse Navy Issue', 'Armageddon')
+LOGISTICS = ('Guardian', 'Basilisk', 'Scimitar', 'Oneiros')
+
+FIRST_CHARACTER = 90000000
+
+ROLES = {
+    1: 'Fleet Commander (Boss)',
+    2: 'Wing Commander',
+    3: 'Squad Commander',
+    4: 'Squad Member',
+}
+
+
+def pilot(i):
+    """
+    Returns the CREST character of the synthetic pilot with the given number.
+    """
+
+    return {'id': FIRST_CHARACTER + i, 'name': 'Pilot %d' % i}
+
+
+def crest_fleet(size, wings=5, squads=5, seed=None, docked=0.2):
+    """
+    Generates the CREST overview, wings and members payloads of a fleet with
+    the given number of members, spread over the given number of wings and
+    squads per wing. The same seed always gives the same fleet.
+    """
+
+    rng = random.Random(seed)
+    overview = {
+        'isFreeMove': rng.random() < 0.5,
+        'isRegistered': rng.random() < 0.5,
+        'isVoiceEnabled': False,
+        'motd': '',
+    }
+    wing_items = [{
+        'id': w, 'name': 'Wing %d' % w, 'squadsList': [
+            {'id': w * 10 + s, 'name': 'Squad %d' % (s + 1)}
+            for s in range(squads)]
+    } for w in range(1, wings + 1)]
+    staging = rng.choice(SYSTEMS)
+
+    # The fleet commander first, then a commander for every wing and squad for
+    # as long as there are enough pilots left to fill them.
+    positions = [(-1, -1, 1)]
+    positions += [(w['id'], -1, 2) for w in wing_items]
+    positions += [(w['id'], s['id'], 3) for w in wing_items for s in w['squadsList']]
+    positions = positions[:max(1, size // 5)]
+    squad_list = [(w['id'], s['id']) for w in wing_items for s in w['squadsList']]
+
+    for i in range(size - len(positions)):
+        wing, squad = squad_list[i % len(squad_list)]
+        positions.append((wing, squad, 4))
+
+    member_items = []
+
+    for i, (wing, squad, role) in enumerate(positions):
+        roll = rng.random()
+
+        if roll < 0.7:
+            hull = rng.choice(DOCTRINE)
+        elif roll < 0.9:
+            hull = rng.choice(LOGISTICS)
+        else:
+            hull = rng.choice(HULLS)
+
+        system = staging if rng.random() < 0.8 else rng.choice(SYSTEMS)
+        p = {
+            'character': pilot(i),
+            'ship': {'id': TYPE_IDS[hull], 'name': hull},
+            'solarSystem': {'id': SYSTEM_IDS[system], 'name': system},
+            'wingID': wing,
+            'squadID': squad,
+            'roleID': role,
+            'roleName': ROLES[role],
+        }
+
+        if rng.random() < docked:
+            p['station'] = {'id': 60003760, 'name': '%s station' % system}
+
+        member_items.append(p)
+
+    return overview, {'items': wing_items}, {'items': member_items}
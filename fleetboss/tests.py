@@ -0,0 +1,1027 @@
+import hashlib
+import json
+import threading
+import time
+from unittest import mock
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import resolve
+from django.middleware.csrf import get_token
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from social.apps.django_app.default.models import UserSocialAuth
+from fleetboss import (breaker, crest, history, invites, participation, querybudget,
+                       querylog, ratelimit, restructure, snapshots, tokenpool, tokens,
+                       views)
+from fleetboss.delta import Delta
+from fleetboss.management.commands.checkbudgets import Command as CheckBudgets
+from fleetboss.models import (Character, Fleet, FleetAccess, FleetHistory, FleetInvite,
+                              FleetLayout, FleetMember, FleetSnapshot, Participation)
+from fleetboss.stats import FleetStats
+from fleetboss.synthetic import crest_fleet
+
+
+# The cache of every process, so that the tests neither need nor touch a
+# shared one.
+local_cache = override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+
+
+def member(id, name, wing=1, squad=10, role=4, system='Jita', ship='Rifter',
+           docked=False):
+    """
+    Returns a member as a row of a snapshot.
+    """
+
+    ship_id = {'Rifter': 587, 'Abaddon': 24692}[ship]
+    system_id = {'Jita': 30000142, 'Amarr': 30002187}[system]
+    return [id, name, ship_id, ship, system_id, system, docked, wing, squad, role,
+            role == 1]
+
+
+def snapshot(*members):
+    """
+    Returns a snapshot of a fleet with the given members, with a wing of two
+    squads.
+    """
+
+    return {
+        'overview': (True, False),
+        'wings': [(1, 'Alpha', [(10, 'One'), (11, 'Two')])],
+        'members': list(members),
+    }
+
+
+def character(character_id, name=None, lifetime=86400):
+    """
+    Creates a character who logged in, with an access token which expires after
+    the given number of seconds.
+    """
+
+    expires = datetime.now() + timedelta(seconds=lifetime)
+    user = Character.objects.create(username=name or 'pilot-%d' % character_id)
+    UserSocialAuth.objects.create(
+        user=user, provider='eveonline', uid=str(character_id),
+        extra_data={'id': character_id, 'access_token': 'token-%d' % character_id,
+                    'expires': expires.strftime(tokens.EXPIRY_FORMAT)})
+    return user
+
+
+class Clock(object):
+    """
+    Stands in for the time module, with a sleep which only moves the clock.
+    """
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Inline(object):
+    """
+    Stands in for an executor, running what is submitted right away.
+    """
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@local_cache
+class QueryBudgetTest(TestCase):
+    """
+    Requests the fleet views the way the checkbudgets command does, with the
+    query budgets enforced, so that a view which makes more queries than its
+    budget fails the tests.
+    """
+
+    fleet_id = 1
+
+    def setUp(self):
+        self.command = CheckBudgets()
+        self.users, self.version = self.command.set_up(self.fleet_id, 50)
+
+    def tearDown(self):
+        cache.delete(snapshots.key(self.fleet_id))
+        cache.delete_many([tokens.key(u.pk) for u in self.users.values()])
+
+    @mock.patch.object(querybudget, 'STRICT', True)
+    def test_views_within_budget(self):
+        clients = {}
+
+        for role, user in self.users.items():
+            clients[role] = Client()
+            clients[role].force_login(user)
+
+        for role, method, path, data in self.command.requests(
+                self.fleet_id, self.users, self.version):
+            with self.subTest(role=role, method=method, path=path, data=data):
+                cache.delete(snapshots.key(self.fleet_id))
+                FleetAccess.objects.filter(id=self.fleet_id).update(last_viewed=None)
+                budget = resolve(path).func.query_budget
+
+                with querylog.recording() as queries:
+                    response = getattr(clients[role], method)(path, data or {})
+
+                # Only the outsider is turned away, everyone else is served.
+                self.assertEqual(response.status_code, 302 if role == 'outsider' else 200)
+                self.assertLessEqual(len(queries), budget)
+
+
+@local_cache
+class StaleSnapshotTest(SimpleTestCase):
+
+    fleet_id = 1
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(snapshots, 'executor', Inline())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache(self, age):
+        cache.set(snapshots.key(self.fleet_id), {
+            'snapshot': snapshot(member(1, 'Pilot A')), 'time': time.time() - age})
+
+    def test_refreshing(self):
+        self.cache(snapshots.TTL + 1)
+        fetch = mock.Mock(return_value=snapshot(member(2, 'Pilot B')))
+
+        self.assertNotIn('stale', snapshots.get(self.fleet_id, fetch))
+        fetch.assert_called_once_with()
+        self.assertEqual(snapshots.get(self.fleet_id, fetch)['members'][0][1], 'Pilot B')
+
+    def test_refresh_failed(self):
+        self.cache(snapshots.TTL + 1)
+        fetch = mock.Mock(side_effect=crest.CrestError('CREST is down.'))
+
+        self.assertTrue(snapshots.get(self.fleet_id, fetch)['stale'])
+
+        # A refresh which succeeds clears the flag.
+        fetch.side_effect, fetch.return_value = None, snapshot(member(2, 'Pilot B'))
+        self.cache(snapshots.TTL + 1)
+        self.assertNotIn('stale', snapshots.get(self.fleet_id, fetch))
+
+    def test_breaker_open(self):
+        self.cache(snapshots.TTL + 1)
+        cache.set(breaker.TRIPPED, 1)
+        fetch = mock.Mock(return_value=snapshot(member(2, 'Pilot B')))
+
+        self.assertTrue(snapshots.get(self.fleet_id, fetch)['stale'])
+
+    def test_too_old(self):
+        self.cache(snapshots.STALE_AFTER)
+        fetch = mock.Mock(return_value=snapshot(member(2, 'Pilot B')))
+
+        self.assertTrue(snapshots.get(self.fleet_id, fetch)['stale'])
+
+
+@local_cache
+class TokenPoolTest(TestCase):
+
+    fleet_id = 1
+
+    def setUp(self):
+        cache.clear()
+        tokens._tokens.clear()
+        self.boss = character(1, 'boss')
+        self.members = [FleetMember(*member(i, 'Pilot %d' % i)) for i in range(2, 12)]
+
+        for m in self.members:
+            character(m.id)
+
+        self.valid = set()
+        patchers = [
+            mock.patch.object(tokenpool.crest, 'get', side_effect=self.get),
+            mock.patch.object(tokenpool, 'Fleet', side_effect=self.read),
+        ]
+
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+        self.get, self.read = [patcher.start() for patcher in patchers]
+
+    def get(self, path, token, priority):
+        return mock.Mock(status_code=200 if token in self.valid else 403)
+
+    def read(self, fleet_id, character, priority):
+        if character.access_token not in self.valid:
+            raise crest.CrestError('Forbidden.', mock.Mock(status_code=403))
+
+        return character.access_token
+
+    def fetch(self, priority=crest.INTERACTIVE):
+        return tokenpool.fetch(self.fleet_id, [self.boss], self.members, priority)
+
+    def probed(self):
+        return [c[0][1] for c in self.get.call_args_list]
+
+    def test_boss(self):
+        self.valid = {'token-1'}
+
+        self.assertEqual(self.fetch(), ('token-1', self.boss))
+        self.assertEqual(self.probed(), ['token-1'])
+
+        # Known to work, so it is no longer probed. A single member is.
+        self.assertEqual(self.fetch(), ('token-1', self.boss))
+        self.assertEqual(len(self.probed()), 2)
+        self.assertNotEqual(self.probed()[1], 'token-1')
+
+    def test_probes_capped(self):
+        with self.assertRaises(crest.CrestError):
+            self.fetch()
+
+        self.assertEqual(len(self.probed()), tokenpool.PROBES[crest.INTERACTIVE])
+        self.assertEqual(self.probed()[0], 'token-1')
+
+        # The tokens which were rejected are not probed again, others are.
+        with self.assertRaises(crest.CrestError):
+            self.fetch()
+
+        self.assertEqual(len(set(self.probed())), 2 * tokenpool.PROBES[crest.INTERACTIVE])
+
+    def test_background_probes_more(self):
+        with self.assertRaises(crest.CrestError):
+            self.fetch(crest.BACKGROUND)
+
+        self.assertEqual(len(self.probed()), tokenpool.PROBES[crest.BACKGROUND])
+
+    def test_turns(self):
+        self.valid = {'token-1', 'token-2'}
+        self.fetch()
+        self.fetch()
+        used = set(self.fetch()[0] for _ in range(4))
+
+        self.assertEqual(used, self.valid)
+
+    def test_grows_by_one_probe(self):
+        self.valid = {'token-1', 'token-2', 'token-3'}
+        self.fetch()
+        self.get.reset_mock()
+        self.fetch()
+
+        self.assertEqual(self.get.call_count, 1)
+
+
+@local_cache
+class LayoutCsrfTest(TestCase):
+
+    fleet_id = 1
+
+    def setUp(self):
+        self.boss = character(1, 'boss')
+        FleetAccess.objects.create(id=self.fleet_id, owner=self.boss)
+        self.layout = FleetLayout.objects.create(
+            owner=self.boss, name='Op', data=json.dumps({'wings': []}))
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(self.boss)
+
+    def post(self, path, data, csrf=False):
+        headers = {}
+
+        if csrf:
+            request = RequestFactory().get('/')
+            headers['HTTP_X_CSRFTOKEN'] = get_token(request)
+            self.client.cookies[settings.CSRF_COOKIE_NAME] = request.META['CSRF_COOKIE']
+
+        return self.client.post('/fleet/%d/%s/' % (self.fleet_id, path), data, **headers)
+
+    def test_rejected_without_token(self):
+        self.assertEqual(self.post('layouts', {'name': 'New', 'layout': '{"wings": []}'}).status_code, 403)
+        self.assertEqual(self.post('restructure', {'layout': self.layout.id, 'apply': 'true'}).status_code, 403)
+        self.assertFalse(FleetLayout.objects.filter(name='New').exists())
+
+    def test_accepted_with_token(self):
+        response = self.post('layouts', {'name': 'New', 'layout': '{"wings": []}'}, csrf=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(FleetLayout.objects.filter(name='New').exists())
+
+
+class DeltaTest(SimpleTestCase):
+
+    def setUp(self):
+        self.old = [FleetMember(*m) for m in (
+            member(1, 'Pilot A'),
+            member(2, 'Pilot B'),
+            member(3, 'Pilot C', system='Amarr'),
+        )]
+        self.new = [FleetMember(*m) for m in (
+            member(1, 'Pilot A'),
+            member(2, 'Pilot B', ship='Abaddon', docked=True),
+            member(4, 'Pilot D'),
+        )]
+
+    def test_changes(self):
+        delta = Delta(self.old, self.new)
+
+        self.assertEqual([m.name for m in delta.joined], ['Pilot D'])
+        self.assertEqual([m.name for m in delta.left], ['Pilot C'])
+        self.assertEqual(delta.as_json()['changed'], [
+            {'id': 2, 'ship': 'Abaddon', 'docked': True}])
+        self.assertFalse(Delta(self.new, self.new))
+
+    def test_apply(self):
+        stats = FleetStats(self.old)
+        changed = Delta(self.old, self.new).apply(stats)
+        expected = FleetStats(self.new)
+
+        self.assertEqual(stats.breakdowns, expected.breakdowns)
+        self.assertEqual(stats.member_names, expected.member_names)
+        self.assertEqual(stats.member_count, 3)
+        self.assertEqual(changed['location_system'], {'Jita': 3, 'Amarr': 0})
+        self.assertEqual(changed['composition_class'], {'Rifter': 2, 'Abaddon': 1})
+        self.assertEqual(changed['location_docked'], {'Docked': 1, 'Undocked': 2})
+
+
+@local_cache
+class RateLimitTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.clock = Clock()
+        patcher = mock.patch.object(ratelimit, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_take(self):
+        for _ in range(4):
+            self.assertEqual(ratelimit.take('bucket', 2, 4), 0)
+
+        self.assertEqual(ratelimit.take('bucket', 2, 4), 0.5)
+        self.clock.sleep(0.5)
+        self.assertEqual(ratelimit.take('bucket', 2, 4), 0)
+
+        # The bucket does not fill up beyond its burst.
+        self.clock.sleep(60)
+
+        for _ in range(4):
+            self.assertEqual(ratelimit.take('bucket', 2, 4), 0)
+
+        self.assertGreater(ratelimit.take('bucket', 2, 4), 0)
+
+    def test_reserve(self):
+        for _ in range(3):
+            self.assertEqual(ratelimit.take('bucket', 1, 4, reserve=1), 0)
+
+        self.assertEqual(ratelimit.take('bucket', 1, 4, reserve=1), 1)
+        self.assertEqual(ratelimit.take('bucket', 1, 4), 0)
+
+    @mock.patch.object(ratelimit, 'GLOBAL_BURST', 1)
+    @mock.patch.object(ratelimit, 'GLOBAL_RATE', 0.01)
+    def test_acquire_refunds(self):
+        self.assertTrue(ratelimit.acquire('token'))
+        self.assertFalse(ratelimit.acquire('token'))
+
+        # The bucket of the access token only lost the call which was made.
+        key = 'fleetboss:rate:token:' + hashlib.sha1(b'token').hexdigest()
+        self.assertEqual(cache.get(key)[0], ratelimit.TOKEN_BURST - 1)
+
+
+@local_cache
+class BreakerTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def trip(self):
+        for _ in range(breaker.THRESHOLD):
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+
+    def cool_down(self):
+        cache.delete(breaker.OPEN)
+
+    def test_closed(self):
+        for _ in range(breaker.THRESHOLD - 1):
+            breaker.failure()
+
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+
+    def test_open(self):
+        self.trip()
+        self.assertFalse(breaker.allow())
+
+    def test_trial_succeeds(self):
+        self.trip()
+        self.cool_down()
+
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_trial_fails(self):
+        self.trip()
+        self.cool_down()
+
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+        # A single failure after the next cooldown opens it again.
+        self.cool_down()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+
+class RestructureTest(SimpleTestCase):
+
+    def setUp(self):
+        self.fleet = Fleet(1, snapshot=snapshot(
+            member(1, 'Boss', wing=-1, squad=-1, role=1),
+            member(2, 'Wing', squad=-1, role=2),
+            member(3, 'Squad', role=3),
+            member(4, 'Pilot A'),
+            member(5, 'Pilot B', squad=11),
+        ))
+        self.layout = restructure.layout_of(self.fleet)
+
+    def moves(self, operations):
+        return dict((op.member.name, op) for op in operations if op.kind == 'move')
+
+    def assertRunnable(self, operations):
+        done = set()
+
+        while len(done) < len(operations):
+            batch = [op for op in operations
+                     if op not in done and all(d in done for d in op.depends)]
+            self.assertTrue(batch, 'The operations depend on each other.')
+            done.update(batch)
+
+    def test_current_layout(self):
+        self.assertEqual(restructure.plan(self.fleet, self.layout), [])
+
+    def test_move_member(self):
+        self.layout['wings'][0]['squads'][0]['members'].remove('Pilot A')
+        self.layout['wings'][0]['squads'][1]['members'].append('Pilot A')
+        operations = restructure.plan(self.fleet, self.layout)
+
+        self.assertEqual(len(operations), 1)
+        self.assertEqual(operations[0].call(7), (
+            'PUT', 'fleets/7/members/4/',
+            {'newRole': 'squadMember', 'newWingID': 1, 'newSquadID': 11}))
+
+    def test_rename_wing(self):
+        self.layout['wings'][0]['name'] = 'Main'
+        operations = restructure.plan(self.fleet, self.layout)
+
+        self.assertEqual([op.kind for op in operations], ['rename_wing'])
+        self.assertEqual(operations[0].call(7), (
+            'PUT', 'fleets/7/wings/1/', {'name': 'Main'}))
+
+    def test_create_wing(self):
+        self.layout['wings'][0]['squads'][1]['members'].remove('Pilot B')
+        self.layout['wings'].append({'name': 'Bravo', 'commander': None, 'squads': [
+            {'name': 'Reserve', 'commander': None, 'members': ['Pilot B']}]})
+        operations = restructure.plan(self.fleet, self.layout)
+
+        self.assertEqual([op.kind for op in operations], [
+            'create_wing', 'rename_wing', 'create_squad', 'rename_squad', 'move'])
+        self.assertRunnable(operations)
+
+        create_wing, _, create_squad, _, move = operations
+        self.assertIn(create_wing, create_squad.depends)
+        self.assertIn(create_squad, move.depends)
+
+        create_wing.result, create_squad.result = 2, 20
+        self.assertEqual(move.call(7)[2], {
+            'newRole': 'squadMember', 'newWingID': 2, 'newSquadID': 20})
+
+    def test_take_position(self):
+        squad = self.layout['wings'][0]['squads'][0]
+        squad['commander'], squad['members'] = 'Pilot A', ['Squad']
+        moves = self.moves(restructure.plan(self.fleet, self.layout))
+
+        self.assertEqual(set(moves), {'Pilot A', 'Squad'})
+        self.assertEqual(moves['Pilot A'].role, 'squadCommander')
+        self.assertIn(moves['Squad'], moves['Pilot A'].depends)
+
+    def test_swap_commanders(self):
+        self.layout['commander'] = 'Wing'
+        self.layout['wings'][0]['commander'] = 'Boss'
+        operations = restructure.plan(self.fleet, self.layout)
+
+        self.assertRunnable(operations)
+        parked = [op for op in operations
+                  if op.kind == 'move' and op.role == 'squadMember']
+        self.assertEqual(len(parked), 1)
+        self.assertIn(parked[0].member.name, ('Boss', 'Wing'))
+
+    def test_invalid_layouts(self):
+        self.layout['wings'][0]['squads'][1]['members'].append('Pilot A')
+
+        with self.assertRaises(restructure.LayoutError):
+            restructure.plan(self.fleet, self.layout)
+
+        with self.assertRaises(restructure.LayoutError):
+            restructure.plan(self.fleet, {'wings': [{'squads': []}]})
+
+
+@local_cache
+class HistoryTest(TestCase):
+
+    fleet_id = 1
+
+    def setUp(self):
+        FleetAccess.objects.create(
+            id=self.fleet_id, owner=Character.objects.create(username='history'))
+
+    def record(self, *members):
+        cache.delete(history.key(self.fleet_id) + ':due')
+        return history.record(self.fleet_id, Fleet(self.fleet_id, snapshot=snapshot(*members)))
+
+    @mock.patch.object(history, 'KEYFRAME_INTERVAL', 2)
+    def test_keyframes(self):
+        self.assertTrue(self.record(member(1, 'Pilot A')))
+        self.assertFalse(self.record(member(1, 'Pilot A')))
+
+        for system in ('Amarr', 'Jita', 'Amarr'):
+            self.assertTrue(self.record(member(1, 'Pilot A', system=system)))
+
+        self.assertEqual(list(FleetHistory.objects.order_by('id').values_list(
+            'keyframe', flat=True)), [True, False, False, True])
+
+    @mock.patch.object(history, 'KEYFRAME_INTERVAL', 1)
+    def test_series(self):
+        self.record(member(1, 'Pilot A'), member(2, 'Pilot B'))
+        self.record(member(1, 'Pilot A'), member(2, 'Pilot B', system='Amarr'))
+        self.record(member(1, 'Pilot A'))
+        self.record(member(1, 'Pilot A'), member(3, 'Pilot C', system='Amarr'))
+        times = list(FleetHistory.objects.order_by('id').values_list('time', flat=True))
+
+        self.assertEqual(history.series(
+            self.fleet_id, 'location_system', times[0], times[-1]),
+            (['Jita', 'Amarr'], [(times[0], [2, 0]), (times[1], [1, 1]),
+                                 (times[2], [1, 0]), (times[3], [1, 1])]))
+
+        # The keyframe before the start is read, but not returned.
+        self.assertEqual(history.series(
+            self.fleet_id, 'location_system', times[1], times[1]),
+            (['Amarr', 'Jita'], [(times[1], [1, 1])]))
+
+        with self.assertRaises(KeyError):
+            history.series(self.fleet_id, 'nonsense', times[0], times[-1])
+
+
+@local_cache
+class TokenTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tokens._tokens.clear()
+        patchers = [
+            mock.patch.object(tokens, 'executor', Inline()),
+            mock.patch.object(tokens, 'connection'),
+            mock.patch.object(UserSocialAuth, 'refresh_token', autospec=True,
+                              side_effect=self.refresh_token),
+        ]
+
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.fail_refresh = False
+
+    def refresh_token(self, provider, strategy):
+        if self.fail_refresh:
+            raise RuntimeError('Refresh failed.')
+
+        provider.extra_data.update(access_token='refreshed', expires_in=1200)
+
+    def test_fresh(self):
+        user = character(1)
+
+        self.assertEqual(tokens.get(user)['access_token'], 'token-1')
+        self.assertFalse(UserSocialAuth.refresh_token.called)
+
+    def test_refresh(self):
+        user = character(1, lifetime=60)
+
+        # The token which is about to expire is still used, while the refreshed
+        # one is used from then on, by this process and by others.
+        self.assertEqual(tokens.get(user)['access_token'], 'token-1')
+        self.assertEqual(tokens.get(user)['access_token'], 'refreshed')
+        self.assertEqual(cache.get(tokens.key(user.pk))['access_token'], 'refreshed')
+        self.assertEqual(UserSocialAuth.refresh_token.call_count, 1)
+        self.assertNotIn(user.pk, tokens._scheduled)
+
+    def test_refresh_expired(self):
+        user = character(1, lifetime=0)
+
+        self.assertEqual(tokens.get(user)['access_token'], 'refreshed')
+
+    def test_refresh_failed(self):
+        user = character(1, lifetime=60)
+        self.fail_refresh = True
+
+        with self.assertLogs('fleetboss.tokens', 'ERROR') as logs:
+            self.assertEqual(tokens.get(user)['access_token'], 'token-1')
+
+        self.assertIn('Could not refresh the token of character %d.' % user.pk,
+                      logs.output[0])
+        self.assertNotIn(user.pk, tokens._scheduled)
+
+        # Scheduled again by the next request.
+        self.fail_refresh = False
+        tokens.get(user)
+
+        self.assertEqual(tokens.get(user)['access_token'], 'refreshed')
+
+    @mock.patch.object(tokens, 'LOCAL_TOKENS', 4)
+    def test_bound(self):
+        users = [character(i) for i in range(1, 10)]
+
+        for user in users:
+            tokens.get(user)
+            self.assertLessEqual(len(tokens._tokens), tokens.LOCAL_TOKENS)
+
+        # Dropped tokens are still found in the shared cache.
+        with self.assertNumQueries(0):
+            self.assertEqual(tokens.get(users[0])['access_token'], 'token-1')
+
+    @mock.patch.object(tokens, 'LOCAL_TOKENS', 4)
+    def test_bound_drops_expired_first(self):
+        now = time.time()
+
+        for user_id in range(1, 5):
+            tokens._store(user_id, {'id': user_id, 'access_token': 'token-%d' % user_id,
+                                    'expires': now + (-1 if user_id == 3 else 3600)})
+
+        tokens._store(5, {'id': 5, 'access_token': 'token-5', 'expires': now + 3600})
+
+        self.assertEqual(sorted(tokens._tokens), [1, 2, 4, 5])
+
+
+@local_cache
+class InviteTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tokens._tokens.clear()
+        self.fleet = FleetAccess.objects.create(id=1, owner=character(1, 'boss'))
+        self.pilot = character(2)
+        patchers = [
+            mock.patch.object(invites, 'executor'),
+            mock.patch.object(invites, 'connection'),
+            mock.patch.object(invites.crest, 'post'),
+            mock.patch.object(invites.crest, 'backoff'),
+        ]
+
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+        self.executor, _, self.post, self.backoff = [patcher.start() for patcher in patchers]
+
+    def age(self, invite, status, seconds):
+        FleetInvite.objects.filter(pk=invite.pk).update(
+            status=status, updated=datetime.now() - timedelta(seconds=seconds))
+
+    def send(self, *responses):
+        invite = invites.enqueue(self.fleet, self.pilot)
+        self.post.side_effect = responses
+        invites.send(invite.pk)
+        return FleetInvite.objects.get(pk=invite.pk)
+
+    def test_repeat_clicks(self):
+        invite = invites.enqueue(self.fleet, self.pilot)
+
+        for status in FleetInvite.PENDING + (FleetInvite.SENT,):
+            self.age(invite, status, 5)
+            self.assertEqual(invites.enqueue(self.fleet, self.pilot).pk, invite.pk)
+
+        self.executor.submit.assert_called_once_with(invites.send, invite.pk)
+        self.assertEqual(FleetInvite.objects.count(), 1)
+
+    def test_requeue(self):
+        invite = invites.enqueue(self.fleet, self.pilot)
+
+        for status, seconds in ((FleetInvite.SENDING, invites.PENDING_TIMEOUT),
+                                (FleetInvite.SENT, invites.RESEND_AFTER),
+                                (FleetInvite.OFFLINE, 0),
+                                (FleetInvite.FAILED, 0)):
+            self.executor.reset_mock()
+            self.age(invite, status, seconds)
+            FleetInvite.objects.filter(pk=invite.pk).update(attempts=2, message='Nope.')
+            requeued = invites.enqueue(self.fleet, self.pilot)
+
+            self.executor.submit.assert_called_once_with(invites.send, invite.pk)
+            self.assertEqual(
+                FleetInvite.objects.filter(pk=invite.pk).values_list(
+                    'status', 'attempts', 'message').get(),
+                (FleetInvite.QUEUED, 0, ''))
+            self.assertEqual(requeued.status, FleetInvite.QUEUED)
+
+    def test_sent(self):
+        invite = self.send(mock.Mock(status_code=201))
+
+        self.assertEqual((invite.status, invite.attempts), (FleetInvite.SENT, 1))
+        path, token = self.post.call_args[0]
+        self.assertEqual((path, token), ('fleets/1/members/', 'token-1'))
+        self.assertEqual(self.post.call_args[1]['json']['character']['href'],
+                         crest.url('characters/2/'))
+
+    def test_transient_retried(self):
+        invite = self.send(mock.Mock(status_code=503),
+                           crest.CrestError("CREST call could not be completed."),
+                           mock.Mock(status_code=201))
+
+        self.assertEqual((invite.status, invite.attempts), (FleetInvite.SENT, 3))
+        self.assertEqual(self.backoff.call_count, 2)
+
+    def test_transient_gives_up(self):
+        invite = self.send(*[mock.Mock(status_code=429)] * (invites.RETRIES + 1))
+
+        self.assertEqual((invite.status, invite.attempts, invite.message),
+                         (FleetInvite.FAILED, invites.RETRIES + 1,
+                          "CREST returned status 429."))
+        self.assertEqual(self.post.call_count, invites.RETRIES + 1)
+
+    def test_offline(self):
+        response = mock.Mock(status_code=422)
+        response.json.return_value = {'key': 'FleetCandidateOffline'}
+        invite = self.send(response)
+
+        self.assertEqual((invite.status, invite.attempts), (FleetInvite.OFFLINE, 1))
+
+    def test_refused(self):
+        response = mock.Mock(status_code=403)
+        response.json.side_effect = ValueError
+        invite = self.send(response)
+
+        self.assertEqual((invite.status, invite.message),
+                         (FleetInvite.FAILED, "CREST refused the invite (403)."))
+
+    def test_no_owner(self):
+        self.fleet.owner = None
+        self.fleet.save()
+        invite = self.send()
+
+        self.assertEqual((invite.status, invite.attempts), (FleetInvite.FAILED, 1))
+        self.assertFalse(self.post.called)
+
+
+@local_cache
+class ParticipationTest(TestCase):
+
+    def setUp(self):
+        self.boss = Character.objects.create(username='boss')
+        FleetAccess.objects.create(id=1, owner=self.boss)
+        FleetAccess.objects.create(id=2)
+        history._names.clear()
+        self.start = datetime.now().replace(microsecond=0)
+
+    def counters(self):
+        return list(Participation.objects.order_by('day', 'character_id').values_list(
+            'day', 'character_id', 'ship_id', 'seconds', 'polls', 'first_seen', 'last_seen'))
+
+    @mock.patch.object(participation, 'BATCH', 1)
+    def test_upsert(self):
+        later = self.start + timedelta(minutes=1)
+        participation.upsert(1, self.start, 0, {(2, 587)})
+        participation.upsert(1, later, 60, {(2, 587), (3, 24692)})
+        participation.upsert(1, later, 60, {(2, 587)})
+        day = self.start.date()
+
+        self.assertEqual(self.counters(), [
+            (day, 2, 587, 120, 3, self.start, later),
+            (day, 3, 24692, 60, 1, later, later),
+        ])
+
+        # Another day, ship or fleet has counters of its own.
+        tomorrow = self.start + timedelta(days=1)
+        participation.upsert(1, tomorrow, 60, {(2, 587), (2, 24692)})
+        participation.upsert(2, tomorrow, 60, {(2, 587)})
+
+        self.assertEqual(Participation.objects.count(), 5)
+        self.assertEqual(Participation.objects.get(day=day, character_id=2).polls, 3)
+
+    @mock.patch.object(participation, 'PAGE_SIZE', 2)
+    def test_report(self):
+        pilots = [FleetMember(*member(i, 'Pilot %d' % i)) for i in range(2, 7)]
+        history.intern_names(pilots)
+
+        for i, pilot in enumerate(pilots):
+            participation.upsert(1, self.start, 60 * (i + 1), {(pilot.id, pilot.ship_id)})
+
+        # Not visible to the boss of the first fleet.
+        participation.upsert(2, self.start, 3600, {(7, 587)})
+        client = Client()
+        client.force_login(self.boss)
+
+        pages = [client.get('/participation/', {'page': page}).context
+                 for page in (1, 2, 3, 'nonsense', 99)]
+
+        self.assertEqual([[r['character_id'] for r in p['rows']] for p in pages],
+                         [[6, 5], [4, 3], [2], [6, 5], [2]])
+        self.assertEqual(pages[0]['page'].paginator.num_pages, 3)
+        self.assertEqual({k: pages[0]['rows'][0][k] for k in (
+            'name', 'ship', 'seconds', 'hours', 'polls', 'fleets', 'days')}, {
+            'name': 'Pilot 6', 'ship': 'Rifter', 'seconds': 300, 'hours': 0.1,
+            'polls': 1, 'fleets': 1, 'days': 1})
+
+
+@local_cache
+class SingleFlightTest(SimpleTestCase):
+
+    fleet_id = 1
+    threads = 8
+
+    def setUp(self):
+        cache.clear()
+        self.release = threading.Event()
+        self.joined = threading.Semaphore(0)
+        test = self
+
+        class Flight(snapshots._Flight):
+            def wait(self):
+                if not self.done.is_set():
+                    test.joined.release()
+
+                return super(Flight, self).wait()
+
+        patcher = mock.patch.object(snapshots, '_Flight', Flight)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self):
+        self.release.wait(5)
+
+        if isinstance(self.result, Exception):
+            raise self.result
+
+        return self.result
+
+    def get_all(self):
+        fetch = mock.Mock(side_effect=self.fetch)
+        results = [None] * self.threads
+
+        def get(i):
+            try:
+                results[i] = snapshots.get(self.fleet_id, fetch)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=get, args=(i,)) for i in range(self.threads)]
+
+        for thread in threads:
+            thread.start()
+
+        # Released once all but the thread fetching are waiting for it.
+        for _ in range(self.threads - 1):
+            self.assertTrue(self.joined.acquire(timeout=5))
+
+        self.release.set()
+
+        for thread in threads:
+            thread.join(5)
+
+        return fetch, results
+
+    def test_single_fetch(self):
+        self.result = snapshot(member(1, 'Pilot A'))
+        fetch, results = self.get_all()
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(results, [self.result] * self.threads)
+        self.assertEqual(snapshots.get(self.fleet_id, fetch), self.result)
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_error_shared(self):
+        self.result = crest.CrestError('CREST is down.')
+        fetch, results = self.get_all()
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(results, [self.result] * self.threads)
+        self.assertEqual(snapshots._flights, {})
+
+    @mock.patch.object(snapshots, 'POLL_INTERVAL', 0.01)
+    def test_other_process(self):
+        # Another process holds the lock, so its snapshot is waited for.
+        cache.add(snapshots.key(self.fleet_id) + ':lock', 1)
+        fetch = mock.Mock()
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(snapshots.get(self.fleet_id, fetch)))
+        thread.start()
+        snapshots.put(self.fleet_id, snapshot(member(1, 'Pilot A')))
+        thread.join(5)
+
+        self.assertEqual(result, [snapshot(member(1, 'Pilot A'))])
+        self.assertFalse(fetch.called)
+
+
+@local_cache
+class StreamTest(TestCase):
+
+    fleet_id = 1
+
+    def setUp(self):
+        cache.clear()
+        tokens._tokens.clear()
+        self.users, self.version = CheckBudgets().set_up(self.fleet_id, 20)
+        self.client.force_login(self.users['viewer'])
+        self.clock = Clock()
+        self.sleeps = 0
+        self.on_sleep = {}
+        patchers = [
+            mock.patch.object(views, 'time', self),
+            mock.patch.object(views.settings, 'FLEET_STREAM_INTERVAL', 0.5, create=True),
+            mock.patch.object(views.settings, 'FLEET_STREAM_DURATION', 20, create=True),
+            mock.patch.object(snapshots, 'get', wraps=snapshots.get),
+        ]
+
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+        self.get = [patcher.start() for patcher in patchers][-1]
+
+    def time(self):
+        return self.clock.time()
+
+    def sleep(self, seconds):
+        self.clock.sleep(seconds)
+        self.sleeps += 1
+
+        if self.sleeps in self.on_sleep:
+            self.on_sleep[self.sleeps]()
+
+    def publish(self):
+        """
+        Takes and publishes a new snapshot, the way the fleet poller does.
+        """
+
+        self.published = FleetSnapshot.record(
+            self.fleet_id, Fleet.snapshot_from_crest(*crest_fleet(20, seed=2)))['version']
+        snapshots.put(self.fleet_id, FleetSnapshot.latest(self.fleet_id).snapshot)
+
+    def events(self, **headers):
+        response = self.client.get('/fleet/%d/stream/' % self.fleet_id,
+                                   self.data, **headers)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        # Streams end by themselves, so the content can be read to the end.
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content.endswith('\n\n'))
+        return content.split('\n\n')[:-1]
+
+    def assertFleet(self, event, version):
+        head, data = event.rsplit('\n', 1)
+
+        self.assertEqual(head, 'id: %d\nevent: fleet' % version)
+        self.assertTrue(data.startswith('data: '))
+        self.assertEqual(json.loads(data[len('data: '):])['version'], version)
+
+    def test_events(self):
+        self.data = {}
+        self.on_sleep = {4: self.publish}
+        events = self.events()
+
+        self.assertEqual(events[0], 'retry: 1000')
+        self.assertFleet(events[1], self.version)
+        self.assertFleet(events[2], self.published)
+        self.assertEqual(events[3:], [': keep-alive'])
+        self.assertEqual(self.sleeps, 40)
+
+        # The snapshot is only read by the view and once the version changed.
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_up_to_date(self):
+        self.data = {'since': self.version}
+
+        self.assertEqual(self.events(), ['retry: 1000', ': keep-alive'])
+
+        # Browsers which reconnect send the version they saw last instead.
+        self.data = {}
+        self.assertEqual(self.events(HTTP_LAST_EVENT_ID=str(self.version)),
+                         ['retry: 1000', ': keep-alive'])
+
+    def test_denied(self):
+        self.data = {'since': self.version}
+
+        def revoke():
+            FleetAccess.objects.get(id=self.fleet_id).access.clear()
+            self.publish()
+
+        self.on_sleep = {2: revoke}
+
+        self.assertEqual(self.events(), ['retry: 1000', 'event: denied\ndata: {}'])
+        self.assertEqual(self.sleeps, 2)
+
+    @mock.patch.object(snapshots, 'published', return_value=None)
+    def test_not_published(self, published):
+        self.data = {'since': self.version}
+        self.events()
+
+        # Without a poller the stream refreshes the shared snapshot itself.
+        self.assertEqual(self.get.call_count, 1 + self.sleeps)
@@ -0,0 +1,163 @@
+"""
+The pool of tokens which can be used to read a fleet. Besides the owner of a
+fleet and the character viewing it, any member of the fleet who logged in has
+a fleetRead token which may work, so polling is spread over all of them.
+
+Whether a token works for a fleet is remembered for a while, so that a broken
+token costs a single cheap call now and then instead of a failed fleet build on
+every fetch. Most members cannot read the fleet, as CREST only lets the boss
+do so, so a fetch only probes a few tokens of unknown status. A page load
+probes fewer of them than the fleet poller, which finds the working tokens
+over time.
+"""
+
+import logging
+import time
+from django.core.cache import cache
+from fleetboss import settings, crest
+from fleetboss.models import Character, Fleet
+
+
+VALID_TTL = getattr(settings, 'FLEET_TOKEN_VALID_TTL', 900)
+INVALID_TTL = getattr(settings, 'FLEET_TOKEN_INVALID_TTL', 600)
+
+# The number of tokens of unknown status a single fetch may probe.
+PROBES = {
+    crest.INTERACTIVE: getattr(settings, 'FLEET_TOKEN_PROBES', 2),
+    crest.BACKGROUND: getattr(settings, 'FLEET_TOKEN_BACKGROUND_PROBES', 10),
+}
+
+# Statuses with which CREST tells us that a token cannot read a fleet, as
+# opposed to the API itself having trouble.
+REJECTED = (401, 403, 404)
+
+logger = logging.getLogger(__name__)
+
+
+def key(fleet_id):
+    """
+    Returns the cache key under which the token memo of a fleet is stored.
+    """
+
+    return 'fleetboss:fleet-tokens:%d' % fleet_id
+
+
+def fetch(fleet_id, preferred, members=(), priority=crest.INTERACTIVE):
+    """
+    Builds a fleet with the token of one of the preferred characters or of one
+    of the given members, who are FleetMember objects. Tokens known to work are
+    used in turns, tokens of unknown status are probed first, up to the number
+    of probes allowed for the priority, and tokens known not to work are
+    skipped. Returns the fleet and the character whose token was used, or
+    raises a CrestError if no token works. All calls are made with the given
+    priority.
+    """
+
+    candidates = [c for c in preferred if c is not None]
+    seen = set(c.pk for c in candidates)
+    ids = [str(m.id) for m in members]
+
+    if ids:
+        for character in Character.objects.filter(
+                social_auth__provider='eveonline', social_auth__uid__in=ids):
+            if character.pk not in seen:
+                seen.add(character.pk)
+                candidates.append(character)
+
+    memo = _memo(fleet_id)
+    valid = [c for c in candidates if memo.get(c.pk) is True]
+    unknown = [c for c in candidates if memo.get(c.pk) is None][:PROBES[priority]]
+
+    if valid and unknown:
+        # Grow the pool by a single probe per fetch, so that the load is spread
+        # over more tokens without delaying any fetch by much.
+        character = unknown.pop(0)
+
+        if probe(fleet_id, character, priority):
+            valid.append(character)
+
+    if valid:
+        turn = _turn(fleet_id) % len(valid)
+        valid = valid[turn:] + valid[:turn]
+
+    for character in valid + unknown:
+        if character in unknown and not probe(fleet_id, character, priority):
+            continue
+
+        try:
+            fleet = Fleet(fleet_id, character, priority=priority)
+        except Exception as e:
+            logger.warning("Could not read fleet %d with the token of %s: %s",
+                           fleet_id, character, e)
+            _judge(fleet_id, character, e)
+            continue
+
+        mark(fleet_id, character, True)
+        return fleet, character
+
+    raise crest.CrestError("No token is valid for the requested fleet.")
+
+
+def probe(fleet_id, character, priority=crest.INTERACTIVE):
+    """
+    Checks with a single call to the fleet overview whether the token of a
+    character can read a fleet, and remembers the answer.
+    """
+
+    try:
+        result = crest.get('fleets/%d/' % fleet_id, character.access_token,
+                           priority=priority)
+    except Exception as e:
+        logger.warning("Could not probe fleet %d with the token of %s: %s",
+                       fleet_id, character, e)
+        _judge(fleet_id, character, e)
+        return False
+
+    if result.status_code in (200,) + REJECTED:
+        mark(fleet_id, character, result.status_code == 200)
+    else:
+        logger.warning("Probing fleet %d with the token of %s returned %d.",
+                       fleet_id, character, result.status_code)
+
+    return result.status_code == 200
+
+
+def mark(fleet_id, character, valid):
+    """
+    Remembers whether the token of a character works for a fleet.
+    """
+
+    memo = cache.get(key(fleet_id)) or {}
+    memo[character.pk] = (valid, time.time() + (VALID_TTL if valid else INVALID_TTL))
+    cache.set(key(fleet_id), memo, max(VALID_TTL, INVALID_TTL))
+
+
+def _judge(fleet_id, character, error):
+    """
+    Marks a token as invalid if the error says it was rejected, but not if the
+    API merely failed to answer, since the token may well work later on.
+    """
+
+    if isinstance(error, crest.CrestError):
+        response = error.response
+
+        if response is None or response.status_code not in REJECTED:
+            return
+
+    mark(fleet_id, character, False)
+
+
+def _memo(fleet_id):
+    now = time.time()
+    memo = cache.get(key(fleet_id)) or {}
+    return dict((pk, valid) for pk, (valid, until) in memo.items() if until > now)
+
+
+def _turn(fleet_id):
+    turn = key(fleet_id) + ':turn'
+    cache.add(turn, 0, None)
+
+    try:
+        return cache.incr(turn)
+    except ValueError:
+        return 0
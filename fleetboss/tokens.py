@@ -0,0 +1,193 @@
+"""
+Access tokens of characters. Tokens are cached in this process as well as in
+the shared cache, so that most requests never have to look them up in the
+database, and they are refreshed in the background shortly before they expire.
+A process keeps a limited number of tokens, dropping expired ones first.
+
+Only a single refresh of the token of a character runs at any time: a lock in
+this process keeps out other threads and a lock in the shared cache keeps out
+other processes, which wait for the refreshed token instead.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db import connection
+from social.apps.django_app.utils import load_strategy
+from social.apps.django_app.default.models import UserSocialAuth
+from fleetboss import settings, metrics
+
+
+EXPIRY_FORMAT = "%Y-%m-%dT%H:%M:%S"
+REFRESH_MARGIN = getattr(settings, 'TOKEN_REFRESH_MARGIN', 120)
+LOCAL_TOKENS = getattr(settings, 'TOKEN_LOCAL_CACHE_SIZE', 1000)
+MINIMUM_LIFETIME = 10
+LOCK_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'TOKEN_REFRESH_WORKERS', 2))
+
+_tokens = {}
+_locks = {}
+_locks_lock = threading.Lock()
+_scheduled = set()
+
+logger = logging.getLogger(__name__)
+
+
+def key(user_id):
+    """
+    Returns the cache key under which the token of a character is stored.
+    """
+
+    return 'fleetboss:token:%d' % user_id
+
+
+def get(user):
+    """
+    Returns the CREST data of a character, which includes its EVE ID and a
+    valid access token. A token which is about to expire is refreshed in the
+    background, while one which has expired is refreshed right away.
+    """
+
+    token, found = _tokens.get(user.pk), 'local'
+
+    if token is None:
+        token, found = cache.get(key(user.pk)), 'shared'
+
+    if token is None:
+        token, found = _load(user.pk), 'miss'
+
+    metrics.inc('fleetboss_cache_lookups_total', cache='token', result=found)
+
+    remaining = token['expires'] - time.time()
+
+    if remaining < MINIMUM_LIFETIME:
+        token = refresh(user.pk)
+    elif remaining < REFRESH_MARGIN:
+        _schedule(user.pk)
+
+    return token
+
+
+def refresh(user_id):
+    """
+    Refreshes the token of a character unless another thread or process did so
+    while we were waiting for the lock, and returns the new token.
+    """
+
+    with _lock(user_id):
+        lock = key(user_id) + ':lock'
+
+        while not cache.add(lock, 1, LOCK_TIMEOUT):
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            token = cache.get(key(user_id)) or _load(user_id)
+
+            if token['expires'] - time.time() >= REFRESH_MARGIN:
+                _store(user_id, token)
+                return token
+
+            provider = _provider(user_id)
+            start = time.time()
+
+            try:
+                provider.refresh_token(load_strategy())
+            except Exception:
+                metrics.inc('fleetboss_token_refreshes_total', outcome='error')
+                raise
+
+            metrics.inc('fleetboss_token_refreshes_total', outcome='ok')
+            metrics.observe('fleetboss_token_refresh_seconds', time.time() - start)
+
+            # The response of the refresh, including the real lifetime of the
+            # new token, is merged into the extra data of the provider.
+            lifetime = int(provider.extra_data.get('expires_in', 1200))
+            expiry = datetime.now() + timedelta(seconds=lifetime)
+            provider.extra_data['expires'] = expiry.strftime(EXPIRY_FORMAT)
+            provider.save()
+
+            token = _token(provider)
+            _store(user_id, token)
+            return token
+        finally:
+            cache.delete(lock)
+
+
+def _schedule(user_id):
+    """
+    Refreshes the token of a character in the background, unless a refresh of
+    that token has already been scheduled by this process.
+    """
+
+    with _locks_lock:
+        if user_id in _scheduled:
+            return
+
+        _scheduled.add(user_id)
+
+    def run():
+        try:
+            refresh(user_id)
+        except Exception:
+            logger.exception("Could not refresh the token of character %d.", user_id)
+        finally:
+            with _locks_lock:
+                _scheduled.discard(user_id)
+
+            connection.close()
+
+    executor.submit(run)
+
+
+def _lock(user_id):
+    with _locks_lock:
+        return _locks.setdefault(user_id, threading.Lock())
+
+
+def _provider(user_id):
+    return UserSocialAuth.objects.get(user_id=user_id, provider='eveonline')
+
+
+def _token(provider):
+    expiry = datetime.strptime(provider.extra_data['expires'], EXPIRY_FORMAT)
+
+    return {
+        'id': provider.extra_data['id'],
+        'access_token': provider.extra_data['access_token'],
+        'expires': time.mktime(expiry.timetuple()),
+    }
+
+
+def _load(user_id):
+    token = _token(_provider(user_id))
+    _store(user_id, token)
+    return token
+
+
+def _store(user_id, token):
+    if user_id not in _tokens and len(_tokens) >= LOCAL_TOKENS:
+        _evict()
+
+    _tokens[user_id] = token
+    cache.set(key(user_id), token, max(1, int(token['expires'] - time.time())))
+
+
+def _evict():
+    """
+    Makes room among the tokens cached in this process by dropping the expired
+    ones, or the oldest half of them if none has expired. Dropped tokens are
+    still found in the shared cache.
+    """
+
+    now = time.time()
+    stored = list(_tokens.items())
+    expired = [k for k, token in stored if token['expires'] <= now]
+
+    for k in expired or [k for k, _ in stored[:len(stored) // 2]]:
+        _tokens.pop(k, None)
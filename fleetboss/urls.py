@@ -6,7 +6,14 @@ from . import views
 
 fleetpatterns = [
     url(r'^settings/$', views.fleet_settings),
+    url(r'^layouts/$', views.fleet_layouts, name='fleet_layouts'),
+    url(r'^restructure/$', views.fleet_restructure, name='fleet_restructure'),
+    url(r'^delta/$', views.delta, name='fleet_delta'),
+    url(r'^api/$', views.api, name='fleet_api'),
+    url(r'^history/$', views.fleet_history, name='fleet_history'),
+    url(r'^stream/$', views.stream, name='fleet_stream'),
     url(r'^join/(?P<key>[A-Za-z0-9]{24})/$', views.join, name='join_fleet'),
+    url(r'^invites/$', views.invite_status, name='fleet_invites'),
     url(r'^$', views.fleet),
 ]
 
@@ -15,6 +22,12 @@ urlpatterns = [
     url(r'^admin/', include(admin.site.urls)),
     url(r'^logout/', auth_views.logout, {'next_page': '/'}, name='logout'),
     url(r'^fleet/$', views.parse_url),
+    url(r'^coalition/$', views.coalition, name='coalition'),
+    url(r'^coalition/api/$', views.coalition_api, name='coalition_api'),
+    url(r'^participation/$', views.participation_report, name='participation'),
+    url(r'^metrics$', views.metrics_export, name='metrics'),
+    url(r'^profiles/(?P<profile_id>\d+)/(?P<kind>pstats|stacks|timeline)/$',
+        views.profile_download, name='profile_download'),
     url(r'^fleet/(?P<fleet_id>\d+)/', include(fleetpatterns)),
     url(r'^', include('social.apps.django_app.urls', namespace='social')),
     url(r'^$', views.home),
@@ -1,48 +1,94 @@
 import re
+import json
+import time
+import logging
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from django.db import connection
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
+from django.utils.safestring import mark_safe
+from django.utils.html import escape
 from django.contrib.auth.decorators import login_required
-from fleetboss.models import Fleet, FleetAccess
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from fleetboss.models import Character, Fleet, FleetAccess, FleetMember, FleetSnapshot, FleetLayout, RequestProfile
+from fleetboss import settings, crest, snapshots, tokenpool, invites, restructure, history, participation, metrics, querybudget
+from fleetboss.delta import Delta
+from fleetboss.stats import FleetStats, BREAKDOWNS
 from social.apps.django_app.default.models import UserSocialAuth
-import requests
+
+
+logger = logging.getLogger(__name__)
 
 
 def home(request):
     return render(request, 'fleetboss/home.html')
 
 
+def has_access(request, obj, member_names):
+    """
+    Returns true if the user may view the fleet, either because they were given
+    access explicitly or because they are a member of a shared fleet.
+    """
+
+    if obj.owner_id == request.user.pk:
+        return True
+
+    # Members of a shared fleet are checked first, as that needs no query.
+    if obj.fleet_access and request.user.get_full_name() in member_names:
+        return True
+
+    return obj.access.filter(pk=request.user.pk).exists()
+
+
+def save_changed(obj, **values):
+    """
+    Sets the given fields of a model instance and saves only those which
+    changed, or nothing at all if none did.
+    """
+
+    changed = [name for name, value in values.items() if getattr(obj, name) != value]
+
+    for name in changed:
+        setattr(obj, name, values[name])
+
+    if changed:
+        obj.save(update_fields=changed)
+
+
+@querybudget.budget(7)
 @login_required
 @require_POST
 @csrf_exempt
 def fleet_settings(request, fleet_id):
     obj = get_object_or_404(FleetAccess, id=fleet_id, owner=request.user)
-    print(request.POST)
+
     if 'allow_fleet' in request.POST:
-        obj.fleet_access = request.POST['allow_fleet'] == 'true'
-        obj.save()
+        save_changed(obj, fleet_access=request.POST['allow_fleet'] == 'true')
         return HttpResponse(status=200)
 
     if 'add_viewer' in request.POST:
-        user = get_object_or_404(UserSocialAuth, uid=request.POST['add_viewer']).user
+        user = get_object_or_404(Character, social_auth__uid=request.POST['add_viewer'])
         obj.access.add(user)
         return HttpResponse(user.get_full_name(), status=200)
 
     if 'link_join' in request.POST:
-        obj.link_join = request.POST['link_join'] == 'true'
-        obj.save()
+        save_changed(obj, link_join=request.POST['link_join'] == 'true')
         return HttpResponse(status=200)
 
     if 'remove_viewer' in request.POST:
-        user = get_object_or_404(UserSocialAuth, uid=request.POST['remove_viewer']).user
+        user = get_object_or_404(Character, social_auth__uid=request.POST['remove_viewer'])
         obj.access.remove(user)
         return HttpResponse(status=200)
 
     return HttpResponse(status=404)
 
 
+@querybudget.budget(7)
 @login_required
 def join(request, fleet_id, key):
     fleet_id = int(fleet_id)
@@ -52,66 +98,567 @@ def join(request, fleet_id, key):
         messages.error(request, "The given key was not valid for the fleet.")
         return redirect(home)
 
-    result = requests.post(
-        'https://crest-tq.eveonline.com/fleets/%d/members/' % fleet_id,
-        headers={
-            'Authorization': 'Bearer ' + obj.owner.access_token,
-            'Content-Type': 'application/json'
-        },
-        json={
-            "character": {
-                "href": "https://crest-tq.eveonline.com/characters/%d/" %
-                request.user.character_id
-            },
-            "role": "squadMember"
-        }
-    )
-
-    print(result.status_code)
-
-    if result.status_code != 201:
-        if result.json()['key'] == 'FleetCandidateOffline':
-            messages.error(request, "You should log in first, dummy.")
+    # The invite is sent by the dispatcher, the page polls for the outcome.
+    invite = invites.enqueue(obj, request.user)
+
+    return render(request, 'fleetboss/join.html', {
+        'fleet_id': fleet_id,
+        'invite': script_json(invite.as_json()),
+    })
+
+
+@querybudget.budget(5)
+@login_required
+def invite_status(request, fleet_id):
+    """
+    Reports the status of the invites into a fleet. The boss and the viewers
+    of the fleet see all of them, anyone else only sees their own.
+    """
+
+    obj = get_object_or_404(FleetAccess, id=int(fleet_id))
+    found = obj.invites.select_related('character').order_by('-updated')
+
+    if obj.owner_id != request.user.pk and not obj.access.filter(pk=request.user.pk).exists():
+        found = found.filter(character=request.user)
+
+    return JsonResponse({'invites': [i.as_json() for i in found]})
+
+
+@querybudget.budget(12)
+@login_required
+def fleet_layouts(request, fleet_id):
+    """
+    Lists the saved layouts of the user, after saving one if asked to. A layout
+    may be given as JSON, otherwise the current structure of the fleet is
+    saved under the given name.
+    """
+
+    if request.method == 'POST':
+        name = request.POST.get('name', '').strip()
+
+        if not name:
+            return JsonResponse({'error': "A layout needs a name."}, status=400)
+
+        if 'layout' in request.POST:
+            try:
+                layout = json.loads(request.POST['layout'])
+                restructure.validate(layout)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
         else:
-            messages.error(request, "An invite could not be sent to %s." % request.user.get_full_name())
-    else:
-        messages.success(request, "An invite was successfully sent to %s." % request.user.get_full_name())
+            obj, fleet, error = load_fleet(request, int(fleet_id))
 
-    return redirect(home)
+            if error is not None:
+                return JsonResponse({'error': error}, status=403)
 
+            layout = restructure.layout_of(fleet)
 
+        FleetLayout.objects.update_or_create(
+            owner=request.user, name=name, defaults={'data': json.dumps(layout)})
+
+    return JsonResponse({'layouts': [
+        {'id': l.id, 'name': l.name, 'layout': l.layout}
+        for l in request.user.layouts.order_by('name')
+    ]})
+
+
+@querybudget.budget(8)
 @login_required
-def fleet(request, fleet_id):
+@require_POST
+def fleet_restructure(request, fleet_id):
+    """
+    Plans the operations which turn the fleet into one of the layouts of the
+    boss, and performs them if asked to. The plan is made against the fleet as
+    it is on CREST right now rather than a snapshot.
+    """
+
+    fleet_id = int(fleet_id)
+    # Only the boss may restructure the fleet, so the user is its owner.
+    get_object_or_404(FleetAccess, id=fleet_id, owner=request.user)
+    layout_id = request.POST.get('layout', '')
+
+    if not layout_id.isdigit():
+        return JsonResponse({'error': "No layout was given."}, status=400)
+
+    layout = get_object_or_404(FleetLayout, id=int(layout_id), owner=request.user)
+
+    try:
+        operations = restructure.plan(Fleet(fleet_id, request.user), layout.layout)
+    except crest.CrestError:
+        return JsonResponse({'error': "The fleet could not be read from CREST."}, status=502)
+    except restructure.LayoutError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if request.POST.get('apply') != 'true':
+        return JsonResponse({'operations': [op.as_json() for op in operations]})
+
+    elapsed = restructure.execute(fleet_id, request.user.access_token, operations)
+
+    # Let viewers see the new structure right away instead of after the
+    # snapshot expires.
+    try:
+        fleet = Fleet(fleet_id, request.user)
+        snapshots.put(fleet_id, FleetSnapshot.record(fleet_id, fleet.snapshot))
+    except crest.CrestError:
+        pass
+
+    return JsonResponse({
+        'operations': [op.as_json() for op in operations],
+        'elapsed': round(elapsed, 2),
+    })
+
+
+def fetch_snapshot(obj, candidates):
+    """
+    Returns a fresh snapshot of a fleet, either the latest one stored by the
+    fleet poller or one fetched from CREST. The candidate characters are tried
+    first, but the load is spread over the tokens of fleet members as well. If
+    one of the candidates had to be used, the access settings are saved with
+    that character as the new owner.
+    """
+
+    last = None if obj._state.adding else FleetSnapshot.latest(obj.id)
+    max_age = timedelta(seconds=getattr(settings, 'FLEET_POLL_MAX_AGE', 30))
+
+    if last is not None and datetime.now() - last.created <= max_age:
+        return last.snapshot
+
+    members = Fleet(obj.id, snapshot=last.snapshot).members if last else ()
+    fleet, character = tokenpool.fetch(obj.id, candidates, members)
+
+    if obj._state.adding:
+        # Saved as viewed, so that the view does not have to update it again.
+        obj.owner, obj.last_viewed = character, datetime.now()
+        obj.save(force_insert=True)
+    elif character in candidates and character != obj.owner:
+        obj.owner = character
+        obj.save(update_fields=['owner'])
+
+    history.record(obj.id, fleet)
+    return FleetSnapshot.record(obj.id, fleet.snapshot, last)
+
+
+def load_fleet(request, fleet_id):
+    """
+    Looks up the access settings of a fleet and builds the fleet from its
+    shared snapshot. Returns the settings, the fleet and an error message which
+    is None if the user is allowed to view the fleet.
+    """
+
     explicit = False
 
     try:
-        obj = FleetAccess.objects.get(id=fleet_id)
-        explicit = request.user == obj.owner or obj.access.filter(pk=request.user.pk).exists()
+        # The owner is needed for the snapshot and to tell the boss apart.
+        obj = FleetAccess.objects.select_related('owner').get(id=fleet_id)
+        explicit = obj.owner_id == request.user.pk
+
         if not obj.fleet_access and not explicit:
-            messages.error(request, "You do not have access to the requested fleet.")
-            return redirect(home)
+            if not obj.access.filter(pk=request.user.pk).exists():
+                return obj, None, "You do not have access to the requested fleet."
+
+            explicit = True
     except FleetAccess.DoesNotExist:
         obj = FleetAccess(id=fleet_id, owner=request.user)
 
-    for attempt in {obj.owner, request.user}:
-        try:
-            fleet = Fleet(int(fleet_id), attempt)
-            obj.owner = attempt
-            obj.save()
-            break
-        except:
-            pass
-    else:
-        messages.error(request, "API key was not valid for the requested fleet.")
-        return redirect(home)
+    def fetch():
+        return fetch_snapshot(obj, [obj.owner, request.user])
+
+    try:
+        snapshot = snapshots.get(fleet_id, fetch)
+    except crest.CrestError:
+        # Rather show the last known state of the fleet than nothing at all.
+        last = None if obj._state.adding else FleetSnapshot.latest(fleet_id)
 
-    if not explicit and request.user.get_full_name() not in fleet.member_names:
-        messages.error(request, "You do not have access to the requested fleet.")
+        if last is None:
+            return obj, None, "API key was not valid for the requested fleet."
+
+        snapshot = dict(last.snapshot, stale=True)
+
+    fleet = Fleet(fleet_id, obj.owner, snapshot=snapshot)
+
+    now = datetime.now()
+
+    if obj._state.adding:
+        obj.last_viewed = now
+        obj.save()
+    elif obj.last_viewed is None or now - obj.last_viewed > timedelta(seconds=60):
+        # Lets the fleet poller know that somebody is still looking at it.
+        FleetAccess.objects.filter(pk=obj.pk).update(last_viewed=now)
+
+    if not explicit and not has_access(request, obj, fleet.member_names):
+        return obj, None, "You do not have access to the requested fleet."
+
+    return obj, fleet, None
+
+
+def script_json(data):
+    """
+    Serializes data as JSON which can safely be placed inside a script tag.
+    """
+
+    return mark_safe(json.dumps(data).replace('<', '\\u003c').replace(
+        '>', '\\u003e').replace('&', '\\u0026'))
+
+
+@querybudget.budget(8)
+@login_required
+def fleet(request, fleet_id):
+    obj, fleet, error = load_fleet(request, int(fleet_id))
+
+    if error is not None:
+        messages.error(request, error)
         return redirect(home)
 
-    return render(
-        request, 'fleetboss/fleet.html',
-        {'fleet': fleet, 'token': obj, 'owner': obj.owner == request.user})
+    # The EVE IDs of the viewers are read along with them, rather than through
+    # the token of each of them.
+    viewers = UserSocialAuth.objects.filter(
+        user__fleets_accessible=obj, provider='eveonline').select_related('user')
+
+    context = {'fleet': fleet, 'token': obj, 'owner': obj.owner_id == request.user.pk,
+               'viewers': viewers,
+               'data': script_json(fleet.as_json()),
+               'refresh': getattr(settings, 'FLEET_REFRESH_INTERVAL', 10)}
+
+    with metrics.timer('fleetboss_template_render_seconds', template='fleet.html'):
+        return render(request, 'fleetboss/fleet.html', context)
+
+
+@querybudget.budget(7)
+@login_required
+def api(request, fleet_id):
+    obj, fleet, error = load_fleet(request, int(fleet_id))
+
+    if error is not None:
+        return JsonResponse({'error': error}, status=403)
+
+    # Clients which are up to date only need to hear that nothing changed.
+    if request.GET.get('since') == str(fleet.version):
+        return JsonResponse({'version': fleet.version, 'stale': fleet.stale})
+
+    return JsonResponse(fleet.as_json())
+
+
+@querybudget.budget(7)
+@login_required
+def stream(request, fleet_id):
+    """
+    Sends the fleet as server-sent events whenever it changes, within a
+    FLEET_STREAM_INTERVAL of the poller publishing a new version. A stream
+    ends after FLEET_STREAM_DURATION seconds, as it holds a worker all along,
+    and the browser then reconnects with the version it saw last.
+    """
+
+    obj, fleet, error = load_fleet(request, int(fleet_id))
+
+    if error is not None:
+        return JsonResponse({'error': error}, status=403)
+
+    interval = getattr(settings, 'FLEET_STREAM_INTERVAL', 0.5)
+    duration = getattr(settings, 'FLEET_STREAM_DURATION', 30)
+
+    def fetch():
+        return fetch_snapshot(obj, [obj.owner, request.user])
+
+    def events():
+        # Browsers reconnect with the last version they saw, so a client is
+        # only sent the fleet if it changed since the page or the last event.
+        version = request.META.get('HTTP_LAST_EVENT_ID', request.GET.get('since'))
+        current = fleet
+        end = time.time() + duration
+        idle = 0
+
+        yield 'retry: 1000\n\n'
+
+        while time.time() < end:
+            if str(current.version) != version:
+                if not has_access(request, obj, current.member_names):
+                    yield 'event: denied\ndata: {}\n\n'
+                    return
+
+                version = str(current.version)
+                idle = 0
+                yield 'id: %s\nevent: fleet\ndata: %s\n\n' % (
+                    version, json.dumps(current.as_json()))
+            elif idle >= 15:
+                idle = 0
+                yield ': keep-alive\n\n'
+
+            time.sleep(interval)
+            idle += interval
+
+            # The fleet poller publishes the version of every snapshot it
+            # takes, so while it keeps the fleet fresh a stream merely watches
+            # that version and only reads the snapshot once it changed.
+            published = snapshots.published(obj.id)
+
+            if published is not None and str(published) == version:
+                continue
+
+            # Otherwise every stream of this fleet reads the same shared
+            # snapshot, so there is only a single upstream fetch no matter how
+            # many browsers are connected.
+            try:
+                snapshot = snapshots.get(obj.id, fetch)
+            except crest.CrestError:
+                continue
+
+            if str(snapshot.get('version')) != version:
+                current = Fleet(obj.id, snapshot=snapshot)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@querybudget.budget(9)
+@login_required
+def fleet_history(request, fleet_id):
+    """
+    Returns a series of one of the breakdowns of the fleet over a time range,
+    given in UNIX time and defaulting to the last few hours.
+    """
+
+    obj, fleet, error = load_fleet(request, int(fleet_id))
+
+    if error is not None:
+        return JsonResponse({'error': error}, status=403)
+
+    try:
+        end = float(request.GET.get('end', time.time()))
+        start = float(request.GET.get('start', end - 3 * 3600))
+        keys, points = history.series(
+            obj.id, request.GET.get('breakdown', 'composition_category'),
+            datetime.fromtimestamp(start), datetime.fromtimestamp(end))
+    except (KeyError, ValueError):
+        return JsonResponse({'error': "Invalid breakdown or time range."}, status=400)
+
+    return JsonResponse({
+        'keys': keys,
+        'points': [[t.isoformat() + 'Z', counts] for t, counts in points],
+    })
+
+
+@querybudget.budget(6)
+@login_required
+def delta(request, fleet_id):
+    fleet_id = int(fleet_id)
+
+    try:
+        since = int(request.GET['since'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'No valid version was given.'}, status=400)
+
+    obj = get_object_or_404(FleetAccess, id=fleet_id)
+    latest = FleetSnapshot.latest(fleet_id)
+
+    if latest is None:
+        return JsonResponse({'error': 'The fleet has no snapshots.'}, status=404)
+
+    try:
+        old = FleetSnapshot.objects.get(id=since, fleet_id=fleet_id)
+    except FleetSnapshot.DoesNotExist:
+        old = None
+
+    members = [FleetMember(*row) for row in latest.snapshot['members']]
+
+    if old is None or latest.id == since:
+        stats = snapshots.get_stats(fleet_id, latest.id)
+
+        if stats is None:
+            stats = FleetStats(members)
+            snapshots.put_stats(fleet_id, latest.id, stats)
+
+        if not has_access(request, obj, stats.member_names):
+            return JsonResponse({'error': 'You do not have access to the requested fleet.'}, status=403)
+
+        # A version we no longer know about means the client has to reload.
+        return JsonResponse({'version': latest.id, 'reset': old is None})
+
+    # Only the old members are counted, if they are not cached already, and
+    # brought up to date by the delta.
+    old = [FleetMember(*row) for row in old.snapshot['members']]
+    stats = snapshots.get_stats(fleet_id, since) or FleetStats(old)
+    changes = Delta(old, members)
+    counts = changes.apply(stats)
+    snapshots.put_stats(fleet_id, latest.id, stats)
+
+    if not has_access(request, obj, stats.member_names):
+        return JsonResponse({'error': 'You do not have access to the requested fleet.'}, status=403)
+
+    res = changes.as_json()
+    res['version'] = latest.id
+    res['counts'] = counts
+    return JsonResponse(res)
+
+
+coalition_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'COALITION_WORKERS', 10))
+
+
+def coalition_fleets(request):
+    """
+    Returns the IDs of the fleets in the coalition view, either those given in
+    the request or all recently viewed fleets which the user owns or was
+    given access to.
+    """
+
+    limit = getattr(settings, 'COALITION_MAX_FLEETS', 20)
+    ids = re.findall(r'\d+', request.GET.get('fleets', ''))
+
+    if ids:
+        return sorted(set(int(i) for i in ids))[:limit]
+
+    since = datetime.now() - timedelta(
+        seconds=getattr(settings, 'FLEET_POLL_ACTIVE', 600))
+    owned = FleetAccess.objects.filter(owner=request.user, last_viewed__gte=since)
+    shared = request.user.fleets_accessible.filter(last_viewed__gte=since)
+
+    return sorted(set(owned.values_list('id', flat=True)) |
+                  set(shared.values_list('id', flat=True)))[:limit]
+
+
+def load_coalition(request, fleet_ids):
+    """
+    Loads several fleets at once and sums them up into a single summary. Each
+    fleet gets until the timeout to load, fleets which take longer or fail are
+    left out of the summary and reported as such, so a single slow fleet does
+    not hold up the others. Slow fleets keep loading in the background, which
+    means they are usually in the shared cache on the next refresh.
+    """
+
+    def load(fleet_id):
+        try:
+            return load_fleet(request, fleet_id)
+        finally:
+            connection.close()
+
+    timeout = getattr(settings, 'COALITION_FLEET_TIMEOUT', 5)
+    futures = [(i, coalition_executor.submit(load, i)) for i in fleet_ids]
+    end = time.time() + timeout
+    stats = FleetStats()
+    fleets = []
+    warnings = []
+
+    for fleet_id, future in futures:
+        summary = {'id': fleet_id, 'boss': None, 'member_count': 0,
+                   'stale': False, 'error': None}
+        fleets.append(summary)
+
+        try:
+            _, fleet, error = future.result(timeout=max(0, end - time.time()))
+        except TimeoutError:
+            summary['error'] = "The fleet took too long to load."
+            continue
+        except Exception:
+            logger.exception("Could not load fleet %d for the coalition view.", fleet_id)
+            summary['error'] = "The fleet could not be loaded."
+            continue
+
+        if error is not None:
+            summary['error'] = error
+            continue
+
+        summary.update(boss=fleet.boss, member_count=fleet.member_count,
+                       stale=fleet.stale)
+        stats.merge(fleet.stats)
+        warnings.extend(
+            (level, '%s\'s fleet: %s' % (escape(fleet.boss or fleet_id), text))
+            for level, text in fleet.warnings)
+
+    return {
+        'fleets': fleets,
+        'member_count': stats.member_count,
+        'breakdowns': dict(
+            (name, sorted(stats[name].items(), key=lambda x: (-x[1], x[0])))
+            for name, _ in BREAKDOWNS),
+        'warnings': warnings,
+    }
+
+
+@login_required
+def coalition(request):
+    fleet_ids = coalition_fleets(request)
+
+    return render(request, 'fleetboss/coalition.html', {
+        'fleets': ','.join(str(i) for i in fleet_ids),
+        'data': script_json(load_coalition(request, fleet_ids)),
+        'refresh': getattr(settings, 'FLEET_REFRESH_INTERVAL', 10),
+    })
+
+
+@login_required
+def coalition_api(request):
+    return JsonResponse(load_coalition(request, coalition_fleets(request)))
+
+
+@login_required
+def participation_report(request):
+    """
+    Shows how much time pilots spent in the fleets visible to the user over a
+    range of days, the last month by default, a page of pilots at a time.
+    """
+
+    try:
+        end = datetime.strptime(request.GET['end'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        end = date.today()
+
+    try:
+        start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        start = end - timedelta(days=30)
+
+    fleets = participation.visible_fleets(request.user)
+    paginator = Paginator(participation.totals(start, end, fleets), participation.PAGE_SIZE)
+
+    try:
+        page = paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        page = paginator.page(1)
+    except EmptyPage:
+        page = paginator.page(paginator.num_pages)
+
+    return render(request, 'fleetboss/participation.html', {
+        'rows': participation.describe(start, end, fleets, page.object_list),
+        'page': page,
+        'start': start,
+        'end': end,
+    })
+
+
+def metrics_export(request):
+    """
+    Exports the metrics of all processes in the Prometheus text format, to
+    staff and to the addresses allowed to scrape them.
+    """
+
+    allowed = getattr(settings, 'METRICS_ALLOWED_ADDRESSES', ('127.0.0.1', '::1'))
+
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponse(status=403)
+
+    return HttpResponse(metrics.export(), content_type='text/plain; version=0.0.4')
+
+
+@staff_member_required
+def profile_download(request, profile_id, kind):
+    """
+    Downloads a part of a request profile: the cProfile statistics, the stack
+    samples for flame graphs or the timeline of queries and CREST calls.
+    """
+
+    profile = get_object_or_404(RequestProfile, id=int(profile_id))
+    content, content_type, extension = {
+        'pstats': (bytes(profile.stats), 'application/octet-stream', 'pstats'),
+        'stacks': (profile.stacks, 'text/plain', 'folded'),
+        'timeline': (profile.timeline, 'application/json', 'json'),
+    }[kind]
+
+    response = HttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="profile-%d.%s"' % (
+        profile.id, extension)
+    return response
 
 
 def parse_url(request):
@@ -119,8 +666,8 @@ def parse_url(request):
         messages.error(request, "The URL you entered was not of the correct format.")
         return redirect(home)
 
-    match = re.match(r'https://crest-tq.eveonline.com/fleets/(\d+)/|(\d+)',
-                     request.GET['url'])
+    match = re.match(r'(?:https://crest-tq.eveonline.com/|%s)fleets/(\d+)/|(\d+)'
+                     % re.escape(crest.BASE_URL), request.GET['url'])
 
     if not match:
         messages.error(request, "The URL you entered was not of the correct format.")